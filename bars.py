@@ -0,0 +1,105 @@
+import numpy as np
+
+class BarStore:
+    """Last capacity days of a few fields for a fixed set of symbols, in preallocated ring buffers.
+    Every row is written twice, capacity rows apart, so the most recent rows are always one contiguous slice
+    and windows are returned as views without copying. Rows are calendar days: bars of different symbols
+    arriving on the same day share a row, and symbols without a bar that day are NaN.
+    """
+    def __init__(self, symbols, fields=("close", "volume"), capacity=252):
+        """
+        :param list symbols: symbols to store, in column order
+        :param tuple[str] fields: fields stored for every symbol
+        :param int capacity: number of days kept, the longest window that can be requested
+        """
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.fields = {field: i for i, field in enumerate(fields)}
+        self.capacity = capacity
+        self.data = np.full((len(self.fields), 2 * capacity, len(self.symbols)), np.nan)
+        self.days = np.full(2 * capacity, np.datetime64("NaT"), dtype="datetime64[D]")
+        # Slot of the latest row, and number of rows written so far up to capacity
+        self.last = -1
+        self.count = 0
+
+    def ready(self, length):
+        """Whether at least length days have been stored."""
+        return self.count >= length
+
+    def update(self, time, **values):
+        """Store one bar per symbol.
+        :param datetime time: bar time, bars on the same calendar day as the latest row are merged into it
+        :param array values: per field, latest value per symbol in column order, NaN where a symbol has no bar
+        """
+        day = np.datetime64(time.date(), "D")
+        if self.count and self.days[self.last] == day:
+            slot = self.last
+            for field, vector in values.items():
+                vector = np.asarray(vector, dtype=float)
+                row = self.data[self.fields[field], slot]
+                np.copyto(row, vector, where=~np.isnan(vector))
+                self.data[self.fields[field], slot + self.capacity] = row
+            return
+        slot = (self.last + 1) % self.capacity
+        self.data[:, slot] = np.nan
+        for field, vector in values.items():
+            self.data[self.fields[field], slot] = vector
+        self.data[:, slot + self.capacity] = self.data[:, slot]
+        self.days[slot] = self.days[slot + self.capacity] = day
+        self.last = slot
+        self.count = min(self.count + 1, self.capacity)
+
+    def update_symbols(self, time, **values):
+        """Store one bar from mappings of symbol to value per field, symbols missing from a mapping get NaN."""
+        vectors = {}
+        for field, by_symbol in values.items():
+            vector = np.full(len(self.symbols), np.nan)
+            for symbol, value in by_symbol.items():
+                if symbol in self.index:
+                    vector[self.index[symbol]] = value
+            vectors[field] = vector
+        self.update(time, **vectors)
+
+    def _rows(self, length):
+        length = min(length, self.count)
+        end = self.last + self.capacity + 1
+        return slice(end - length, end)
+
+    def window(self, field, length, symbols=None):
+        """Latest length days of one field, oldest first.
+        A view into the buffer when symbols is None or a contiguous run of the stored symbols, a copy otherwise.
+        It is only valid until the next update.
+        :param str field: stored field
+        :param int length: number of days, fewer are returned until the store has filled up
+        :param list symbols: columns to return, defaults to every symbol in column order
+        :return array: days x symbols
+        """
+        rows = self.data[self.fields[field], self._rows(length)]
+        if symbols is None:
+            return rows
+        columns = [self.index[symbol] for symbol in symbols]
+        if columns and columns == list(range(columns[0], columns[0] + len(columns))):
+            return rows[:, columns[0]:columns[0] + len(columns)]
+        return rows[:, columns]
+
+    def times(self, length):
+        """Calendar days of the rows returned by window for the same length."""
+        return self.days[self._rows(length)]
+
+    def to_arrays(self, prefix=""):
+        """Arrays restore reloads the store from, with names starting with prefix. Only one copy of each row is saved."""
+        return {
+            prefix + "symbols": np.array(self.symbols, dtype=str),
+            prefix + "data": self.data[:, :self.capacity],
+            prefix + "days": self.days[:self.capacity],
+            prefix + "position": np.array([self.last, self.count]),
+        }
+
+    def restore(self, arrays, prefix=""):
+        """Load state saved by to_arrays, False and unchanged if it was saved from a store of other symbols, fields or capacity."""
+        if arrays[prefix + "symbols"].tolist() != list(map(str, self.symbols)) or arrays[prefix + "data"].shape != self.data[:, :self.capacity].shape:
+            return False
+        self.data[:, :self.capacity] = self.data[:, self.capacity:] = arrays[prefix + "data"]
+        self.days[:self.capacity] = self.days[self.capacity:] = arrays[prefix + "days"]
+        self.last, self.count = (int(value) for value in arrays[prefix + "position"])
+        return True
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Make the algorithm modules importable from benchmark scripts, with the offline stand-in for AlgorithmImports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import offline
+offline.install()
@@ -0,0 +1,91 @@
+"""Scaling benchmark for rebalance.calculate_factors against the original per-pair loop.
+
+Run from the repository root:
+    python benchmarks/bench_factors.py --sizes 5 50 100 500 --legacy-max 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks import synthetic
+import rebalance
+
+def legacy_factors(historical_data, portfolio):
+    """Original calculate_factors: resamples and correlates every pair of symbols separately."""
+    risks = {}
+    mean_returns = {}
+    diversification = {}
+    for symbol in portfolio:
+        prices = historical_data.loc[symbol]['close'].resample('D').last()
+        returns = np.diff(prices) / prices[:-1]
+        risks[symbol] = np.std(returns)
+        mean_returns[symbol] = np.mean(returns)
+        correlations = []
+        for compare_symbol in portfolio:
+            if symbol != compare_symbol:
+                compare_prices = historical_data.loc[compare_symbol]['close'].resample('D').last()
+                compare_returns = np.diff(compare_prices) / compare_prices[:-1]
+                if len(returns) > len(compare_returns):
+                    returns = returns[:len(compare_returns)]
+                elif len(compare_returns) > len(returns):
+                    compare_returns = compare_returns[:len(returns)]
+                correlations.append(np.corrcoef(returns, compare_returns)[0][1])
+        diversification[symbol] = 1 - np.mean(correlations)
+    return risks, mean_returns, diversification
+
+def check(historical_data, portfolio):
+    """Check the correlation engine against pairwise np.corrcoef on the same aligned returns."""
+    returns = rebalance.returns_matrix(historical_data, list(portfolio)).to_numpy()
+    risks, mean_returns, diversification = rebalance.calculate_factors(historical_data, portfolio)
+    expected = [1 - np.mean([np.corrcoef(returns[:, i], returns[:, j])[0][1] for j in range(returns.shape[1]) if j != i])
+                for i in range(returns.shape[1])]
+    np.testing.assert_allclose(diversification.to_numpy(), expected, rtol=1e-9)
+    np.testing.assert_allclose(risks.to_numpy(), returns.std(axis=0), rtol=1e-9)
+    np.testing.assert_allclose(mean_returns.to_numpy(), returns.mean(axis=0), rtol=1e-9)
+
+def check_staggered(symbols, days):
+    """Check that bars ending at different times of the same day share a row, as equity and index bars must."""
+    aligned = rebalance.price_matrix(synthetic.history_frame(symbols, days), symbols)
+    historical_data = synthetic.history_frame(symbols, days, bar_hours=[16, 17])
+    index = historical_data.index.copy()
+    staggered = rebalance.price_matrix(historical_data, symbols)
+    assert len(staggered) == days, "{} rows for {} days".format(len(staggered), days)
+    np.testing.assert_array_equal(staggered.to_numpy(), aligned.to_numpy())
+    assert historical_data.index.equals(index), "price_matrix modified the History frame"
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 100, 250, 500])
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--legacy-max", type=int, default=50, help="largest universe to time the per-pair loop on")
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>9}".format("symbols", "per-pair", "vectorized", "speedup"))
+    for size in args.sizes:
+        symbols = ["S{}".format(i) for i in range(size)]
+        historical_data = synthetic.history_frame(symbols, args.days)
+        portfolio = dict.fromkeys(symbols, 1 / size)
+        if size <= 50:
+            check(historical_data, portfolio)
+            check_staggered(symbols, args.days)
+        fast = timed(rebalance.calculate_factors, historical_data, portfolio)
+        if size <= args.legacy_max:
+            slow = timed(legacy_factors, historical_data, portfolio, repeat=1)
+            print("{:>8} {:>11.4f}s {:>11.4f}s {:>8.1f}x".format(size, slow, fast, slow / fast))
+        else:
+            print("{:>8} {:>12} {:>11.4f}s {:>9}".format(size, "-", fast, "-"))
+
+if __name__ == "__main__":
+    main()
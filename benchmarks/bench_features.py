@@ -0,0 +1,85 @@
+"""Compare the per-month TrainModel loop with the bulk feature pipeline in features.py.
+
+Run from the repository root:
+    python benchmarks/bench_features.py --years 22 --request-latency 0.05
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import features
+from benchmarks import synthetic
+
+def legacy_features(history, interest, risk_free_rate, months, request_latency=0.0):
+    """Per-month reference implementation mirroring the original TrainModel loop.
+    Every month makes two History round trips and streams SPY closes through a momentum indicator.
+    """
+    spy = history.loc["spy"]["close"]
+    vix = history.loc["vix"]["close"]
+    interest = interest.droplevel(0)["value"]
+    momentum_window = deque(maxlen=features.MOMENTUM_PERIOD + 1)
+    rows = []
+    for month in months:
+        start_date = month.start_time
+        # February has no 30th, so its window is the whole month
+        end_date = min(start_date + features.MONTH_WINDOW, month.end_time)
+        # Two History requests per month
+        time.sleep(request_latency)
+        spy_month = spy[(spy.index >= start_date) & (spy.index <= end_date)]
+        vix_month = vix[(vix.index >= start_date) & (vix.index <= end_date)]
+        time.sleep(request_latency)
+        interest_month = interest[(interest.index >= start_date) & (interest.index <= end_date)]
+
+        market_return = spy_month.pct_change().dropna().mean() * 100
+        market_volatility = spy_month.pct_change().dropna().std() * 100
+        sharpe_ratio = (market_return - risk_free_rate) / market_volatility
+        momentum_list = []
+        for price in spy_month:
+            # Oldest price is the first one seen until the indicator is ready, then the price period bars ago
+            momentum_window.append(price)
+            momentum_list.append(price - momentum_window[0])
+        rows.append([market_return, market_volatility, vix_month.dropna().mean(), sharpe_ratio,
+                     statistics.fmean(momentum_list) if momentum_list else 0, interest_month.dropna().mean()])
+    return pd.DataFrame(rows, index=months, columns=features.FEATURES)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=22)
+    parser.add_argument("--request-latency", type=float, default=0.0, help="simulated seconds per History round trip")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    days = args.years * 261
+    history = pd.concat([synthetic.history_frame(["spy"], days), synthetic.value_frame("vix", days, level=20.0, column="close")])
+    interest = synthetic.value_frame("interest30", days, seed=2)
+    months = pd.period_range("2001-01", periods=args.years * 12, freq="M")
+    risk_free_rate = 0.05
+
+    start = time.perf_counter()
+    expected = legacy_features(history, interest, risk_free_rate, months, args.request_latency)
+    legacy_time = time.perf_counter() - start
+
+    bulk_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        # Two History requests in total
+        time.sleep(2 * args.request_latency)
+        result = features.monthly_features(history.loc["spy"]["close"], history.loc["vix"]["close"], interest["value"], risk_free_rate, months)
+        bulk_times.append(time.perf_counter() - start)
+
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-9, equal_nan=True)
+    bulk_time = min(bulk_times)
+    print("months: {}, history requests: {} -> 2".format(len(months), 2 * len(months)))
+    print("per-month loop: {:.4f}s".format(legacy_time))
+    print("bulk pipeline:  {:.4f}s".format(bulk_time))
+    print("speedup:        {:.1f}x".format(legacy_time / bulk_time))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Microbenchmarks for the numerical hot paths, on synthetic data shaped like History output.
+
+    python benchmarks/suite.py --out baseline.json
+    python benchmarks/suite.py --out current.json --compare baseline.json --threshold 0.25
+
+Each case is timed over several repeats and the median seconds per call is recorded. With --compare, any
+case whose median is slower than the baseline by more than threshold is reported and the exit code is 1.
+Use --filter to run a subset, e.g. --filter strategies, and --quick for a fast smoke run.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks import synthetic
+import bars
+import features
+import regime
+import optimizer
+import rebalance
+import risk
+import strategies
+
+# Parameter grids for each group of cases
+UNIVERSE_SIZES = [5, 50, 500]
+HISTORY_LENGTHS = [14, 30, 252]
+TRAINING_YEARS = [5, 22]
+THRESHOLDS = {'risk_factor': 2.0, 'return_factor': 1.5, 'diversification_factor': 0.5, 'short_window': 7, 'long_window': 14}
+ASSET_CLASSES = ["market", "tech", "gold", "bonds", "treasuries"]
+
+CASES = {}
+
+def case(name, **grid):
+    """Register a benchmark. The decorated function takes one value per grid axis and returns the callable to time."""
+    def decorator(setup):
+        axes = list(grid)
+        for values in itertools.product(*[grid[axis] for axis in axes]):
+            params = dict(zip(axes, values))
+            label = "{}[{}]".format(name, ",".join("{}={}".format(axis, value) for axis, value in params.items()))
+            CASES[label] = (setup, params)
+        return setup
+    return decorator
+
+def _symbols(size):
+    return ["S{}".format(i) for i in range(size)]
+
+def _bar_store(size, days):
+    """BarStore holding days of synthetic closes for size symbols."""
+    store = bars.BarStore(_symbols(size), ("close", "volume"), capacity=max(days, 252))
+    for time, closes in zip(pd.bdate_range("2020-01-01", periods=days), synthetic.price_paths(size, days)):
+        store.update(time, close=closes)
+    return store
+
+def _universe(size):
+    return strategies.Universe(_symbols(size), [ASSET_CLASSES[i % len(ASSET_CLASSES)] for i in range(size)])
+
+@case("rebalance.adjust", symbols=UNIVERSE_SIZES, days=HISTORY_LENGTHS)
+def bench_adjust(symbols, days):
+    historical_data = synthetic.history_frame(_symbols(symbols), days)
+    portfolio = dict.fromkeys(_symbols(symbols), 1 / symbols)
+    return lambda: rebalance.adjust(dict(portfolio), 1, historical_data, 0.05, THRESHOLDS, 100.0)
+
+@case("rebalance.adjust.bars", symbols=UNIVERSE_SIZES, days=HISTORY_LENGTHS)
+def bench_adjust_bars(symbols, days):
+    store = _bar_store(symbols, days)
+    portfolio = dict.fromkeys(_symbols(symbols), 1 / symbols)
+    return lambda: rebalance.adjust(dict(portfolio), 1, pd.DataFrame(store.window("close", days), columns=store.symbols, copy=False), 0.05, THRESHOLDS, 100.0)
+
+@case("optimizer.solve", symbols=UNIVERSE_SIZES, days=HISTORY_LENGTHS, start=["cold", "warm"])
+def bench_solve(symbols, days, start):
+    expected_returns, factors = rebalance.return_moments(synthetic.price_paths(symbols, days))
+    expected_returns, factors = expected_returns * rebalance.TRADING_DAYS, factors * np.sqrt(rebalance.TRADING_DAYS)
+    anchor = np.full(symbols, 2.0 / symbols)
+    bounds = (np.full(symbols, -0.5 / symbols), np.full(symbols, 4.0 / symbols))
+    initial = None
+    if start == "warm":
+        # Last week's solution, solved on slightly different returns
+        initial, _ = optimizer.solve(expected_returns * 0.9, factors, 2.0, anchor, 1.0, *bounds, gross=1.5)
+    return lambda: optimizer.solve(expected_returns, factors, 2.0, anchor, 1.0, *bounds, gross=1.5, initial=initial)
+
+@case("bars.update", symbols=UNIVERSE_SIZES)
+def bench_bars_update(symbols):
+    store = _bar_store(symbols, 30)
+    closes = synthetic.price_paths(symbols, 1)[0]
+    # Alternating between two days makes every update start a new row
+    days = itertools.cycle([datetime(2030, 1, 1), datetime(2030, 1, 2)])
+    return lambda: store.update(next(days), close=closes)
+
+@case("risk.update", symbols=UNIVERSE_SIZES)
+def bench_risk_update(symbols):
+    # One symbol's bar and the end of bar drawdown check, with every position open
+    names = _symbols(symbols)
+    monitor = risk.RiskMonitor(names, 100000.0)
+    closes = synthetic.price_paths(symbols, 1)[0]
+    for name, close in zip(names, closes):
+        monitor.update(name, close)
+        monitor.on_fill(name, 10.0, close, monitor.cash - 10 * close)
+    bars_fed = itertools.cycle([(name, close * move) for move in (1.001, 0.999) for name, close in zip(names, closes)])
+    def update():
+        monitor.update(*next(bars_fed))
+        monitor.end_bar()
+    return update
+
+@case("rebalance.calculate_factors", symbols=UNIVERSE_SIZES, days=HISTORY_LENGTHS)
+def bench_factors(symbols, days):
+    historical_data = synthetic.history_frame(_symbols(symbols), days)
+    portfolio = dict.fromkeys(_symbols(symbols), 1 / symbols)
+    return lambda: rebalance.calculate_factors(historical_data, portfolio)
+
+@case("rebalance.calculate_macd", days=HISTORY_LENGTHS + [5000])
+def bench_macd(days):
+    prices = synthetic.price_paths(1, days)[:, 0]
+    return lambda: rebalance.calculate_macd(prices, THRESHOLDS['short_window'], THRESHOLDS['long_window'])
+
+@case("rebalance.numpy_ewma", days=HISTORY_LENGTHS + [5000])
+def bench_ewma(days):
+    prices = synthetic.price_paths(1, days)[:, 0]
+    return lambda: rebalance.numpy_ewma(prices, THRESHOLDS['long_window'])
+
+@case("strategies", strategy=sorted(strategies.STRATEGIES), symbols=UNIVERSE_SIZES, days=HISTORY_LENGTHS)
+def bench_strategy(strategy, symbols, days):
+    prices = synthetic.price_paths(symbols, days)
+    universe = _universe(symbols)
+    return lambda: strategies.strategy_for(strategy)(prices, universe)
+
+@case("strategies.price_matrix", symbols=UNIVERSE_SIZES, days=[30], bars=["aligned", "staggered"])
+def bench_price_matrix(symbols, days, bars):
+    # Staggered bars end at 16:00 and 17:00 on alternate symbols, as equity and index data do
+    historical_data = synthetic.history_frame(_symbols(symbols), days, bar_hours=[16, 17] if bars == "staggered" else None)
+    return lambda: rebalance.price_matrix(historical_data, _symbols(symbols))
+
+def _training_data(years):
+    days = years * 261
+    history = pd.concat([synthetic.history_frame(["SPY"], days), synthetic.value_frame("VIX", days, level=20.0, column="close")])
+    interest = synthetic.value_frame("RIFSPPAAAD30NB", days, seed=2)
+    return history, interest
+
+@case("features.monthly_features", years=TRAINING_YEARS)
+def bench_monthly_features(years):
+    history, interest = _training_data(years)
+    return lambda: features.monthly_features(history.loc["SPY"]["close"], history.loc["VIX"]["close"], interest["value"], 0.05)
+
+@case("features.window_features", days=[30])
+def bench_window_features(days):
+    history, interest = _training_data(1)
+    spy, vix, value = history.loc["SPY"]["close"][-days:], history.loc["VIX"]["close"][-days:], interest["value"][-days:]
+    momentum = features.momentum(spy).tolist()
+    return lambda: features.window_features(spy, vix, value, 0.05, momentum)
+
+def _feature_matrix(years):
+    history, interest = _training_data(years)
+    return features.monthly_features(history.loc["SPY"]["close"], history.loc["VIX"]["close"], interest["value"], 0.05).dropna().to_numpy()
+
+@case("bgmm.fit", years=TRAINING_YEARS)
+def bench_bgmm_fit(years):
+    from sklearn import mixture
+    data = _feature_matrix(years)
+    return lambda: mixture.BayesianGaussianMixture(n_components=4, covariance_type='full', weight_concentration_prior=1, random_state=0).fit(data)
+
+@case("bgmm.predict", months=[1, 264])
+def bench_bgmm_predict(months):
+    from sklearn import mixture
+    data = _feature_matrix(22)
+    model = mixture.BayesianGaussianMixture(n_components=4, covariance_type='full', weight_concentration_prior=1, random_state=0).fit(data)
+    batch = data[:months]
+    return lambda: model.predict(batch)
+
+@case("regime.predict", months=[1, 264])
+def bench_regime_predict(months):
+    from sklearn import mixture
+    data = _feature_matrix(22)
+    model = mixture.BayesianGaussianMixture(n_components=4, covariance_type='full', weight_concentration_prior=1, random_state=0).fit(data)
+    scorer = regime.RegimeScorer.from_model(model)
+    batch = data[:months]
+    return lambda: scorer.predict(batch)
+
+def measure(function, repeat, min_time):
+    """Median and best seconds per call, looping each sample until it lasts at least min_time."""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time and number < 1e6:
+        number *= 10
+    samples = [t / number for t in timer.repeat(repeat, number)]
+    return {"median": float(np.median(samples)), "best": float(min(samples)), "loops": number, "repeat": repeat}
+
+def compare(results, baseline, threshold):
+    """Cases slower than the baseline median by more than threshold, as (label, baseline, current, ratio)."""
+    regressions = []
+    for label, result in results.items():
+        previous = baseline.get("results", {}).get(label)
+        if previous is None:
+            continue
+        ratio = result["median"] / previous["median"]
+        if ratio > 1 + threshold:
+            regressions.append((label, previous["median"], result["median"], ratio))
+    return regressions
+
+def main():
+    import warnings
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=None, help="write results to this JSON file")
+    parser.add_argument("--compare", default=None, help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before flagging, 0.25 is 25%%")
+    parser.add_argument("--filter", default="", help="only run cases whose label contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per sample")
+    parser.add_argument("--quick", action="store_true", help="fewer, shorter samples for a smoke run")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.min_time = 3, 0.005
+
+    results = {}
+    for label, (setup, params) in CASES.items():
+        if args.filter not in label:
+            continue
+        results[label] = measure(setup(**params), args.repeat, args.min_time)
+        print("{:<70} {:>12.6f}s".format(label, results[label]["median"]), flush=True)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for label, before, after, ratio in regressions:
+            print("REGRESSION {:<60} {:.6f}s -> {:.6f}s ({:+.0%})".format(label, before, after, ratio - 1))
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond {:.0%} against {}".format(args.threshold, args.compare))
+
+if __name__ == "__main__":
+    main()
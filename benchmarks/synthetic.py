@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+def business_days(start, days):
+    """Daily timestamps for trading days starting at start."""
+    return pd.bdate_range(start, periods=days)
+
+def price_paths(num_symbols, days, seed=0, start_price=100.0, volatility=0.01):
+    """Geometric random walks, one column per symbol.
+    :param int num_symbols: number of symbols
+    :param int days: number of daily bars
+    :return array: days x num_symbols closing prices
+    """
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0003, volatility, size=(days, num_symbols))
+    return start_price * np.exp(np.cumsum(returns, axis=0))
+
+def history_frame(symbols, days, start="2001-01-01", seed=0, bar_hours=None):
+    """OHLCV frame shaped like QuantConnect History output, indexed by (symbol, time).
+    :param list symbols: symbol names, used as the first index level
+    :param int days: number of daily bars per symbol
+    :param list[int] bar_hours: hours the daily bars end at, cycled over the symbols, e.g. [16, 17] for equities next
+        to index data, defaults to midnight for every symbol
+    :return DataFrame: columns open, high, low, close, volume
+    """
+    days_index = business_days(start, days)
+    closes = price_paths(len(symbols), days, seed)
+    rng = np.random.default_rng(seed + 1)
+    frames = []
+    for i, symbol in enumerate(symbols):
+        times = days_index + pd.Timedelta(hours=bar_hours[i % len(bar_hours)]) if bar_hours else days_index
+        close = closes[:, i]
+        spread = np.abs(rng.normal(0, 0.005, days)) * close
+        frames.append(pd.DataFrame({
+            "open": close * (1 + rng.normal(0, 0.002, days)),
+            "high": close + spread,
+            "low": close - spread,
+            "close": close,
+            "volume": rng.integers(1e5, 1e7, days).astype(float),
+        }, index=pd.MultiIndex.from_product([[symbol], times], names=["symbol", "time"])))
+    return pd.concat(frames)
+
+def value_frame(symbol, days, start="2001-01-01", seed=0, level=3.0, column="value"):
+    """Custom data frame shaped like a Fred/CBOE History result, indexed by (symbol, time)."""
+    times = business_days(start, days)
+    rng = np.random.default_rng(seed)
+    values = level + np.cumsum(rng.normal(0, 0.02, days))
+    return pd.DataFrame({column: values}, index=pd.MultiIndex.from_product([[symbol], times], names=["symbol", "time"]))
@@ -0,0 +1,52 @@
+import json
+import struct
+
+import numpy as np
+
+# Bump when the layout of a checkpoint changes, checkpoints written by other versions are ignored
+CHECKPOINT_VERSION = 4
+MAGIC = b"CKPT"
+# File extension of checkpoints written to a local directory, they are not npz archives
+EXTENSION = ".ckpt"
+# Magic, format version and header length
+PREAMBLE = struct.Struct("<4sII")
+
+def dumps(arrays):
+    """Serialise a checkpoint, a flat mapping of names to numpy arrays, to bytes.
+    The layout is a short preamble, a JSON header with each array's dtype, shape and offset, then the raw array
+    bytes back to back. Checkpoints are written every day, and this takes a fraction of the time an npz archive does.
+    """
+    header = []
+    chunks = []
+    offset = 0
+    for name, value in arrays.items():
+        value = np.asarray(value)
+        header.append([name, value.dtype.str, list(value.shape), offset])
+        chunks.append(value.tobytes())
+        offset += value.nbytes
+    header = json.dumps(header).encode()
+    return b"".join([PREAMBLE.pack(MAGIC, CHECKPOINT_VERSION, len(header)), header] + chunks)
+
+def loads(data):
+    """Inverse of dumps, None if the data is not a checkpoint of this version."""
+    if len(data) < PREAMBLE.size:
+        return None
+    magic, version, header_length = PREAMBLE.unpack_from(data)
+    if magic != MAGIC or version != CHECKPOINT_VERSION:
+        return None
+    start = PREAMBLE.size + header_length
+    header = json.loads(data[PREAMBLE.size:start].decode())
+    arrays = {}
+    for name, dtype, shape, offset in header:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=start + offset).reshape(tuple(shape)).copy()
+    return arrays
+
+def to_ns(time):
+    """A datetime as an int64 nanosecond array, the form times take in a checkpoint."""
+    return np.array(np.datetime64(time, "ns").astype(np.int64))
+
+def from_ns(value):
+    """Inverse of to_ns, a python datetime."""
+    return np.datetime64(int(value), "ns").astype("datetime64[us]").item()
@@ -0,0 +1,30 @@
+def plan_orders(targets, current_weights, band):
+    """Work out which target weights are worth trading towards.
+    :param dict[str, float] targets: target portfolio weight per symbol, symbols left out are closed
+    :param dict[str, float] current_weights: current portfolio weight per symbol
+    :param float band: smallest weight change that is traded, closing a position always trades
+    :return list[(str, float)] orders, list[str] skipped: symbols and target weights to trade, reducing positions first
+    """
+    orders = []
+    skipped = []
+    for symbol in dict.fromkeys(list(targets) + list(current_weights)):
+        target = targets.get(symbol, 0.0)
+        current = current_weights.get(symbol, 0.0)
+        delta = target - current
+        if delta == 0:
+            continue
+        if abs(delta) < band and not (target == 0 and current != 0):
+            skipped.append(symbol)
+            continue
+        orders.append((symbol, target))
+
+    # Sells before buys, so reductions free up margin for the increases that follow
+    def reduces_exposure(order):
+        symbol, target = order
+        return abs(target) < abs(current_weights.get(symbol, 0.0))
+    orders.sort(key=lambda order: not reduces_exposure(order))
+    return orders, skipped
+
+def turnover(orders, current_weights):
+    """Sum of absolute weight changes of the given orders."""
+    return sum(abs(target - current_weights.get(symbol, 0.0)) for symbol, target in orders)
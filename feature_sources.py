@@ -0,0 +1,85 @@
+import pandas as pd
+import features
+
+class Source:
+    """One data series the regime features are computed from."""
+    def __init__(self, name, symbol, field, data_type=None):
+        """
+        :param str name: name features refer to it by in features.FEATURE_SOURCES
+        :param symbol: subscribed symbol, or the ticker of custom data
+        :param str field: History column holding the series, e.g. close or value
+        :param data_type: custom data type read with History(data_type, ticker, ...) without a subscription, None for a subscribed symbol
+        """
+        self.name = name
+        self.symbol = symbol
+        self.field = field
+        self.data_type = data_type
+
+class FeatureSources:
+    """Data the regime features need, fetched only when a feature computation asks for it.
+    Custom data is never subscribed, so it does not pass through OnData, the security list or the universe History
+    requests. Sources no feature in features.FEATURES uses are never requested at all.
+    Recent windows go through the HistoryCache, so requests at the same algorithm time share one fetch.
+    """
+    def __init__(self, algorithm, history_cache, sources):
+        """
+        :param QCAlgorithm algorithm: algorithm whose History is used for date ranges
+        :param HistoryCache history_cache: cache used for bar count requests
+        :param list[Source] sources: every source a feature may need
+        """
+        self.algorithm = algorithm
+        self.history_cache = history_cache
+        self.sources = {source.name: source for source in sources}
+        self.required = features.required_sources()
+        missing = [name for name in self.required if name not in self.sources]
+        if missing:
+            raise ValueError("No data source registered for {}".format(", ".join(missing)))
+
+    def symbols(self):
+        """Symbols or tickers of the required sources, e.g. to identify the training data."""
+        return [self.sources[name].symbol for name in self.required]
+
+    def _groups(self):
+        # Subscribed sources of one data type are requested together
+        groups = {}
+        for name in self.required:
+            groups.setdefault(self.sources[name].data_type, []).append(self.sources[name])
+        return groups
+
+    def _series(self, history, source):
+        try:
+            return history.loc[source.symbol][source.field]
+        except KeyError:
+            return pd.Series(dtype=float)
+
+    def window(self, periods, resolution):
+        """Last periods bars of every required source.
+        :param int periods: bars per source
+        :param resolution: bar resolution
+        :return dict[str, Series]: time-indexed values per source name
+        """
+        series = {}
+        for data_type, sources in self._groups().items():
+            history = self.history_cache.get([source.symbol for source in sources], periods, resolution, data_type)
+            for source in sources:
+                series[source.name] = self._series(history, source)
+        return series
+
+    def history(self, start, end, resolution):
+        """Every required source between two dates, one History request per subscribed group or custom ticker.
+        Used to prefetch the whole training range at once.
+        :param datetime start: first day
+        :param datetime end: last day
+        :param resolution: bar resolution
+        :return dict[str, Series]: time-indexed values per source name
+        """
+        series = {}
+        for data_type, sources in self._groups().items():
+            if data_type is None:
+                history = self.algorithm.History([source.symbol for source in sources], start, end, resolution)
+                for source in sources:
+                    series[source.name] = self._series(history, source)
+            else:
+                for source in sources:
+                    series[source.name] = self._series(self.algorithm.History(data_type, source.symbol, start, end, resolution), source)
+        return series
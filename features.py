@@ -0,0 +1,169 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Columns of the regime model feature matrix, in the order the model was trained on
+FEATURES = ["return", "volatility", "vix", "sharpe", "momentum", "interest30"]
+# Bump whenever a feature definition changes, so cached training data is rebuilt
+FEATURE_VERSION = 1
+# Data sources each feature is computed from, only the sources of FEATURES are ever requested
+FEATURE_SOURCES = {
+    "return": ("spy",),
+    "volatility": ("spy",),
+    "vix": ("vix",),
+    "sharpe": ("spy",),
+    "momentum": ("spy",),
+    "interest30": ("interest30",),
+}
+
+def required_sources(names=None):
+    """Data sources the given features need, in first use order.
+    :param list[str] names: features, defaults to FEATURES
+    :return list[str]: source names
+    """
+    return list(dict.fromkeys(source for name in (FEATURES if names is None else names) for source in FEATURE_SOURCES[name]))
+
+# Period of the QuantConnect Momentum indicator fed with SPY closes
+MOMENTUM_PERIOD = 30
+
+# Monthly windows originally ran from the 1st to the 30th of each month (inclusive)
+MONTH_WINDOW = pd.Timedelta(days=29)
+
+def month_window(series):
+    """Restrict a time-indexed series to the per-month windows used for training and label each row with its month.
+    :param Series series: time-indexed values
+    :return Series, PeriodIndex: filtered values and their calendar months
+    """
+    if isinstance(series.index, pd.MultiIndex):
+        # History frames are indexed by (symbol, time)
+        series = series.droplevel(0)
+    series = series.sort_index()
+    months = series.index.to_period("M")
+    in_window = (series.index - months.start_time) <= MONTH_WINDOW
+    return series[in_window], months[in_window]
+
+def momentum(prices, period=MOMENTUM_PERIOD):
+    """Vectorized equivalent of streaming prices through Momentum(period).
+    Before the indicator is ready it returns the change since the first price seen.
+    :param Series prices: closing prices in time order
+    :param int period: momentum lookback
+    :return Series: momentum value emitted for every price
+    """
+    values = prices.to_numpy(dtype=float)
+    out = values - values[0] if len(values) else values.copy()
+    out[period:] = values[period:] - values[:-period]
+    return pd.Series(out, index=prices.index)
+
+def monthly_features(spy_close, vix_close, interest, risk_free_rate, months=None):
+    """Build the regime model feature matrix for every calendar month in one pass.
+    :param Series spy_close: daily SPY closes over the whole training range
+    :param Series vix_close: daily VIX closes over the whole training range
+    :param Series interest: daily 30-day AA commercial paper rate over the whole training range
+    :param float risk_free_rate: risk free rate used for the sharpe ratio
+    :param PeriodIndex months: months to return, defaults to every month covered by spy_close
+    :return DataFrame: one row per month, columns FEATURES
+    """
+    spy_close, spy_months = month_window(spy_close.dropna())
+    vix_close, vix_months = month_window(vix_close.dropna())
+    interest, interest_months = month_window(interest.dropna())
+
+    # Returns are taken within each month only, as each month used to be requested separately
+    returns = spy_close / spy_close.groupby(spy_months).shift(1) - 1
+    grouped_returns = returns.groupby(spy_months)
+
+    features = pd.DataFrame({
+        #1. Monthly return of SPY (percent)
+        "return": grouped_returns.mean() * 100,
+        #2. Monthly volatility of SPY (percent)
+        "volatility": grouped_returns.std() * 100,
+        #3. Monthly VIX average for volatility
+        "vix": vix_close.groupby(vix_months).mean(),
+        #5. Monthly average day to day momentum of market, indicator state carries over between months
+        "momentum": momentum(spy_close).groupby(spy_months).mean(),
+        #6. US federal reserve 30-day AA asset-backed commercial paper interest rate (percent)
+        "interest30": interest.groupby(interest_months).mean(),
+    })
+    #4. Sharpe ratio of SPY
+    features["sharpe"] = (features["return"] - risk_free_rate) / features["volatility"]
+
+    if months is None:
+        months = pd.period_range(spy_months.min(), spy_months.max(), freq="M") if len(spy_months) else pd.PeriodIndex([], freq="M")
+    features = features.reindex(months)
+    # No data, act as if neutral
+    features["momentum"] = features["momentum"].fillna(0)
+    return features[FEATURES]
+
+def window_features(spy_close, vix_close, interest, risk_free_rate, momentum_values):
+    """Regime model features for a single window of recent data, as used for prediction.
+    :param Series spy_close: SPY closes over the window
+    :param Series vix_close: VIX closes over the window
+    :param Series interest: 30-day AA commercial paper rate over the window
+    :param float risk_free_rate: risk free rate used for the sharpe ratio
+    :param list[float] momentum_values: momentum indicator values emitted over the window
+    :return array: 1 x len(FEATURES) test data
+    """
+    test_data = np.empty((1, len(FEATURES)))
+    returns = spy_close.pct_change().dropna()
+    #1. Monthly return of SPY (percent)
+    test_data[0, 0] = returns.mean() * 100
+    #2. Monthly volatility of SPY (percent)
+    test_data[0, 1] = returns.std() * 100
+    #3. Monthly VIX average for volatility
+    test_data[0, 2] = vix_close.mean()
+    #4. Sharpe ratio of SPY
+    test_data[0, 3] = (test_data[0, 0] - risk_free_rate) / test_data[0, 1]
+    #5. Momentum of SPY, no data acts as neutral
+    test_data[0, 4] = np.mean(momentum_values) if len(momentum_values) else 0
+    #6. 30-day AA asset-backed commercial paper interest rate (percent)
+    test_data[0, 5] = interest.dropna().mean()
+    return test_data
+
+def trailing_windows(series, times, length):
+    """Last length values of a series before each of several times, as History(symbol, length) would return them then.
+    :param Series series: time-indexed values in time order
+    :param DatetimeIndex times: times to look back from, values at or after each time are excluded
+    :param int length: number of values per window
+    :return array: times x length values, oldest first, NaN padded on the left where fewer values exist
+    """
+    values = series.to_numpy(dtype=float)
+    ends = np.searchsorted(series.index.values, pd.DatetimeIndex(times).values, side="left")
+    positions = ends[:, np.newaxis] - length + np.arange(length)
+    return np.where(positions >= 0, values[np.maximum(positions, 0)], np.nan)
+
+def batch_window_features(spy_close, vix_close, interest, risk_free_rate, times, length=30):
+    """window_features for many prediction times at once, as PredictModel would compute them at each time.
+    PredictModel streams its 30 SPY closes through a Momentum(30) indicator that keeps its state, so once the
+    indicator is warm each momentum value is the difference between a close and the close in the same position of
+    the previous prediction's window. The first time behaves like a fresh indicator, as at the start of a backtest.
+    :param Series spy_close: daily SPY closes, covering length days before the first time
+    :param Series vix_close: daily VIX closes
+    :param Series interest: daily 30-day AA commercial paper rate
+    :param float risk_free_rate: risk free rate used for the sharpe ratio
+    :param DatetimeIndex times: prediction times in order, each window ends the bar before
+    :param int length: bars per window, the number requested from History
+    :return DataFrame: one row per time, columns FEATURES
+    """
+    closes = trailing_windows(spy_close.dropna(), times, length)
+    returns = closes[:, 1:] / closes[:, :-1] - 1
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # Times without enough history give NaN rows rather than warnings
+        warnings.simplefilter("ignore", RuntimeWarning)
+        features = pd.DataFrame(index=pd.DatetimeIndex(times), columns=FEATURES, dtype=float)
+        #1. Monthly return of SPY (percent)
+        features["return"] = np.nanmean(returns, axis=1) * 100
+        #2. Monthly volatility of SPY (percent)
+        features["volatility"] = np.nanstd(returns, axis=1, ddof=1) * 100
+        #3. Monthly VIX average for volatility
+        features["vix"] = np.nanmean(trailing_windows(vix_close.dropna(), times, length), axis=1)
+        #4. Sharpe ratio of SPY
+        features["sharpe"] = (features["return"] - risk_free_rate) / features["volatility"]
+        #5. Momentum of SPY against the previous window, or the first close for a fresh indicator
+        previous = np.vstack([np.full((1, length), np.nan), closes[:-1]])
+        first = closes[:1, :]
+        previous[0] = first[0, np.argmax(~np.isnan(first[0]))] if len(closes) else np.nan
+        momentum_values = closes - previous
+        features["momentum"] = np.where(np.isnan(momentum_values).all(axis=1), 0, np.nanmean(momentum_values, axis=1))
+        #6. 30-day AA asset-backed commercial paper interest rate (percent)
+        features["interest30"] = np.nanmean(trailing_windows(interest.dropna(), times, length), axis=1)
+    return features
@@ -0,0 +1,65 @@
+import pandas as pd
+
+class HistoryCache:
+    """Bar count History requests, memoised for the current algorithm time.
+    Each symbol's bars are kept separately along with how many bars were asked for, so a request for fewer bars
+    or for a subset of symbols is sliced from earlier results instead of calling History again.
+    Everything is dropped as soon as the algorithm clock moves on, so each bar is fetched at most once per time step.
+    Custom data can be requested by type and ticker without subscribing to it, as History(data_type, ticker, ...) does.
+    """
+    def __init__(self, algorithm):
+        """
+        :param QCAlgorithm algorithm: algorithm whose History and Time are used
+        """
+        self.algorithm = algorithm
+        self.time = None
+        # (symbol, resolution, data type) -> (periods requested, frame indexed by (symbol, time), None when History had no data)
+        self.frames = {}
+        self.requests = 0
+        self.hits = 0
+
+    def get(self, symbols, periods, resolution, data_type=None):
+        """Last periods bars of each symbol, as History(symbols, periods, resolution) would return them.
+        :param symbols: one symbol or a list of symbols, tickers when data_type is given
+        :param int periods: number of bars per symbol
+        :param resolution: bar resolution
+        :param data_type: custom data type of unsubscribed symbols, None for subscribed symbols
+        :return DataFrame: bars indexed by (symbol, time), in the order of symbols
+        """
+        if self.time != self.algorithm.Time:
+            self.frames.clear()
+            self.time = self.algorithm.Time
+        if isinstance(symbols, str) or not hasattr(symbols, "__iter__"):
+            symbols = [symbols]
+        symbols = list(symbols)
+
+        missing = [symbol for symbol in symbols if self.frames.get((symbol, resolution, data_type), (0, None))[0] < periods]
+        self.requests += 1
+        if missing:
+            self.fetch(missing, periods, resolution, data_type)
+        else:
+            self.hits += 1
+
+        frames = []
+        for symbol in symbols:
+            frame = self.frames[(symbol, resolution, data_type)][1]
+            if frame is not None:
+                frames.append(frame.iloc[-periods:])
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames)
+
+    def fetch(self, symbols, periods, resolution, data_type=None):
+        """Request periods bars of symbols in one History call and store each symbol's bars.
+        Custom data types take one ticker per History call."""
+        if data_type is None:
+            history = self.algorithm.History(symbols, periods, resolution)
+        else:
+            history = pd.concat([self.algorithm.History(data_type, symbol, periods, resolution) for symbol in symbols])
+        for symbol in symbols:
+            try:
+                frame = history.loc[[symbol]]
+            except (KeyError, TypeError):
+                # No data for this symbol, or no data at all
+                frame = None
+            self.frames[(symbol, resolution, data_type)] = (periods, frame if frame is not None and len(frame) else None)
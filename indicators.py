@@ -0,0 +1,84 @@
+import numpy as np
+
+class StreamingMACD:
+    """Exponential moving averages and MACD for a universe of symbols, updated one bar at a time.
+    State is two float arrays with one slot per symbol, so a bar for the whole universe is a single vectorized update.
+    Uses the recursive form ema += alpha * (price - ema), which stays stable for series of any length.
+    """
+    def __init__(self, symbols, short_window, long_window):
+        """
+        :param list symbols: symbols to track, later symbols can be added with add
+        :param int short_window: short window for EWMA
+        :param int long_window: long window for EWMA
+        """
+        self.short_alpha = 2 / (short_window + 1.0)
+        self.long_alpha = 2 / (long_window + 1.0)
+        self.index = {}
+        self.short_ema = np.empty(0)
+        self.long_ema = np.empty(0)
+        self.samples = np.empty(0, dtype=np.int64)
+        self.add(symbols)
+
+    def add(self, symbols):
+        """Start tracking new symbols, already tracked symbols are ignored."""
+        new = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self.index]
+        for symbol in new:
+            self.index[symbol] = len(self.index)
+        self.short_ema = np.concatenate([self.short_ema, np.full(len(new), np.nan)])
+        self.long_ema = np.concatenate([self.long_ema, np.full(len(new), np.nan)])
+        self.samples = np.concatenate([self.samples, np.zeros(len(new), dtype=np.int64)])
+
+    def update(self, prices):
+        """Feed one bar for every tracked symbol.
+        :param array prices: latest price per symbol in tracking order, NaN where a symbol has no new bar
+        """
+        prices = np.asarray(prices, dtype=float)
+        has_bar = ~np.isnan(prices)
+        # The first price seen seeds both averages
+        first = has_bar & (self.samples == 0)
+        self.short_ema[first] = prices[first]
+        self.long_ema[first] = prices[first]
+        seen = has_bar & ~first
+        self.short_ema[seen] += self.short_alpha * (prices[seen] - self.short_ema[seen])
+        self.long_ema[seen] += self.long_alpha * (prices[seen] - self.long_ema[seen])
+        self.samples += has_bar
+
+    def update_symbols(self, prices):
+        """Feed one bar from a mapping of symbol to price, symbols missing from the mapping are left unchanged."""
+        vector = np.full(len(self.index), np.nan)
+        for symbol, price in prices.items():
+            if symbol in self.index:
+                vector[self.index[symbol]] = price
+        self.update(vector)
+
+    def macd(self, symbol):
+        """Current MACD of one symbol, NaN if it has not had a bar yet."""
+        i = self.index[symbol]
+        return self.short_ema[i] - self.long_ema[i]
+
+    def values(self):
+        """Current MACD of every tracked symbol as a dict."""
+        macd = self.short_ema - self.long_ema
+        return {symbol: macd[i] for symbol, i in self.index.items()}
+
+    def is_ready(self, symbol, min_samples):
+        """Whether a symbol has had at least min_samples bars."""
+        return self.samples[self.index[symbol]] >= min_samples
+
+    def to_arrays(self, prefix=""):
+        """Arrays restore reloads the averages from, with names starting with prefix."""
+        return {
+            prefix + "symbols": np.array(list(map(str, self.index)), dtype=str),
+            prefix + "short_ema": self.short_ema,
+            prefix + "long_ema": self.long_ema,
+            prefix + "samples": self.samples,
+        }
+
+    def restore(self, arrays, prefix=""):
+        """Load averages saved by to_arrays, False and unchanged if they were saved for other symbols."""
+        if arrays[prefix + "symbols"].tolist() != list(map(str, self.index)):
+            return False
+        self.short_ema = arrays[prefix + "short_ema"].astype(float)
+        self.long_ema = arrays[prefix + "long_ema"].astype(float)
+        self.samples = arrays[prefix + "samples"].astype(np.int64)
+        return True
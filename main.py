@@ -2,9 +2,27 @@ from AlgorithmImports import *
 import numpy as np
 import strategies
 import rebalance
-from sklearn import mixture, preprocessing
+import features
+import model_cache
+import indicators
+import execution
+import timing
+import regime
+import history_cache
+import bars
+import feature_sources
+import checkpoint
+import risk
 import pandas as pd
-import statistics
+from datetime import datetime, timedelta
+from collections import deque
+import copy
+import json
+
+# Regime model hyperparameters, shared with the offline validation tools
+MODEL_PARAMS = {'n_components': 4, 'covariance_type': 'full', 'weight_concentration_prior': 1, 'random_state': 0}
+# Estimated risk-free rate used in the sharpe calculations
+RISK_FREE_RATE = 0.05
 
 class TradingStrategy(QCAlgorithm):
     def Initialize(self):
@@ -15,40 +33,80 @@ class TradingStrategy(QCAlgorithm):
         self.first_iteration = True
         self.market_condition = 1
         self.previous_value = 100000
-        self.SetWarmUp(100)
+
+        # Timing of scheduled events, model calls and History requests, switched on with the profile parameter.
+        # When off nothing is wrapped, so the instrumented methods run exactly as before
+        self.profiler = timing.Profiler() if self.GetParameter('profile', 0) else timing.NullProfiler()
+        if self.profiler.enabled:
+            for name in ("Update", "Rebalance", "PredictModel", "TrainModel", "RetrainModel", "ExecuteTargets", "ReduceRisk"):
+                setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+            self.History = self.profiler.wrap("History", self.History, rows=True)
 
         # Set estimated risk-free rate, as well as rebalancing thresholds for calculations
-        self.risk_free_rate = 0.05
+        self.risk_free_rate = RISK_FREE_RATE
+        # Each value can be overridden by an algorithm parameter of the same name, e.g. for optimisation
         self.thresholds = {
-            'risk_factor': 2.0,
-            'return_factor': 1.5,
-            'diversification_factor': 0.5,
-            'short_window': 7,
-            'long_window': 14
+            'risk_factor': self.GetParameter('risk_factor', 2.0),
+            'return_factor': self.GetParameter('return_factor', 1.5),
+            'diversification_factor': self.GetParameter('diversification_factor', 0.5),
+            'short_window': self.GetParameter('short_window', 7),
+            'long_window': self.GetParameter('long_window', 14)
         }
+        for name, default in rebalance.OPTIMISER_DEFAULTS.items():
+            self.thresholds[name] = self.GetParameter(name, default)
+        for name, values in {**rebalance.MULTIPLIERS, **rebalance.REGIME_LIMITS}.items():
+            self.thresholds[name] = self.ListParameter(name, values)
         
-        # 5 etfs selected as proof of concept, SPY as the market, TQQQ as tech, XAGUSD as gold, UBT as bonds, UST as treasuries
-        spy = self.AddEquity("SPY", Resolution.Daily).Symbol
-        tqqq = self.AddEquity("TQQQ", Resolution.Daily).Symbol
-        xagusd = self.AddCfd("XAGUSD", Resolution.Daily).Symbol
-        ubt = self.AddEquity("UBT", Resolution.Daily).Symbol
-        ust = self.AddEquity("UST", Resolution.Daily).Symbol
-        self.ticker = ["SPY", "TQQQ", "XAGUSD", "UBT", "UST"]
-        self.historytickers = [spy, tqqq, xagusd, ubt, ust] # List of securities to be used for history function
+        # Traded universe as (ticker, asset class, security type). 5 etfs selected as proof of concept, SPY as the market,
+        # TQQQ as tech, XAGUSD as gold, UBT as bonds, UST as treasuries. Strategies allocate by asset class, so any number of tickers can be listed
+        universe = [
+            ("SPY", "market", "equity"),
+            ("TQQQ", "tech", "equity"),
+            ("XAGUSD", "gold", "cfd"),
+            ("UBT", "bonds", "equity"),
+            ("UST", "treasuries", "equity"),
+        ]
+        # SPY is also the market data for the regime model, whether or not it is traded
+        self.spy = self.AddEquity("SPY", Resolution.Daily).Symbol
+        self.ticker = [ticker for ticker, _, _ in universe]
+        self.historytickers = [(self.AddCfd if security_type == "cfd" else self.AddEquity)(ticker, Resolution.Daily).Symbol for ticker, _, security_type in universe] # List of securities to be used for history function
+        self.universe = strategies.Universe(self.ticker, [asset_class for _, asset_class, _ in universe])
+        self.symbolByTicker = dict(zip(self.ticker, self.historytickers))
+        self.tickerBySymbol = dict(zip(self.historytickers, self.ticker))
+        # Bar count History requests go through this cache, so events scheduled at the same time share one request
+        self.history_cache = history_cache.HistoryCache(self)
+        # Weight changes smaller than this are not traded
+        self.rebalance_band = self.GetParameter('rebalance_band', 0.02)
+        # Trailing stops, drawdown from the high-water mark and exposure limits, checked every bar from OnData.
+        # Positions are tracked from fills, so a bar costs the same whatever the size of the universe
+        self.risk = risk.RiskMonitor(self.ticker, float(self.Portfolio.TotalPortfolioValue),
+                                     trailing_stop=self.GetParameter('trailing_stop', 0.1),
+                                     max_drawdown=self.GetParameter('max_drawdown', 0.05),
+                                     max_exposure=self.GetParameter('max_exposure', 1.0))
+        # MACD per ticker, fed every bar from OnData so Rebalance needs no history for it
+        self.macd = indicators.StreamingMACD(self.ticker, self.thresholds['short_window'], self.thresholds['long_window'])
 
         # ============= For model training =================
-        self.vix = self.AddData(CBOE, "VIX", Resolution.Daily).Symbol
-        # US federal reserve 30-day AA asset-backed commercial paper interest rate
-        self.interest30 = self.AddData(Fred, Fred.CommercialPaper.Three0DayAAAssetbackedCommercialPaperInterestRate, Resolution.Daily).Symbol
-        # Yield curve data
-        self.ustres = self.AddData(USTreasuryYieldCurveRate, "USTYCR").Symbol
+        # Data the regime features are computed from. Custom data is not subscribed, it is requested by type only
+        # when features are computed, once a month for prediction and in bulk for training
+        self.feature_sources = feature_sources.FeatureSources(self, self.history_cache, [
+            feature_sources.Source("spy", self.spy, "close"),
+            feature_sources.Source("vix", "VIX", "close", CBOE),
+            # US federal reserve 30-day AA asset-backed commercial paper interest rate
+            feature_sources.Source("interest30", Fred.CommercialPaper.Three0DayAAAssetbackedCommercialPaperInterestRate, "value", Fred),
+        ])
         # Set momentum indicator
         self.manual_mom = Momentum(30)
         self.manual_mom.Updated += (lambda sender, updated: self.mom_window.Add(updated))
         self.mom_window = RollingWindow[IndicatorDataPoint](30)
+        # Prices fed to the momentum indicator, enough to rebuild its state from a checkpoint
+        self.mom_prices = deque(maxlen=self.manual_mom.WarmUpPeriod)
+
+        # Recent daily bars fed from OnData, so scheduled events can read windows without calling History
+        self.bars = bars.BarStore(self.ticker, ("close", "volume"))
         
         # Set initial equal weights - initialises portfolio
-        self.weightBySymbol = {"SPY" : 0.2, "TQQQ" : 0.2, "XAGUSD" : 0.2, "UBT" : 0.2, "UST" : 0.2}
+        self.weightBySymbol = {ticker: 1 / len(self.ticker) for ticker in self.ticker}
 
         # Schedule updating and rebalancing of portfolio weights
         self.Schedule.On(
@@ -59,14 +117,61 @@ class TradingStrategy(QCAlgorithm):
             self.DateRules.WeekStart("SPY"),
             self.TimeRules.AfterMarketOpen("SPY"),
             self.Rebalance)
+        if self.profiler.enabled:
+            self.Schedule.On(
+                self.DateRules.MonthStart("SPY"),
+                self.TimeRules.AfterMarketOpen("SPY"),
+                self.LogTimings)
 
         # Set Leverage, and lower cash buffer to reduce unfilled orders
         self.SetSecurityInitializer(self.CustomSecurityInitializer)
         self.Settings.FreePortfolioValuePercentage = 0.05
 
-        # Model setup
+        # Model setup, fitted models are cached in the ObjectStore keyed on everything that affects training
         self.model_training = False
-        self.model = self.TrainModel(2001, 21)
+        self.model_params = dict(MODEL_PARAMS)
+        self.model_cache = model_cache.ModelCache(model_cache.ObjectStoreBackend(self.ObjectStore))
+        # Set once the model has been refitted in memory, so checkpoints carry the refitted model
+        self.model_retrained = False
+        self.mixture_payload = None
+        # Set when a checkpoint is restored. Live holdings and cash are only loaded from the brokerage after Initialize,
+        # so the risk monitor is synced to them on the first bar instead
+        self.risk_sync_pending = False
+
+        # Resuming from a checkpoint restores the model, indicators and bar windows, so there is no warm up or training.
+        # Checkpoints are kept in the ObjectStore, or in a local directory when checkpoint_dir is set
+        self.checkpoint_key = self.GetParameter('checkpoint', '')
+        if self.checkpoint_key:
+            directory = self.GetParameter('checkpoint_dir', '')
+            self.checkpoint_store = model_cache.FileBackend(directory, checkpoint.EXTENSION) if directory else model_cache.ObjectStoreBackend(self.ObjectStore)
+        if not (self.checkpoint_key and self.LoadCheckpoint()):
+            self.SetWarmUp(100)
+            # A model chosen by offline/selection.py can be loaded from the ObjectStore instead of training the default one
+            selected_model = self.GetParameter('selected_model', '')
+            self.model = self.LoadSelectedModel(selected_model) if selected_model else self.TrainModel(2001, 21)
+        if self.checkpoint_key:
+            self.Schedule.On(
+                self.DateRules.EveryDay("SPY"),
+                self.TimeRules.At(17, 0),
+                self.SaveCheckpoint)
+
+        # Optionally refit every month on the month just completed, before the market opens and ahead of Update
+        if self.GetParameter('retrain', 0):
+            self.Train(
+                self.DateRules.MonthStart("SPY"),
+                self.TimeRules.At(7, 0),
+                self.RetrainModel)
+
+    def ListParameter(self, name, default):
+        """Read a comma separated list of numbers from an algorithm parameter.
+        :param str name: parameter name
+        :param list[float] default: value used when the parameter is not set
+        :return list[float]: parameter values
+        """
+        value = self.GetParameter(name)
+        if not value:
+            return default
+        return [float(item) for item in str(value).split(',')]
 
     def CustomSecurityInitializer(self, security):
         """Set leverage to 5."""
@@ -77,127 +182,151 @@ class TradingStrategy(QCAlgorithm):
         self.portfolio_returns = float(self.Portfolio.TotalPortfolioValue - self.previous_value)
         self.previous_value = float(self.Portfolio.TotalPortfolioValue)
 
-        # Rebalance every week depending on portfolio performance
-        historical_data = self.History(self.historytickers, 14, Resolution.Daily)
+        # Rebalance every week depending on portfolio performance, on the last 14 daily closes
+        if self.bars.ready(14):
+            historical_data = pd.DataFrame(self.bars.window("close", 14), columns=self.ticker, copy=False)
+        else:
+            historical_data = self.history_cache.get(self.historytickers, 14, Resolution.Daily)
 
         # Call rebalancing function from rebalance.py
-        rebalanced_portfolio = rebalance.adjust(self.weightBySymbol, self.market_condition, historical_data, self.risk_free_rate, self.thresholds, self.portfolio_returns)
-        
-        # Liquidate any symbols that are no longer in the portfolio
-        for symbol in self.Portfolio.Keys:
-            if symbol not in rebalanced_portfolio:
-                self.Liquidate(symbol)
-        
-        # Set holdings for rebalanced portfolio
-        for symbol in rebalanced_portfolio:
-            self.SetHoldings(symbol, rebalanced_portfolio[symbol])
+        rebalanced_portfolio = rebalance.adjust(self.weightBySymbol, self.market_condition, historical_data, self.risk_free_rate, self.thresholds, self.portfolio_returns, self.macd.values())
+
+        # Trade towards the rebalanced portfolio, closing any symbols no longer in it
+        self.ExecuteTargets(rebalanced_portfolio, "Rebalance")
         self.weightBySymbol = rebalanced_portfolio
 
     def Update(self):
         """Called by Schedule function in QuantConnect automatically every month.
         Update portfolio weights every month depending on market conditions."""
         self.market_condition = self.PredictModel()
-        historical_data = self.History(self.historytickers, 30, Resolution.Daily)
-
-        # Call strategy from strategies.py based on market condition
-        if self.market_condition == 1:
-            updated_portfolio = strategies.crisis_strategy(historical_data, self.ticker)
-        elif self.market_condition == 0:
-            updated_portfolio = strategies.steady_state_strategy(historical_data, self.ticker)
-        elif self.market_condition == 3:
-            updated_portfolio = strategies.inflation_strategy(historical_data, self.ticker)
+        if self.bars.ready(30):
+            prices = self.bars.window("close", 30)
         else:
-            updated_portfolio = strategies.woi_strategy(historical_data, self.ticker)
+            prices = rebalance.closes_matrix(self.history_cache.get(self.historytickers, 30, Resolution.Daily), self.ticker)
 
-        # Liquidate any symbols that are no longer in the portfolio
-        for symbol in self.Portfolio.Keys:
-            if symbol not in updated_portfolio:
-                self.Liquidate(symbol)
+        # Call strategy registered in strategies.py for the market condition
+        weights = strategies.strategy_for(self.market_condition)(prices, self.universe)
+        updated_portfolio = self.universe.to_portfolio(weights)
 
-        # Set holdings for updated portfolio
-        for symbol in updated_portfolio:
-            self.SetHoldings(symbol, updated_portfolio[symbol])
+        # Trade towards the updated portfolio, closing any symbols no longer in it
+        self.ExecuteTargets(updated_portfolio, "Update")
         self.weightBySymbol = updated_portfolio
 
+    def ExecuteTargets(self, targets, reason):
+        """Submit one batch of orders moving the portfolio to target weights.
+        Changes smaller than rebalance_band are skipped, and positions being reduced are ordered first.
+        :param dict[str, float] targets: target weight per ticker, tickers left out are closed
+        :param str reason: label for the log line
+        """
+        # Weights relative to the value SetHoldings allocates, which excludes the free portfolio value buffer
+        allocatable = float(self.Portfolio.TotalPortfolioValue) * (1 - self.Settings.FreePortfolioValuePercentage)
+        current_weights = {}
+        for ticker, symbol in self.symbolByTicker.items():
+            if self.Portfolio[symbol].Invested:
+                current_weights[ticker] = float(self.Portfolio[symbol].HoldingsValue) / allocatable
+
+        orders, skipped = execution.plan_orders(targets, current_weights, self.rebalance_band)
+        if orders:
+            self.SetHoldings([PortfolioTarget(self.symbolByTicker[ticker], weight) for ticker, weight in orders])
+        self.Log("{}: {} orders, {} within band, turnover {:.3f}".format(reason, len(orders), len(skipped), execution.turnover(orders, current_weights)))
+
+    def SyncRisk(self):
+        """Replace the positions and cash the risk monitor tracks with the portfolio's, once after a checkpoint is restored."""
+        holdings = {self.tickerBySymbol[symbol]: float(self.Portfolio[symbol].Quantity) for symbol in self.historytickers if self.Portfolio[symbol].Invested}
+        self.risk.sync(holdings, float(self.Portfolio.Cash))
+        self.risk_sync_pending = False
+
+    def ReduceRisk(self, targets, reasons):
+        """Trade only the symbols that breached a risk limit, leaving the rest of the portfolio alone.
+        :param dict[str, float] targets: target weight per ticker, 0 to close
+        :param dict[str, str] reasons: breached limit per ticker, for the log line
+        """
+        self.SetHoldings([PortfolioTarget(self.symbolByTicker[ticker], weight) for ticker, weight in targets.items()])
+        self.Log("Risk: " + ", ".join("{} {} to {:.2f}".format(ticker, reasons[ticker], weight) for ticker, weight in targets.items()))
+
     def OnData(self, data):
         """Called every time data updates automatically.
         :param dataframe data: Historical data on assets in our portfolio
         """
-        if self.IsWarmingUp or self.model_training:
-            return
+        with self.profiler.measure("OnData"):
+            if self.risk_sync_pending:
+                self.SyncRisk()
+            # Update bar stores and streaming indicators, including during warm up
+            closes = {}
+            volumes = {}
+            for ticker, symbol in self.symbolByTicker.items():
+                if data.ContainsKey(symbol):
+                    closes[ticker] = self.Securities[symbol].Price
+                    volumes[ticker] = getattr(data[symbol], "Volume", np.nan)
+            if closes:
+                self.bars.update_symbols(self.Time, close=closes, volume=volumes)
+            self.macd.update_symbols(closes)
+            for ticker, close in closes.items():
+                self.risk.update(ticker, close)
+            self.risk.end_bar()
 
-        # On first iteration, set initial portfolio weights as a baseline
-        if self.first_iteration:
-            for symbol in self.weightBySymbol:
-                self.SetHoldings(symbol, self.weightBySymbol[symbol])
-            self.first_iteration = False
-        self.Benchmark.Evaluate(self.Time)
-        # Stop loss
-        if self.Portfolio.TotalPortfolioValue/self.previous_value < 0.95:
-            self.Liquidate()
+            if self.IsWarmingUp or self.model_training:
+                return
+
+            # On first iteration, set initial portfolio weights as a baseline
+            if self.first_iteration:
+                self.ExecuteTargets(self.weightBySymbol, "Initial")
+                self.first_iteration = False
+            # Close or trim only the positions that breached a risk limit on this bar
+            targets, reasons = self.risk.pop_targets()
+            if targets:
+                self.ReduceRisk(targets, reasons)
+
+    def OnOrderEvent(self, orderEvent):
+        """Called for every order update. Fills keep the risk monitor's positions and cash current."""
+        if orderEvent.Status in (OrderStatus.Filled, OrderStatus.PartiallyFilled) and orderEvent.Symbol in self.tickerBySymbol:
+            self.risk.on_fill(self.tickerBySymbol[orderEvent.Symbol], float(orderEvent.FillQuantity), float(orderEvent.FillPrice), float(self.Portfolio.Cash))
+
+    def LogTimings(self):
+        """Called by Schedule function every month when profiling, logs timings so far."""
+        self.Log("Timings at {}\n{}\nHistory cache: {} requests, {} served without calling History".format(
+            self.Time, self.profiler.summary(), self.history_cache.requests, self.history_cache.hits))
+
+    def OnEndOfAlgorithm(self):
+        """Called once when the algorithm finishes. Saves the full timing histograms to the ObjectStore when profiling."""
+        if self.checkpoint_key:
+            self.SaveCheckpoint()
+        if self.profiler.enabled:
+            self.LogTimings()
+            self.ObjectStore.Save("timings", json.dumps(self.profiler.to_dict()))
         
     def TrainModel(self, startyear, numyears):
         """Method to train model. Should only be called once at initialisation unless update needed.
         Note the model cluster assingments may change if argument random_state is not fixed.
         :param int startyear: Start year of training data in YYYY format
         :param int years: Number of years of training data to use
-        :return sklearn GMM model: trained model
+        :return RegimeScorer: trained model, reduced to what prediction needs
         """
+        key = model_cache.cache_key(startyear, numyears, self.feature_sources.symbols(), self.model_params, self.risk_free_rate)
+        self.model_key = key
+        cached = self.model_cache.load(key)
+        if cached is not None:
+            self.Debug('Loaded cached model {}'.format(key))
+            # The sklearn model is only rebuilt from the cache if it is retrained
+            self.training_features, scorer, self.mixture = cached
+            return scorer
+
+        # sklearn is only needed to fit, so it is imported here rather than at module load
+        from sklearn import mixture
+
         self.Debug(str(('Start training at {}'.format(self.Time))))
         self.model_training = True
         
-        # We want historic data grouped by month. Can do this by requesting data for one month at a time or slicing the whole history array using datetime indices. Here, we will request a month at a time.
-        years = map(str, range(startyear, startyear+numyears+1))
-        months = map(str, range(1, 13))
-        
-        # Save data for training
-        spy_returns = []
-        spy_volatilities = []
-        vix_volatilities = []
-        spy_sharpes = []
-        spy_momentums = []
-        interest_rates = []
-
-        # Use S&P as market data
-        for year in years:
-            for month in months:
-                self.mom_window.Reset()
-                # Month start
-                start_date_str = year + " " + month + " 01"
-                start_date = Time.ParseDate(start_date_str)
-                # Month end
-                end_date_str = year + " " + month + " 30"
-                end_date = Time.ParseDate(end_date_str)
-                # Get history of all securities
-                history = history = self.History(self.Securities.Keys, start_date, end_date, Resolution.Daily)
-
-                #1. Monthly return of SPY (percent)
-                market_return = history.loc["spy"].close.pct_change().dropna().mean()
-                market_return = market_return * 100
-                spy_returns.append(market_return)
-                #2. Monthly volatility of SPY (percent)
-                market_volatility = history.loc["spy"].close.pct_change().dropna().std()
-                market_volatility = market_volatility * 100
-                spy_volatilities.append(market_volatility)
-                #3. Monthly VIX average for volatility
-                vix_volatilities.append(history.loc["vix"].close.dropna().mean())
-                #4. Sharpe ratio of SPY
-                sharpe_ratio = (market_return - self.risk_free_rate) / market_volatility
-                spy_sharpes.append(sharpe_ratio)
-                #5. Monthly average day to day momentum of market
-                for time, price in history.loc["spy"]["close"].items():
-                    self.manual_mom.Update(time, price)
-                momentum_list = [item.Value for item in self.mom_window]
-                if momentum_list:
-                    spy_momentums.append(statistics.fmean(momentum_list))
-                else: # No data, act as if neutral
-                    spy_momentums.append(0)
-                #6. US federal reserve 30-day AA asset-backed commercial paper interest rate (percent)
-                interest30_history = self.History(self.interest30, start_date, end_date, Resolution.Daily)
-                interest_rates.append(interest30_history["value"].dropna().mean())
+        # Request the whole training range once per data source, then group it by month
+        start_date = datetime(startyear, 1, 1)
+        end_date = datetime(startyear + numyears, 12, 31)
+        sources = self.feature_sources.history(start_date, end_date, Resolution.Daily)
+        months = pd.period_range(start_date, end_date, freq="M")
 
         # 2D array: years*12 x n where n is number of predictive variables
-        data = list(zip(spy_returns, spy_volatilities, vix_volatilities, spy_sharpes, spy_momentums, interest_rates))
+        # Months after the current algorithm time have no history, so only complete months are kept
+        self.training_features = features.monthly_features(sources["spy"], sources["vix"], sources["interest30"], self.risk_free_rate, months).dropna()
+        data = self.training_features.to_numpy()
 
         ## Scale data option
         # data = np.array(data)
@@ -205,45 +334,181 @@ class TradingStrategy(QCAlgorithm):
         # data_scaled = scaler.transform(data)
 
         # Train model
-        model = mixture.BayesianGaussianMixture(n_components=4, covariance_type='full', weight_concentration_prior=1, random_state=0).fit(data)
+        model = mixture.BayesianGaussianMixture(**self.model_params).fit(data)
         self.Log(str(model.means_))
         self.Log(str(model.covariances_))
+        self.model_cache.save(key, self.training_features, model)
         self.model_training = False
-        return model
+        self.mixture = model
+
+        # Predict with the numpy scorer, which gives the same labels without going through sklearn
+        scorer = regime.RegimeScorer.from_model(model)
+        if not np.array_equal(scorer.predict(data), model.predict(data)):
+            self.Error('Regime scorer disagrees with the fitted model on the training data')
+        return scorer
+
+    def LoadSelectedModel(self, key):
+        """Load a model saved by offline/selection.py, falling back to training the default model if it is missing.
+        :param str key: ObjectStore key of the selected model
+        :return RegimeScorer: selected model
+        """
+        cached = self.model_cache.load(key)
+        if cached is None:
+            self.Error('Selected model {} not found, training the default model'.format(key))
+            return self.TrainModel(2001, 21)
+        # Labels are regimes only for models with the default component count, relabelled by offline/selection.py
+        if cached[1].n_components != self.model_params['n_components']:
+            self.Error('Selected model {} has {} components, not {}, training the default model'.format(key, cached[1].n_components, self.model_params['n_components']))
+            return self.TrainModel(2001, 21)
+        self.Debug('Loaded selected model {}'.format(key))
+        self.model_key = key
+        self.training_features, scorer, self.mixture = cached
+        return scorer
+
+    def RetrainModel(self):
+        """Called by Train every month when the retrain parameter is set.
+        Appends the month just completed to the training features and refits from the current model parameters with
+        warm start, which takes a few EM iterations instead of a full fit. Regime labels of the refitted model are
+        matched to the current ones, and the new model replaces the old one in a single assignment.
+        Retrained models are kept in memory only, so a later backtest never loads a model fitted on its future.
+        """
+        month = pd.Period(self.Time, freq="M") - 1
+        if month in self.training_features.index:
+            return
+        from sklearn import mixture
+
+        # Two earlier months give the momentum feature its full lookback
+        start_date = (month - 2).start_time.to_pydatetime()
+        end_date = month.end_time.to_pydatetime()
+        sources = self.feature_sources.history(start_date, end_date, Resolution.Daily)
+        try:
+            month_features = features.monthly_features(sources["spy"], sources["vix"], sources["interest30"], self.risk_free_rate, pd.PeriodIndex([month])).dropna()
+        except KeyError:
+            month_features = None
+        if month_features is None or month_features.empty:
+            self.Debug('No complete features for {}, model not retrained'.format(month))
+            return
+        training_features = pd.concat([self.training_features, month_features])
+
+        if self.mixture is None:
+            # A model refitted before a checkpoint comes from the checkpoint, otherwise from the model cache
+            cached = model_cache.loads(self.mixture_payload, mixture.BayesianGaussianMixture) if self.mixture_payload is not None else self.model_cache.load(self.model_key, mixture.BayesianGaussianMixture)
+            self.mixture = cached[2]
+        # Fit a copy so the current model stays usable until the new one is ready
+        model = copy.deepcopy(self.mixture)
+        model.set_params(warm_start=True)
+        # Selected models may have been fitted on standardised features, which keep their original scaling
+        data = self.model.scale_features(training_features.to_numpy())
+        model.fit(data)
+        scorer, order = regime.align(self.model, regime.RegimeScorer.from_model(model, self.model.feature_mean, self.model.feature_scale), data.std(axis=0))
+        self.Debug('Retrained on {} months to {} in {} iterations, component order {}'.format(len(training_features), month, model.n_iter_, order.tolist()))
+
+        self.mixture, self.training_features = model, training_features
+        self.model = scorer
+        self.model_retrained = True
+
+    def CheckpointState(self):
+        """Everything the algorithm carries between bars, as a flat mapping of names to numpy arrays."""
+        arrays = {
+            "time": checkpoint.to_ns(self.Time),
+            "portfolio_value": np.array(float(self.Portfolio.TotalPortfolioValue)),
+            "tickers": np.array(self.ticker, dtype=str),
+            "weights": np.array([self.weightBySymbol.get(ticker, 0.0) for ticker in self.ticker], dtype=float),
+            "scalars": np.array([self.market_condition, self.previous_value, self.first_iteration, getattr(self, 'portfolio_returns', np.nan)], dtype=float),
+            "model_key": np.array(self.model_key),
+            "model_params": np.array(json.dumps(self.model_params)),
+            "training_features": self.training_features.to_numpy(),
+            "training_months": self.training_features.index.asi8,
+            "mom_times": np.array([np.datetime64(time, "ns").astype(np.int64) for time, _ in self.mom_prices], dtype=np.int64),
+            "mom_prices": np.array([price for _, price in self.mom_prices], dtype=float),
+            "mom_window_times": np.array([np.datetime64(item.Time, "ns").astype(np.int64) for item in self.mom_window], dtype=np.int64),
+            "mom_window_values": np.array([item.Value for item in self.mom_window], dtype=float),
+        }
+        arrays.update(self.model.to_arrays("model."))
+        if self.model_retrained:
+            payload = model_cache.dumps(self.training_features, self.mixture, self.model) if self.mixture is not None else self.mixture_payload
+            arrays["mixture"] = np.frombuffer(payload, dtype=np.uint8)
+        arrays.update(self.bars.to_arrays("bars."))
+        arrays.update(self.macd.to_arrays("macd."))
+        arrays.update(self.risk.to_arrays("risk."))
+        return arrays
+
+    def SaveCheckpoint(self):
+        """Called by Schedule function every day when checkpointing, and at the end of the algorithm."""
+        if self.IsWarmingUp or self.model_training:
+            return
+        self.checkpoint_store.save(self.checkpoint_key, checkpoint.dumps(self.CheckpointState()))
+
+    def LoadCheckpoint(self):
+        """Restore the state saved by SaveCheckpoint, if there is a usable checkpoint.
+        Live algorithms keep their brokerage holdings, which LEAN loads after Initialize, so the risk monitor is synced
+        to them by SyncRisk on the first bar. A backtest cannot restore holdings, so a resumed backtest starts
+        the day after the checkpoint with its portfolio value in cash and buys the checkpointed weights on the first bar.
+        :return bool: whether the algorithm was restored, False leaves it as Initialize set it up
+        """
+        try:
+            arrays = checkpoint.loads(self.checkpoint_store.read(self.checkpoint_key)) if self.checkpoint_store.contains(self.checkpoint_key) else None
+        except (ValueError, KeyError, OSError):
+            arrays = None
+        if arrays is None:
+            return False
+        scorer = regime.RegimeScorer.from_arrays(arrays, "model.")
+        if scorer is None or json.loads(str(arrays["model_params"])) != self.model_params or arrays["tickers"].tolist() != self.ticker:
+            self.Debug('Checkpoint {} does not match this algorithm, starting from scratch'.format(self.checkpoint_key))
+            return False
+        if not (self.bars.restore(arrays, "bars.") and self.macd.restore(arrays, "macd.") and self.risk.restore(arrays, "risk.")):
+            self.Debug('Checkpoint {} is for another universe, starting from scratch'.format(self.checkpoint_key))
+            return False
+
+        self.model = scorer
+        self.model_key = str(arrays["model_key"])
+        self.training_features = pd.DataFrame(arrays["training_features"], index=pd.PeriodIndex.from_ordinals(arrays["training_months"], freq="M"), columns=features.FEATURES)
+        self.mixture = None
+        self.model_retrained = "mixture" in arrays
+        self.mixture_payload = arrays["mixture"].tobytes() if self.model_retrained else None
+
+        self.weightBySymbol = dict(zip(self.ticker, arrays["weights"].tolist()))
+        market_condition, self.previous_value, first_iteration, portfolio_returns = arrays["scalars"].tolist()
+        self.market_condition = int(market_condition)
+        self.first_iteration = bool(first_iteration)
+        if not np.isnan(portfolio_returns):
+            self.portfolio_returns = portfolio_returns
+
+        # Replaying the prices last fed to the momentum indicator leaves it in the same state
+        self.manual_mom.Reset()
+        self.mom_prices.clear()
+        for time, price in zip(arrays["mom_times"], arrays["mom_prices"]):
+            self.manual_mom.Update(checkpoint.from_ns(time), float(price))
+            self.mom_prices.append((checkpoint.from_ns(time), float(price)))
+        self.mom_window.Reset()
+        # RollingWindow iterates newest first
+        for time, value in zip(arrays["mom_window_times"][::-1], arrays["mom_window_values"][::-1]):
+            self.mom_window.Add(IndicatorDataPoint(checkpoint.from_ns(time), float(value)))
+
+        saved = checkpoint.from_ns(arrays["time"])
+        if not self.LiveMode:
+            next_day = saved.date() + timedelta(days=1)
+            if datetime(next_day.year, next_day.month, next_day.day) > self.StartDate:
+                self.SetStartDate(next_day.year, next_day.month, next_day.day)
+            self.SetCash(float(arrays["portfolio_value"]))
+            self.first_iteration = True
+        self.risk_sync_pending = True
+        self.Debug('Restored checkpoint {} from {}'.format(self.checkpoint_key, saved))
+        return True
 
     def PredictModel(self):
         """Predict on one datapoint averaged from data from one month."""
         # Reset momentum rolling window
         self.mom_window.Reset()
-        # Get history of all securities
-        history = self.History(self.Securities.Keys, 30, Resolution.Daily)
-        # Initialise test dataset - 1xn where n is number of predictive variables
-        test_data = np.empty((1,6))
-
-        #1. Monthly return of SPY (percent)
-        market_return = history.loc["spy"].close.pct_change().dropna().mean()
-        market_return = market_return * 100
-        test_data[0,0] = market_return
-        #2. Monthly volatility of SPY (percent)
-        market_volatility = history.loc["spy"].close.pct_change().dropna().std()
-        market_volatility = market_volatility * 100
-        test_data[0,1] = market_volatility
-        #3. Monthly VIX average for volatility
-        vix = history.loc["vix"].close.mean()
-        test_data[0,2] = vix
-        #4. Sharpe ratio of SPY
-        sharpe_ratio = (market_return - self.risk_free_rate) / market_volatility
-        test_data[0,3] = sharpe_ratio
-        #5. Momentum of SPY
-        for time, price in history.loc["spy"]["close"].items():
+        # Get history of the feature data sources only
+        sources = self.feature_sources.window(30, Resolution.Daily)
+        # Stream SPY closes through the momentum indicator, which keeps its state between months
+        for time, price in sources["spy"].items():
             self.manual_mom.Update(time, price)
+            self.mom_prices.append((time, price))
         momentum_list = [item.Value for item in self.mom_window]
-        if momentum_list:
-            test_data[0,4] = statistics.fmean(momentum_list)
-        else: # No data, act as if neutral
-            test_data[0,4] = 0
-        #6. 30-day AA asset-backed commercial paper interest rate (percent)
-        interest30_history = self.History(self.interest30, 30, Resolution.Daily)
-        test_data[0,5] = interest30_history["value"].dropna().mean()
+
+        # Test dataset - 1xn where n is number of predictive variables
+        test_data = features.window_features(sources["spy"], sources["vix"], sources["interest30"], self.risk_free_rate, momentum_list)
 
         return self.model.predict(test_data)[0]
@@ -0,0 +1,197 @@
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import features
+import regime
+
+# Bump when the on-disk layout changes, entries written by other versions are ignored and pruned
+CACHE_VERSION = 3
+KEY_PREFIX = "regime-model"
+
+class ObjectStoreBackend:
+    """Cache storage in the QuantConnect ObjectStore."""
+    def __init__(self, object_store):
+        self.object_store = object_store
+
+    def contains(self, key):
+        return self.object_store.ContainsKey(key)
+
+    def read(self, key):
+        return bytes(self.object_store.ReadBytes(key))
+
+    def save(self, key, data):
+        self.object_store.SaveBytes(key, bytearray(data))
+
+    def delete(self, key):
+        self.object_store.Delete(key)
+
+    def keys(self):
+        return [str(item.Key) for item in self.object_store]
+
+class FileBackend:
+    """Cache storage in a local directory, used by the offline harness."""
+    def __init__(self, directory, extension=".npz"):
+        """
+        :param str directory: directory the entries are written to
+        :param str extension: file extension of the entries, matching their format
+        """
+        self.directory = directory
+        self.extension = extension
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace("/", "_") + self.extension)
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def read(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def save(self, key, data):
+        # Write then rename so a crash never leaves a truncated entry behind
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def delete(self, key):
+        os.remove(self._path(key))
+
+    def keys(self):
+        return [name[:-len(self.extension)].replace("_", "/", 1) for name in os.listdir(self.directory) if name.endswith(self.extension)]
+
+def cache_key(startyear, numyears, tickers, model_params, risk_free_rate):
+    """Key identifying a training run. Any change to its inputs gives a new key.
+    :param int startyear: start year of training data
+    :param int numyears: number of years of training data
+    :param list[str] tickers: tickers the features are computed from
+    :param dict model_params: mixture model hyperparameters
+    :param float risk_free_rate: risk free rate used in the sharpe feature
+    :return str: object store key
+    """
+    definition = {
+        "version": CACHE_VERSION,
+        "startyear": startyear,
+        "numyears": numyears,
+        "tickers": list(map(str, tickers)),
+        "features": features.FEATURES,
+        "feature_version": features.FEATURE_VERSION,
+        "model_params": model_params,
+        "risk_free_rate": risk_free_rate,
+    }
+    digest = hashlib.sha1(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+    return "{}/{}".format(KEY_PREFIX, digest[:16])
+
+def dumps(feature_matrix, model, scorer=None):
+    """Serialise a monthly feature matrix and a fitted mixture model to bytes.
+    The payload holds both the sklearn model and its regime.RegimeScorer, so predicting never needs sklearn.
+    :param DataFrame feature_matrix: output of features.monthly_features
+    :param BayesianGaussianMixture model: fitted model
+    :param RegimeScorer scorer: scorer to store, built from model if not given, e.g. to keep feature scaling
+    :return bytes: compressed npz payload
+    """
+    arrays = {
+        "features": feature_matrix.to_numpy(),
+        "months": feature_matrix.index.astype(str).to_numpy(dtype=str),
+    }
+    arrays.update((scorer or regime.RegimeScorer.from_model(model)).to_arrays("scorer."))
+    fitted = []
+    # Fitted sklearn attributes end with an underscore, tuples are stored element by element
+    for name, value in vars(model).items():
+        if not name.endswith("_") or name.startswith("_"):
+            continue
+        if isinstance(value, tuple):
+            for i, item in enumerate(value):
+                arrays["model.{}.{}".format(name, i)] = np.asarray(item)
+            fitted.append([name, len(value)])
+        else:
+            arrays["model." + name] = np.asarray(value)
+            fitted.append([name, None])
+    meta = {"version": CACHE_VERSION, "feature_version": features.FEATURE_VERSION, "params": model.get_params(), "fitted": fitted}
+    arrays["meta"] = np.array(json.dumps(meta))
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def is_current(meta):
+    """Whether an entry's metadata is from this cache layout and feature definition."""
+    return meta.get("version") == CACHE_VERSION and meta.get("feature_version") == features.FEATURE_VERSION
+
+def read_meta(data):
+    """Metadata of a payload written by dumps, without reading its arrays."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return json.loads(str(arrays["meta"]))
+
+def loads(data, model_class=None):
+    """Inverse of dumps.
+    :param bytes data: payload written by dumps
+    :param type model_class: mixture model class to rebuild, or None to skip rebuilding the sklearn model
+    :return DataFrame, RegimeScorer, model: feature matrix, scorer and fitted model (None without model_class),
+        or None if the payload is from another cache version or feature definition
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays["meta"]))
+        if not is_current(meta):
+            return None
+        feature_matrix = pd.DataFrame(arrays["features"], index=pd.PeriodIndex(arrays["months"], freq="M"), columns=features.FEATURES)
+        scorer = regime.RegimeScorer.from_arrays(arrays, "scorer.")
+        if scorer is None:
+            return None
+        if model_class is None:
+            return feature_matrix, scorer, None
+        model = model_class(**meta["params"])
+        for name, length in meta["fitted"]:
+            if length is None:
+                value = arrays["model." + name]
+                # Scalars such as n_iter_ and converged_ come back as python values
+                setattr(model, name, value.item() if value.ndim == 0 else value)
+            else:
+                setattr(model, name, tuple(arrays["model.{}.{}".format(name, i)] for i in range(length)))
+    return feature_matrix, scorer, model
+
+class ModelCache:
+    """Versioned store of the training feature matrix and fitted regime model."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def load(self, key, model_class=None):
+        """Return (feature_matrix, scorer, model) for key, or None on a miss. model is None unless model_class is given."""
+        if not self.backend.contains(key):
+            return None
+        try:
+            return loads(self.backend.read(key), model_class)
+        except (ValueError, KeyError, OSError):
+            # Corrupt or foreign entry, treat as a miss so it gets rebuilt
+            return None
+
+    def save(self, key, feature_matrix, model, scorer=None):
+        """Store an entry and drop entries no version of the code can load any more."""
+        self.backend.save(key, dumps(feature_matrix, model, scorer))
+        self.prune(keep=key)
+
+    def prune(self, keep=None):
+        """Delete regime model entries from another cache version or feature definition, or that cannot be read.
+        Entries for other training years, tickers or hyperparameters are kept, so runs sharing an ObjectStore, such as
+        a parameter sweep, each keep their own model instead of evicting one another.
+        :param str keep: key to leave alone, the entry just written
+        :return list[str]: deleted keys
+        """
+        stale = []
+        for key in self.backend.keys():
+            if not key.startswith(KEY_PREFIX + "/") or key == keep:
+                continue
+            try:
+                current = is_current(read_meta(self.backend.read(key)))
+            except (ValueError, KeyError, OSError):
+                current = False
+            if not current:
+                self.backend.delete(key)
+                stale.append(key)
+        return stale
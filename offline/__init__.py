@@ -0,0 +1,12 @@
+"""Local replay of the QuantConnect algorithm on daily bars, without the QuantConnect cloud."""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def install():
+    """Register the offline API as AlgorithmImports and make the algorithm modules importable."""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from offline import qc
+    sys.modules.setdefault("AlgorithmImports", qc)
@@ -0,0 +1,138 @@
+"""Daily bar storage for the offline engine.
+
+Each ticker is a CSV file <TICKER>.csv in the data directory, with a date column followed by lowercase
+field columns (open, high, low, close, volume for trade data, value for Fred series). On first load each
+CSV is converted to .npy arrays under <data_dir>/.cache, which are then opened memory-mapped, so any
+number of processes can share one read-only copy of the dataset.
+
+Write a synthetic dataset for every ticker TradingStrategy subscribes to:
+    python -m offline.data data --synthetic --start 2000-01-01 --end 2023-03-01
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = ".cache"
+
+class DailyBars:
+    """Daily bars of one ticker, times as int64 nanoseconds and fields as a float64 matrix."""
+    def __init__(self, ticker, times, values, columns):
+        self.ticker = ticker
+        self.times = times
+        self.values = values
+        self.columns = columns
+        self.field_index = {column: i for i, column in enumerate(columns)}
+
+    def __len__(self):
+        return len(self.times)
+
+    def end_index(self, cutoff):
+        """Number of bars with time at or before cutoff (nanoseconds)."""
+        return int(np.searchsorted(self.times, cutoff, side="right"))
+
+    def frame(self, start, stop, symbol=None):
+        """Bars start:stop as a frame indexed by (symbol, time), like a History result."""
+        stop = max(start, stop)
+        # Building the index from levels and codes avoids factorizing the arrays again
+        index = pd.MultiIndex(
+            levels=[[symbol if symbol is not None else self.ticker], pd.to_datetime(np.asarray(self.times[start:stop]))],
+            codes=[np.zeros(stop - start, dtype=np.int64), np.arange(stop - start)],
+            names=["symbol", "time"], verify_integrity=False)
+        return pd.DataFrame(np.asarray(self.values[start:stop]), index=index, columns=self.columns)
+
+def _cache_paths(data_dir, ticker):
+    base = os.path.join(data_dir, CACHE_DIR, ticker)
+    return base + ".times.npy", base + ".values.npy", base + ".json"
+
+def convert(data_dir, ticker):
+    """Convert <ticker>.csv to the memory-mappable cache format."""
+    frame = pd.read_csv(os.path.join(data_dir, ticker + ".csv"), index_col=0, parse_dates=True).sort_index()
+    frame.columns = [str(column).lower() for column in frame.columns]
+    times_path, values_path, meta_path = _cache_paths(data_dir, ticker)
+    os.makedirs(os.path.dirname(times_path), exist_ok=True)
+    np.save(times_path, frame.index.as_unit("ns").asi8)
+    np.save(values_path, frame.to_numpy(dtype=float))
+    with open(meta_path, "w") as f:
+        json.dump({"columns": list(frame.columns)}, f)
+
+def load(data_dir, ticker):
+    """Open a ticker memory-mapped, converting its CSV first if the cache is missing or older.
+    :param str data_dir: dataset directory
+    :param str ticker: ticker, also the CSV file name
+    :return DailyBars: read-only bars
+    """
+    csv_path = os.path.join(data_dir, ticker + ".csv")
+    times_path, values_path, meta_path = _cache_paths(data_dir, ticker)
+    if not os.path.exists(meta_path) or (os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(meta_path)):
+        convert(data_dir, ticker)
+    with open(meta_path) as f:
+        columns = json.load(f)["columns"]
+    return DailyBars(ticker, np.load(times_path, mmap_mode="r"), np.load(values_path, mmap_mode="r"), columns)
+
+class DataSet:
+    """Lazily opened collection of DailyBars keyed by ticker."""
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.bars = {}
+
+    def __getitem__(self, ticker):
+        if ticker not in self.bars:
+            self.bars[ticker] = load(self.data_dir, ticker)
+        return self.bars[ticker]
+
+    def __contains__(self, ticker):
+        return ticker in self.bars or os.path.exists(os.path.join(self.data_dir, ticker + ".csv")) \
+            or os.path.exists(_cache_paths(self.data_dir, ticker)[2])
+
+    def preload(self, tickers):
+        """Open every ticker up front, converting any CSVs, before handing the dataset to worker processes."""
+        for ticker in tickers:
+            self[ticker]
+
+# Tickers TradingStrategy subscribes to, with the kind of data each one carries
+STRATEGY_TICKERS = {
+    "SPY": "trade", "TQQQ": "trade", "XAGUSD": "trade", "UBT": "trade", "UST": "trade",
+    "VIX": "trade", "RIFSPPAAAD30NB": "value", "USTYCR": "value",
+}
+
+def write_synthetic(data_dir, start, end, tickers=STRATEGY_TICKERS, seed=0):
+    """Write random-walk CSVs for tickers, so the engine can run without downloaded data."""
+    os.makedirs(data_dir, exist_ok=True)
+    days = pd.bdate_range(start, end)
+    rng = np.random.default_rng(seed)
+    for ticker, kind in tickers.items():
+        if kind == "value":
+            values = np.abs(2.0 + np.cumsum(rng.normal(0, 0.02, len(days))))
+            frame = pd.DataFrame({"value": values}, index=days)
+        else:
+            level = 20.0 if ticker == "VIX" else 100.0
+            close = level * np.exp(np.cumsum(rng.normal(0.0003, 0.012, len(days))))
+            spread = np.abs(rng.normal(0, 0.005, len(days))) * close
+            frame = pd.DataFrame({
+                "open": close * (1 + rng.normal(0, 0.002, len(days))),
+                "high": close + spread,
+                "low": close - spread,
+                "close": close,
+                "volume": rng.integers(1e5, 1e7, len(days)).astype(float),
+            }, index=days)
+        frame.index.name = "date"
+        frame.to_csv(os.path.join(data_dir, ticker + ".csv"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("--synthetic", action="store_true", help="write random-walk CSVs for the strategy tickers")
+    parser.add_argument("--start", default="2000-01-01")
+    parser.add_argument("--end", default="2023-03-01")
+    args = parser.parse_args()
+    if args.synthetic:
+        write_synthetic(args.data_dir, args.start, args.end)
+    # Build the memory-mapped cache for every CSV in the directory
+    dataset = DataSet(args.data_dir)
+    dataset.preload(name[:-len(".csv")] for name in os.listdir(args.data_dir) if name.endswith(".csv"))
+
+if __name__ == "__main__":
+    main()
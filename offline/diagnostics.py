@@ -0,0 +1,122 @@
+"""Cluster diagnostics of the fitted regime model, rendered headless to image files.
+
+    python -m offline.diagnostics --object-store results/objectstore --out diagnostics
+    python -m offline.diagnostics --key regime-selection/best
+    python -m offline.diagnostics --checkpoint checkpoints/state.ckpt
+
+The model and its training months are loaded from the cached model in an ObjectStore, from any other model_cache
+entry such as the one offline/selection.py saves, or from a checkpoint, which carries the model as last retrained.
+Component covariances and their projections onto every feature pair come from batched numpy calls, and one image
+per pair, with each component's ellipse over the training months coloured by regime, is rendered on a process pool.
+Writes <out>/<x>-<y>.png for every pair and <out>/components.csv with each component's weight, mean and the
+number of training months it labels.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import offline
+offline.install()
+from offline import qc
+import checkpoint
+import features
+import model_cache
+import regime
+import utils
+
+def cached_model(object_store_dir, key=None):
+    """Training feature matrix and scorer of a model_cache entry, the cached regime model by default."""
+    backend = model_cache.ObjectStoreBackend(qc.ObjectStore(object_store_dir))
+    if key is None:
+        keys = [name for name in backend.keys() if name.startswith(model_cache.KEY_PREFIX + "/")]
+        if not keys:
+            raise SystemExit("No cached regime model in {}, run a backtest first".format(object_store_dir))
+        key = keys[0]
+    cached = model_cache.ModelCache(backend).load(key)
+    if cached is None:
+        raise SystemExit("No usable model under {} in {}".format(key, object_store_dir))
+    feature_matrix, scorer, _ = cached
+    return feature_matrix, scorer
+
+def checkpoint_model(path):
+    """Training feature matrix and scorer saved in a checkpoint file."""
+    with open(path, "rb") as f:
+        arrays = checkpoint.loads(f.read())
+    scorer = regime.RegimeScorer.from_arrays(arrays, "model.") if arrays is not None else None
+    if scorer is None:
+        raise SystemExit("{} is not a checkpoint of this version".format(path))
+    months = pd.PeriodIndex.from_ordinals(arrays["training_months"], freq="M")
+    return pd.DataFrame(arrays["training_features"], index=months, columns=features.FEATURES), scorer
+
+# Set in each worker by _init_worker, so tasks only carry a pair index
+_job = None
+
+def _init_worker(job):
+    global _job
+    _job = job
+
+def _render(k):
+    job = _job
+    x, y = job["pairs"][k]
+    names = (job["names"][x], job["names"][y])
+    path = os.path.join(job["out"], "{}-{}.png".format(*names))
+    return utils.plot_pair(path, names, job["samples"][:, [x, y]], job["labels"], job["centres"][k], job["sizes"][k],
+                           job["angles"][k], job["weights"], job["dpi"])
+
+def report(feature_matrix, scorer, out, processes=None, dpi=100):
+    """Render every pairwise feature projection of the model and write the component summary.
+    :param DataFrame feature_matrix: training months x features
+    :param RegimeScorer scorer: fitted regime model
+    :param str out: output directory
+    :param int processes: worker processes, defaults to one per image up to every core
+    :param int dpi: image resolution
+    :return list[str]: image paths
+    """
+    import multiprocessing
+    os.makedirs(out, exist_ok=True)
+    samples = feature_matrix.to_numpy()
+    labels = scorer.predict(samples)
+    means, covariances = utils.component_covariances(scorer)
+    pairs = utils.feature_pairs(len(feature_matrix.columns))
+    centres, sizes, angles = utils.ellipses(means, covariances, pairs)
+
+    summary = pd.DataFrame(means, columns=feature_matrix.columns)
+    summary.insert(0, "months", np.bincount(labels, minlength=scorer.n_components))
+    summary.insert(0, "weight", scorer.weights)
+    summary.to_csv(os.path.join(out, "components.csv"), index_label="regime")
+
+    job = {"names": list(feature_matrix.columns), "pairs": pairs, "samples": samples, "labels": labels, "centres": centres,
+           "sizes": sizes, "angles": angles, "weights": scorer.weights, "out": out, "dpi": dpi}
+    processes = min(processes or os.cpu_count(), len(pairs))
+    if processes <= 1:
+        _init_worker(job)
+        return [_render(k) for k in range(len(pairs))]
+    with multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn").Pool(
+            processes, initializer=_init_worker, initargs=(job,)) as pool:
+        return pool.map(_render, range(len(pairs)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--object-store", default="results/objectstore", help="ObjectStore holding the model")
+    parser.add_argument("--key", default=None, help="model_cache entry to load, defaults to the cached regime model")
+    parser.add_argument("--checkpoint", default=None, help="load the model from this checkpoint file instead")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument("--dpi", type=int, default=100, help="image resolution")
+    parser.add_argument("--out", default="diagnostics", help="output directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.checkpoint:
+        feature_matrix, scorer = checkpoint_model(args.checkpoint)
+    else:
+        feature_matrix, scorer = cached_model(args.object_store, args.key)
+    paths = report(feature_matrix, scorer, args.out, args.processes, args.dpi)
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(pd.read_csv(os.path.join(args.out, "components.csv"), index_col="regime"))
+    print("{} images in {:.2f}s".format(len(paths), time.perf_counter() - started))
+
+if __name__ == "__main__":
+    main()
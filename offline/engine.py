@@ -0,0 +1,255 @@
+"""Daily event loop that runs a QCAlgorithm against a local DataSet.
+
+For every trading day of the benchmark:
+  1. scheduled events whose date rule matches and whose time is before the close run in time order, seeing
+     history up to yesterday's close; orders fill at the day's open price
+  2. the day's bars are applied and OnData runs at the close, followed by any events timed at or after the close;
+     orders fill at the close price
+  3. the close total portfolio value is appended to the equity curve
+Scheduled events are skipped while warming up and orders placed during warm up are ignored, as in LEAN.
+Orders pay an interactive brokers style fee of 0.005 per share, minimum 1, capped at 0.5% of trade value,
+and are rejected if the resulting margin used would exceed total portfolio value. Every fill is passed to OnOrderEvent.
+"""
+import time as timer
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from offline import qc
+
+MARKET_OPEN = timedelta(hours=9, minutes=30)
+MARKET_CLOSE = timedelta(hours=16)
+
+def _parameter_string(value):
+    """Parameters are strings in LEAN, lists become comma separated values."""
+    if isinstance(value, (list, tuple)):
+        return ",".join(map(str, value))
+    return str(value)
+
+class BacktestResult:
+    def __init__(self, algorithm, equity, trades, logs, runtime):
+        self.algorithm = algorithm
+        self.equity = equity
+        self.trades = trades
+        self.logs = logs
+        self.runtime = runtime
+
+    def summary(self):
+        """Headline statistics of the equity curve and trade log."""
+        equity = self.equity
+        returns = equity.pct_change().dropna()
+        drawdown = equity / equity.cummax() - 1
+        years = max((equity.index[-1] - equity.index[0]).days / 365.25, 1 / 365.25) if len(equity) else np.nan
+        traded_value = (self.trades["quantity"].abs() * self.trades["price"]).sum()
+        return {
+            "total_return": equity.iloc[-1] / equity.iloc[0] - 1 if len(equity) else np.nan,
+            "cagr": (equity.iloc[-1] / equity.iloc[0]) ** (1 / years) - 1 if len(equity) else np.nan,
+            "sharpe": returns.mean() / returns.std() * np.sqrt(252) if returns.std() > 0 else np.nan,
+            "max_drawdown": drawdown.min() if len(equity) else np.nan,
+            # Average traded value per year as a fraction of average equity
+            "turnover": traded_value / equity.mean() / years if len(equity) else np.nan,
+            "orders": len(self.trades),
+            "fees": self.trades["fee"].sum(),
+            "runtime": self.runtime,
+        }
+
+class Engine:
+    def __init__(self, dataset, object_store_dir, verbose=False, parameters=None, fee_per_share=0.005, min_fee=1.0, max_fee_rate=0.005):
+        """
+        :param DataSet dataset: daily bars for every ticker the algorithm subscribes to
+        :param str object_store_dir: directory backing the algorithm's ObjectStore
+        :param bool verbose: print Debug and Log messages as they are emitted
+        :param dict parameters: algorithm parameters returned by GetParameter
+        """
+        self.dataset = dataset
+        self.object_store = qc.ObjectStore(object_store_dir)
+        self.verbose = verbose
+        self.parameters = {name: _parameter_string(value) for name, value in (parameters or {}).items()}
+        self.fee_per_share = fee_per_share
+        self.min_fee = min_fee
+        self.max_fee_rate = max_fee_rate
+        self.algorithm = None
+        self.securities = []
+        self.cutoff = None
+        self.fill_field = "close"
+        self.trades = []
+        self.logs = []
+
+    # ===== Called by the algorithm =====
+    def subscribe(self, security):
+        self.securities.append(security)
+
+    def log(self, level, message):
+        self.logs.append((self.algorithm.Time if self.algorithm is not None else None, level, str(message)))
+        if self.verbose:
+            print("{} {} {}".format(self.algorithm.Time if self.algorithm is not None else "", level, message))
+
+    def price(self, symbol):
+        return self.algorithm.Securities[symbol].Price
+
+    def _cutoff_ns(self, end=None):
+        # During Initialize the cutoff follows the start date set by the algorithm
+        cutoff = self.cutoff if self.cutoff is not None else pd.Timestamp(self.algorithm.Time)
+        if end is not None:
+            cutoff = min(pd.Timestamp(end), cutoff)
+        return cutoff.value
+
+    def history_periods(self, symbols, periods):
+        frames = []
+        cutoff = self._cutoff_ns()
+        for symbol in symbols:
+            bars = self.dataset[symbol]
+            stop = bars.end_index(cutoff)
+            frames.append(bars.frame(max(0, stop - periods), stop, symbol))
+        return self._concat(frames)
+
+    def history_range(self, symbols, start, end):
+        frames = []
+        cutoff = self._cutoff_ns(end)
+        start = pd.Timestamp(start).value
+        for symbol in symbols:
+            bars = self.dataset[symbol]
+            frames.append(bars.frame(int(np.searchsorted(bars.times, start, side="left")), bars.end_index(cutoff), symbol))
+        return self._concat(frames)
+
+    @staticmethod
+    def _concat(frames):
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames)
+
+    def order(self, symbol, quantity, tag=""):
+        algorithm = self.algorithm
+        if algorithm.IsWarmingUp or quantity == 0:
+            return None
+        security = algorithm.Securities[symbol]
+        price = security.Open if self.fill_field == "open" and not np.isnan(security.Open) else security.Price
+        if not price or np.isnan(price):
+            self.log("ERROR", "No price for {}, order of {} ignored".format(symbol, quantity))
+            return None
+        holding = algorithm.Portfolio[symbol]
+        portfolio_value = algorithm.Portfolio.TotalPortfolioValue
+        margin_after = algorithm.Portfolio.TotalMarginUsed + (abs(holding.Quantity + quantity) - abs(holding.Quantity)) * price / security.Leverage
+        if margin_after > portfolio_value and abs(holding.Quantity + quantity) > abs(holding.Quantity):
+            self.log("ERROR", "Insufficient buying power for {} {} at {:.2f}".format(quantity, symbol, price))
+            return None
+        fee = min(max(self.min_fee, abs(quantity) * self.fee_per_share), self.max_fee_rate * abs(quantity) * price)
+        if holding.Quantity + quantity != 0 and np.sign(holding.Quantity + quantity) == np.sign(quantity):
+            # Average price only moves when adding to or flipping a position
+            if np.sign(holding.Quantity) == np.sign(quantity):
+                holding.AveragePrice = (holding.AveragePrice * holding.Quantity + price * quantity) / (holding.Quantity + quantity)
+            else:
+                holding.AveragePrice = price
+        holding.Quantity += quantity
+        algorithm.Portfolio.Cash -= quantity * price + fee
+        algorithm.Portfolio.TotalFees += fee
+        self.trades.append((algorithm.Time, symbol, quantity, price, fee, tag))
+        algorithm.OnOrderEvent(qc.OrderEvent(symbol, qc.OrderStatus.Filled, quantity, price, algorithm.Time))
+        return quantity
+
+    def order_target_value(self, symbol, value, tag=""):
+        security = self.algorithm.Securities[symbol]
+        price = security.Open if self.fill_field == "open" and not np.isnan(security.Open) else security.Price
+        if not price or np.isnan(price):
+            return None
+        # Whole units only, rounded towards zero like LEAN's lot size handling
+        quantity = np.trunc(value / price) - self.algorithm.Portfolio[symbol].Quantity
+        return self.order(symbol, quantity, tag)
+
+    # ===== Event loop =====
+    def _calendar(self, algorithm):
+        benchmark = algorithm.Benchmark.symbol if algorithm.Benchmark is not None else self.securities[0].Symbol
+        times = np.asarray(self.dataset[benchmark].times)
+        start = int(np.searchsorted(times, pd.Timestamp(algorithm.StartDate).value, side="left"))
+        stop = int(np.searchsorted(times, pd.Timestamp(algorithm.EndDate).value, side="right"))
+        first = max(0, start - algorithm.warm_up_periods)
+        return pd.to_datetime(times[first:stop]), start - first
+
+    def _rule_matches(self, rule, calendar, i):
+        if rule.name == "EveryDay":
+            return True
+        if i == 0:
+            return True
+        previous, current = calendar[i - 1], calendar[i]
+        if rule.name == "MonthStart":
+            return (previous.year, previous.month) != (current.year, current.month)
+        if rule.name == "WeekStart":
+            return previous.isocalendar()[:2] != current.isocalendar()[:2]
+        raise ValueError("Unsupported date rule {}".format(rule.name))
+
+    def initialize(self, algorithm_class):
+        """Create the algorithm and run its Initialize."""
+        algorithm = algorithm_class(self)
+        self.algorithm = algorithm
+        self.cutoff = None
+        algorithm.Initialize()
+        return algorithm
+
+    def run(self, algorithm_class):
+        started = timer.perf_counter()
+        algorithm = self.initialize(algorithm_class)
+
+        calendar, warm_up_days = self._calendar(algorithm)
+        calendar_ns = calendar.asi8
+        # Position of each security's bar for every calendar day, -1 where it has none
+        positions = []
+        for security in self.securities:
+            bars = self.dataset[security.Symbol]
+            index = np.searchsorted(bars.times, calendar_ns, side="left")
+            found = index < len(bars)
+            found[found] = np.asarray(bars.times)[index[found]] == calendar_ns[found]
+            positions.append(np.where(found, index, -1))
+
+        events = sorted(algorithm.Schedule.events, key=lambda event: event[1].TimeOfDay)
+        equity = []
+        for i, day in enumerate(calendar):
+            algorithm.IsWarmingUp = i < warm_up_days
+            # Open, values seen are yesterday's closes and today's open
+            for security, position in zip(self.securities, positions):
+                bars = self.dataset[security.Symbol]
+                security.Open = bars.values[position[i], bars.field_index["open"]] if position[i] >= 0 and "open" in bars.field_index else np.nan
+            self.cutoff = day - pd.Timedelta(1, "ns")
+            algorithm.Time = (day + MARKET_OPEN).to_pydatetime()
+            if not algorithm.IsWarmingUp:
+                self.fill_field = "open"
+                # Events before the close run at the open in time of day order, events from the close on run after OnData
+                for date_rule, time_rule, callback in events:
+                    if time_rule.TimeOfDay < MARKET_CLOSE and self._rule_matches(date_rule, calendar, i):
+                        algorithm.Time = (day + time_rule.TimeOfDay).to_pydatetime()
+                        callback()
+                algorithm.Time = (day + MARKET_OPEN).to_pydatetime()
+
+            # Close, apply today's bars and call OnData
+            self.cutoff = day
+            algorithm.Time = (day + MARKET_CLOSE).to_pydatetime()
+            self.fill_field = "close"
+            bars_today = {}
+            for security, position in zip(self.securities, positions):
+                if position[i] < 0:
+                    continue
+                bars = self.dataset[security.Symbol]
+                fields = dict(zip(bars.columns, np.asarray(bars.values[position[i]])))
+                bar = qc.TradeBar(security.Symbol, algorithm.Time, fields)
+                security.Price = bar.Close
+                security.HasData = True
+                bars_today[security.Symbol] = bar
+            algorithm.OnData(qc.Slice(algorithm.Time, bars_today))
+            if not algorithm.IsWarmingUp:
+                for date_rule, time_rule, callback in events:
+                    if time_rule.TimeOfDay >= MARKET_CLOSE and self._rule_matches(date_rule, calendar, i):
+                        algorithm.Time = (day + time_rule.TimeOfDay).to_pydatetime()
+                        callback()
+                algorithm.Time = (day + MARKET_CLOSE).to_pydatetime()
+            if not algorithm.IsWarmingUp:
+                equity.append((day, algorithm.Portfolio.TotalPortfolioValue))
+
+        algorithm.OnEndOfAlgorithm()
+        equity = pd.Series([value for _, value in equity], index=pd.DatetimeIndex([day for day, _ in equity], name="time"), name="equity")
+        trades = pd.DataFrame(self.trades, columns=["time", "symbol", "quantity", "price", "fee", "tag"])
+        return BacktestResult(algorithm, equity, trades, self.logs, timer.perf_counter() - started)
+
+def run(algorithm_class, dataset, object_store_dir, verbose=False, parameters=None):
+    """Run a backtest of algorithm_class and return its BacktestResult."""
+    return Engine(dataset, object_store_dir, verbose, parameters).run(algorithm_class)
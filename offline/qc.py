@@ -0,0 +1,477 @@
+"""Stand-in for the small part of QuantConnect's AlgorithmImports that this project uses.
+
+offline.install() registers this module as AlgorithmImports, so main.py, rebalance.py and strategies.py
+import unchanged. Symbols are plain ticker strings. The engine that drives a QCAlgorithm through time is in
+offline/engine.py.
+"""
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+
+__all__ = [
+    "QCAlgorithm", "Resolution", "CBOE", "Fred", "USTreasuryYieldCurveRate", "Momentum", "RollingWindow",
+    "IndicatorDataPoint", "Slice", "TradeBar", "PortfolioTarget", "OrderStatus", "OrderEvent", "datetime", "timedelta",
+]
+
+class Resolution:
+    Minute = "Minute"
+    Hour = "Hour"
+    Daily = "Daily"
+
+class CBOE:
+    """CBOE index data, stored with trade bar columns."""
+
+class Fred:
+    """Federal Reserve economic data, stored with a single value column."""
+    class CommercialPaper:
+        Three0DayAAAssetbackedCommercialPaperInterestRate = "RIFSPPAAAD30NB"
+
+class USTreasuryYieldCurveRate:
+    """US Treasury yield curve data, stored with a single value column."""
+
+class IndicatorDataPoint:
+    def __init__(self, time, value):
+        self.Time = time
+        self.EndTime = time
+        self.Value = value
+
+class _Event:
+    """C# style event, handlers are attached with +=."""
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self, sender, value):
+        for handler in self.handlers:
+            handler(sender, value)
+
+class RollingWindow:
+    """Fixed size window, indexed and iterated newest first. RollingWindow[T](size) works as in LEAN."""
+    def __class_getitem__(cls, item):
+        return cls
+
+    def __init__(self, size):
+        self.Size = size
+        self.items = deque(maxlen=size)
+
+    def Add(self, item):
+        self.items.appendleft(item)
+
+    def Reset(self):
+        self.items.clear()
+
+    @property
+    def Count(self):
+        return len(self.items)
+
+    @property
+    def IsReady(self):
+        return len(self.items) == self.Size
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+class Momentum:
+    """Price change over period bars. Until ready it returns the change since the first price."""
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period + 1)
+        self.Updated = _Event()
+        self.Current = IndicatorDataPoint(None, 0.0)
+        self.Samples = 0
+
+    @property
+    def IsReady(self):
+        return self.Samples > self.period
+
+    @property
+    def WarmUpPeriod(self):
+        return self.period + 1
+
+    def Update(self, time, value):
+        self.window.append(float(value))
+        self.Samples += 1
+        self.Current = IndicatorDataPoint(time, self.window[-1] - self.window[0])
+        self.Updated.fire(self, self.Current)
+        return self.IsReady
+
+    def Reset(self):
+        self.window.clear()
+        self.Samples = 0
+        self.Current = IndicatorDataPoint(None, 0.0)
+
+class TradeBar:
+    def __init__(self, symbol, time, fields):
+        self.Symbol = symbol
+        self.Time = time
+        self.EndTime = time
+        self.Open = fields.get("open", np.nan)
+        self.High = fields.get("high", np.nan)
+        self.Low = fields.get("low", np.nan)
+        self.Close = fields.get("close", fields.get("value", np.nan))
+        self.Volume = fields.get("volume", 0.0)
+        self.Value = fields.get("value", self.Close)
+        self.Price = self.Value
+
+class Slice:
+    """Bars received at one time step, keyed by symbol."""
+    def __init__(self, time, bars):
+        self.Time = time
+        self.Bars = bars
+
+    def ContainsKey(self, symbol):
+        return symbol in self.Bars
+
+    def __contains__(self, symbol):
+        return symbol in self.Bars
+
+    def __getitem__(self, symbol):
+        return self.Bars[symbol]
+
+    def get(self, symbol, default=None):
+        return self.Bars.get(symbol, default)
+
+    def Keys(self):
+        return list(self.Bars)
+
+class PortfolioTarget:
+    """Target for one symbol. Passed to SetHoldings, Quantity is a portfolio weight."""
+    def __init__(self, symbol, quantity):
+        self.Symbol = symbol
+        self.Quantity = quantity
+
+class OrderStatus:
+    Submitted = "Submitted"
+    PartiallyFilled = "PartiallyFilled"
+    Filled = "Filled"
+    Invalid = "Invalid"
+
+class OrderEvent:
+    """Fill of one order, passed to OnOrderEvent. Orders fill completely, so Status is always Filled."""
+    def __init__(self, symbol, status, fill_quantity, fill_price, time):
+        self.Symbol = symbol
+        self.Status = status
+        self.FillQuantity = fill_quantity
+        self.FillPrice = fill_price
+        self.UtcTime = time
+
+class Security:
+    def __init__(self, symbol, kind):
+        self.Symbol = symbol
+        self.kind = kind
+        self.Price = 0.0
+        self.Open = np.nan
+        self.Leverage = 1.0
+        self.HasData = False
+
+    def SetLeverage(self, leverage):
+        self.Leverage = float(leverage)
+
+class _Securities(dict):
+    @property
+    def Keys(self):
+        return list(self.keys())
+
+class SecurityHolding:
+    def __init__(self, security):
+        self.security = security
+        self.Quantity = 0.0
+        self.AveragePrice = 0.0
+
+    @property
+    def HoldingsValue(self):
+        return self.Quantity * self.security.Price
+
+    @property
+    def AbsoluteHoldingsValue(self):
+        return abs(self.HoldingsValue)
+
+    @property
+    def Invested(self):
+        return self.Quantity != 0
+
+class SecurityPortfolioManager(dict):
+    """Holdings keyed by symbol, plus cash."""
+    def __init__(self):
+        super().__init__()
+        self.Cash = 0.0
+        self.TotalFees = 0.0
+
+    @property
+    def Keys(self):
+        return list(self.keys())
+
+    @property
+    def TotalHoldingsValue(self):
+        return sum(holding.HoldingsValue for holding in self.values())
+
+    @property
+    def TotalAbsoluteHoldingsValue(self):
+        return sum(holding.AbsoluteHoldingsValue for holding in self.values())
+
+    @property
+    def TotalPortfolioValue(self):
+        return self.Cash + self.TotalHoldingsValue
+
+    @property
+    def TotalMarginUsed(self):
+        return sum(holding.AbsoluteHoldingsValue / holding.security.Leverage for holding in self.values())
+
+    @property
+    def Invested(self):
+        return any(holding.Invested for holding in self.values())
+
+class ObjectStore:
+    """ObjectStore backed by a local directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace("/", "%2F"))
+
+    def ContainsKey(self, key):
+        return os.path.exists(self._path(key))
+
+    def ReadBytes(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def SaveBytes(self, key, data):
+        # Write then rename, so processes sharing the directory never read a partial file
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(bytes(data))
+        os.replace(path + ".tmp", path)
+        return True
+
+    def Read(self, key):
+        return self.ReadBytes(key).decode()
+
+    def Save(self, key, text):
+        return self.SaveBytes(key, text.encode())
+
+    def Delete(self, key):
+        if self.ContainsKey(key):
+            os.remove(self._path(key))
+            return True
+        return False
+
+    def __iter__(self):
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".tmp"):
+                continue
+            yield _KeyValue(name.replace("%2F", "/"))
+
+class _KeyValue:
+    def __init__(self, key):
+        self.Key = key
+
+class _DateRule:
+    def __init__(self, name, symbol):
+        self.name = name
+        self.symbol = symbol
+
+class _TimeRule:
+    def __init__(self, name, symbol, minutes=0):
+        self.name = name
+        self.symbol = symbol
+        self.minutes = minutes
+
+    @property
+    def TimeOfDay(self):
+        """Time after midnight the event fires, market hours are 9:30 to 16:00 every day."""
+        if self.name == "AfterMarketOpen":
+            return timedelta(hours=9, minutes=30 + self.minutes)
+        return timedelta(minutes=self.minutes)
+
+class DateRules:
+    def MonthStart(self, symbol=None, daysOffset=0):
+        return _DateRule("MonthStart", symbol)
+
+    def WeekStart(self, symbol=None, daysOffset=0):
+        return _DateRule("WeekStart", symbol)
+
+    def EveryDay(self, symbol=None):
+        return _DateRule("EveryDay", symbol)
+
+class TimeRules:
+    def AfterMarketOpen(self, symbol=None, minutesAfterOpen=0):
+        return _TimeRule("AfterMarketOpen", symbol, minutesAfterOpen)
+
+    def At(self, hour, minute=0, second=0):
+        return _TimeRule("At", None, hour * 60 + minute + second / 60)
+
+class ScheduleManager:
+    def __init__(self):
+        self.events = []
+
+    def On(self, date_rule, time_rule, callback):
+        self.events.append((date_rule, time_rule, callback))
+
+class AlgorithmSettings:
+    def __init__(self):
+        self.FreePortfolioValuePercentage = 0.0025
+
+class Benchmark:
+    def __init__(self, algorithm, symbol):
+        self.algorithm = algorithm
+        self.symbol = symbol
+
+    def Evaluate(self, time):
+        return self.algorithm.engine.price(self.symbol)
+
+class QCAlgorithm:
+    """The QCAlgorithm API used by TradingStrategy. Orders fill immediately against the engine's current price."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.Securities = _Securities()
+        self.Portfolio = SecurityPortfolioManager()
+        self.Schedule = ScheduleManager()
+        self.DateRules = DateRules()
+        self.TimeRules = TimeRules()
+        self.Settings = AlgorithmSettings()
+        self.ObjectStore = engine.object_store
+        self.Benchmark = None
+        self.StartDate = datetime(1998, 1, 1)
+        self.EndDate = datetime.now()
+        self.Time = self.StartDate
+        self.IsWarmingUp = False
+        self.LiveMode = False
+        self.warm_up_periods = 0
+        self.security_initializer = None
+
+    # ===== Setup =====
+    def SetStartDate(self, year, month, day):
+        self.StartDate = datetime(year, month, day)
+        self.Time = self.StartDate
+
+    def SetEndDate(self, year, month, day):
+        self.EndDate = datetime(year, month, day)
+
+    def SetCash(self, cash):
+        self.Portfolio.Cash = float(cash)
+
+    def SetBenchmark(self, symbol):
+        self.Benchmark = Benchmark(self, symbol)
+
+    def SetWarmUp(self, periods, resolution=None):
+        self.warm_up_periods = int(periods)
+
+    def SetSecurityInitializer(self, initializer):
+        self.security_initializer = initializer
+        for security in self.Securities.values():
+            initializer(security)
+
+    def Train(self, date_rule, time_rule=None, training_code=None):
+        """Schedule model training. LEAN gives training events a longer time budget; here they are ordinary scheduled events."""
+        self.Schedule.On(date_rule, time_rule, training_code)
+
+    def _add(self, ticker, kind):
+        if ticker not in self.Securities:
+            security = Security(ticker, kind)
+            self.Securities[ticker] = security
+            self.Portfolio[ticker] = SecurityHolding(security)
+            self.engine.subscribe(security)
+            if self.security_initializer is not None:
+                self.security_initializer(security)
+        return self.Securities[ticker]
+
+    def AddEquity(self, ticker, resolution=None, *args, **kwargs):
+        return self._add(ticker, "equity")
+
+    def AddCfd(self, ticker, resolution=None, *args, **kwargs):
+        return self._add(ticker, "cfd")
+
+    def AddData(self, data_type, ticker, resolution=None, *args, **kwargs):
+        return self._add(ticker, "data")
+
+    def GetParameter(self, name, default=None):
+        """Parameter value as a string, or converted to the type of default when one is given."""
+        value = self.engine.parameters.get(name)
+        if value is None:
+            return default
+        if isinstance(default, bool) or default is None or isinstance(default, str):
+            return value
+        if isinstance(default, int):
+            return int(float(value))
+        return float(value)
+
+    # ===== Data =====
+    def History(self, symbols, start, end=None, resolution=None, *args):
+        """History for one or many symbols, as a frame indexed by (symbol, time).
+        start is either a number of bars or a start datetime, in which case end is the end datetime.
+        History(data_type, ticker, ...) reads custom data without a subscription, as in LEAN.
+        Data after the current algorithm time is never returned.
+        """
+        if isinstance(symbols, type):
+            return self.History(start, end, resolution, *args)
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        if isinstance(start, (int, np.integer)):
+            return self.engine.history_periods(list(symbols), int(start))
+        if end is None or isinstance(end, str):
+            end = self.Time
+        return self.engine.history_range(list(symbols), start, end)
+
+    # ===== Orders =====
+    def SetHoldings(self, symbol, percentage=None, liquidateExistingHoldings=False, tag=""):
+        if isinstance(symbol, (list, tuple)):
+            # A batch of PortfolioTargets, sized against one portfolio value and submitted in order
+            value = self.Portfolio.TotalPortfolioValue * (1 - self.Settings.FreePortfolioValuePercentage)
+            for target in symbol:
+                self.engine.order_target_value(target.Symbol, float(target.Quantity) * value, tag)
+            return
+        if liquidateExistingHoldings:
+            for other in self.Portfolio.Keys:
+                if other != symbol:
+                    self.Liquidate(other)
+        value = float(percentage) * self.Portfolio.TotalPortfolioValue * (1 - self.Settings.FreePortfolioValuePercentage)
+        self.engine.order_target_value(symbol, value, tag)
+
+    def Liquidate(self, symbol=None, tag="Liquidated"):
+        symbols = self.Portfolio.Keys if symbol is None else [symbol]
+        for target in symbols:
+            if target in self.Portfolio and self.Portfolio[target].Invested:
+                self.engine.order(target, -self.Portfolio[target].Quantity, tag)
+
+    def MarketOrder(self, symbol, quantity, tag=""):
+        return self.engine.order(symbol, quantity, tag)
+
+    # ===== Logging =====
+    def Debug(self, message):
+        self.engine.log("DEBUG", message)
+
+    def Log(self, message):
+        self.engine.log("LOG", message)
+
+    def Error(self, message):
+        self.engine.log("ERROR", message)
+
+    # ===== Events, overridden by the algorithm =====
+    def Initialize(self):
+        pass
+
+    def OnData(self, data):
+        pass
+
+    def OnOrderEvent(self, orderEvent):
+        pass
+
+    def OnEndOfAlgorithm(self):
+        pass
@@ -0,0 +1,59 @@
+"""Regime timeline and per regime profit and loss over any date range, without running the backtest.
+
+    python -m offline.regimes data --start 2005-01 --end 2023-01 --out regimes
+    python -m offline.regimes data --parameter selected_model=regime-selection/best
+
+The algorithm is initialised offline to get its regime model, universe and parameters, loading the model from the
+ObjectStore cache when it is there. Features for every month start are computed in one pass and scored with one
+model call, and every strategy's allocation is evaluated against the following month's returns.
+Writes <out>/timeline.csv with one row per month and <out>/attribution.csv with one row per regime, and prints both.
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+
+import offline
+offline.install()
+from offline import data, engine
+import regime_timeline
+
+def series(dataset, ticker, field):
+    bars = dataset[ticker]
+    return bars.frame(0, len(bars))[field].droplevel(0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", help="dataset directory")
+    parser.add_argument("--start", default=None, help="first month, defaults to the start of the data")
+    parser.add_argument("--end", default=None, help="last month, defaults to the end of the data")
+    parser.add_argument("--object-store", default="results/objectstore", help="ObjectStore holding the cached regime model")
+    parser.add_argument("--parameter", action="append", default=[], metavar="NAME=VALUE", help="algorithm parameter, can be repeated")
+    parser.add_argument("--out", default="regimes", help="output directory")
+    args = parser.parse_args()
+    parameters = dict(parameter.split("=", 1) for parameter in args.parameter)
+
+    import main as algorithm_module
+    dataset = data.DataSet(args.data_dir)
+    algorithm = engine.Engine(dataset, args.object_store, parameters=parameters).initialize(algorithm_module.TradingStrategy)
+
+    started = time.perf_counter()
+    closes = pd.DataFrame({ticker: series(dataset, symbol, "close") for ticker, symbol in algorithm.symbolByTicker.items()})
+    start = pd.Period(args.start, "M").start_time if args.start else None
+    end = pd.Period(args.end, "M").end_time if args.end else None
+    sources = {name: series(dataset, source.symbol, source.field) for name, source in algorithm.feature_sources.sources.items()}
+    months = regime_timeline.timeline(algorithm.model, sources["spy"], sources["vix"], sources["interest30"], closes, algorithm.universe, algorithm.risk_free_rate, start, end)
+    table = regime_timeline.attribution(months)
+    seconds = time.perf_counter() - started
+
+    os.makedirs(args.out, exist_ok=True)
+    months.to_csv(os.path.join(args.out, "timeline.csv"), index_label="time")
+    table.to_csv(os.path.join(args.out, "attribution.csv"))
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(months[["regime", "strategy", "return"]].tail(12))
+        print(table)
+    print("{} months in {:.3f}s".format(len(months), seconds))
+
+if __name__ == "__main__":
+    main()
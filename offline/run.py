@@ -0,0 +1,40 @@
+"""Run TradingStrategy locally and write its equity curve and trade log.
+
+    python -m offline.data data --synthetic
+    python -m offline.run data --out results
+    python -m offline.run data --out results --parameter profile=1
+
+Writes results/equity.csv, results/trades.csv and results/log.txt, and prints summary statistics.
+"""
+import argparse
+import os
+
+import offline
+offline.install()
+from offline import data, engine
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", help="directory of <TICKER>.csv daily bars")
+    parser.add_argument("--out", default="results", help="output directory")
+    parser.add_argument("--object-store", default=None, help="ObjectStore directory, defaults to <out>/objectstore")
+    parser.add_argument("--verbose", action="store_true", help="print Debug and Log messages")
+    parser.add_argument("--parameter", action="append", default=[], metavar="NAME=VALUE", help="algorithm parameter, can be repeated")
+    args = parser.parse_args()
+    parameters = dict(parameter.split("=", 1) for parameter in args.parameter)
+
+    import main as algorithm_module
+    os.makedirs(args.out, exist_ok=True)
+    object_store = args.object_store or os.path.join(args.out, "objectstore")
+    result = engine.run(algorithm_module.TradingStrategy, data.DataSet(args.data_dir), object_store, args.verbose, parameters)
+
+    result.equity.to_csv(os.path.join(args.out, "equity.csv"))
+    result.trades.to_csv(os.path.join(args.out, "trades.csv"), index=False)
+    with open(os.path.join(args.out, "log.txt"), "w") as f:
+        for time, level, message in result.logs:
+            f.write("{} {} {}\n".format(time, level, message))
+    for name, value in result.summary().items():
+        print("{:>14}: {}".format(name, value))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Model selection for the regime model over the cached monthly feature matrix.
+
+    python -m offline.selection --object-store results/objectstore --out selection.jsonl
+    python -m offline.selection --components 3 4 5 --covariance full diag --priors 0.1 1 --scaling off on --seeds 0 1 2
+
+Every combination of component count, covariance type, weight concentration prior, feature scaling and random seed
+is fitted on a process pool and scored by BIC. Finished fits are appended to the output file as one JSON line keyed
+on the feature matrix and the candidate, so rerunning with a wider grid only fits the new candidates.
+
+The best candidate with as many components as the default model is refitted, relabelled to the default model's
+regimes with regime.align, and saved to the ObjectStore under regime-selection/best together with the training
+features. Run the algorithm with the selected_model parameter set to that key to use it instead of the default model.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import warnings
+
+import numpy as np
+
+import offline
+offline.install()
+from offline import qc, walkforward
+import model_cache
+import regime
+
+# ObjectStore key the best model is saved under
+SELECTED_KEY = "regime-selection/best"
+
+# Keep each worker single threaded, parallelism comes from the process pool
+for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(variable, "1")
+
+def candidates(components, covariance_types, priors, scalings, seeds):
+    """Every combination of the search values, as (model params, scaling) pairs."""
+    return [({"n_components": n, "covariance_type": covariance_type, "weight_concentration_prior": prior, "random_state": seed}, scaling)
+            for n, covariance_type, prior, scaling, seed in itertools.product(components, covariance_types, priors, scalings, seeds)]
+
+def candidate_key(feature_digest, params, scaling):
+    return json.dumps({"features": feature_digest, "params": params, "scaling": scaling}, sort_keys=True)
+
+def n_parameters(covariance_type, n_components, n_features):
+    """Free parameters of a Gaussian mixture, as counted by sklearn's GaussianMixture.bic."""
+    if covariance_type == "full":
+        covariance = n_components * n_features * (n_features + 1) / 2.0
+    elif covariance_type == "diag":
+        covariance = n_components * n_features
+    elif covariance_type == "tied":
+        covariance = n_features * (n_features + 1) / 2.0
+    else:
+        covariance = n_components
+    return int(covariance + n_components * n_features + n_components - 1)
+
+def fit(values, params, scaling):
+    """Fit one candidate.
+    :return model, RegimeScorer: fitted sklearn model and its scorer, which applies the scaling itself
+    """
+    from sklearn import mixture
+    feature_mean = values.mean(axis=0) if scaling else None
+    feature_scale = values.std(axis=0) if scaling else None
+    data = (values - feature_mean) / feature_scale if scaling else values
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model = mixture.BayesianGaussianMixture(**params).fit(data)
+    return model, regime.RegimeScorer.from_model(model, feature_mean, feature_scale)
+
+def evaluate(values, params, scaling):
+    """Fit one candidate and score it.
+    BIC counts only components holding at least 1% of the weight, as the Bayesian mixture switches off the rest.
+    Log likelihoods of scaled fits are converted back to the original feature units so all candidates compare.
+    """
+    model, scorer = fit(values, params, scaling)
+    n_months, n_features = values.shape
+    log_likelihood = model.score(scorer.scale_features(values)) * n_months
+    if scaling:
+        log_likelihood -= n_months * np.sum(np.log(scorer.feature_scale))
+    effective = int(np.sum(model.weights_ >= 0.01))
+    bic = -2 * log_likelihood + n_parameters(params["covariance_type"], effective, n_features) * np.log(n_months)
+    return {
+        "bic": float(bic),
+        "log_likelihood": float(log_likelihood / n_months),
+        "effective_components": effective,
+        "converged": bool(model.converged_),
+        "n_iter": int(model.n_iter_),
+        "labels": np.bincount(scorer.predict(values), minlength=params["n_components"]).tolist(),
+    }
+
+# Worker state, set once per process by _init_worker
+_worker = {}
+
+def _init_worker(values):
+    _worker["values"] = values
+
+def _evaluate(job):
+    key, params, scaling = job
+    row = {"key": key, "params": params, "scaling": scaling}
+    try:
+        row.update(evaluate(_worker["values"], params, scaling))
+        row["error"] = None
+    except Exception as e:
+        row["error"] = "{}: {}".format(type(e).__name__, e)
+    return row
+
+def completed(path):
+    """Rows of a results file by candidate key."""
+    rows = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    rows[row["key"]] = row
+    return rows
+
+def search(feature_matrix, grid, out, processes=None):
+    """Evaluate every candidate of grid not already in out.
+    :return list[dict]: rows of every candidate in grid, ranked by BIC
+    """
+    import multiprocessing
+    values = feature_matrix.to_numpy()
+    feature_digest = hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()[:16]
+    jobs = [(candidate_key(feature_digest, params, scaling), params, scaling) for params, scaling in candidates(*grid)]
+    jobs = list({job[0]: job for job in jobs}.values())
+    done = completed(out)
+    pending = [job for job in jobs if job[0] not in done]
+    print("{} candidates, {} already fitted, {} to fit".format(len(jobs), len(jobs) - len(pending), len(pending)))
+    if pending:
+        with multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn").Pool(
+                processes or os.cpu_count(), initializer=_init_worker, initargs=(values,)) as pool, open(out, "a") as f:
+            for row in pool.imap_unordered(_evaluate, pending):
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+                done[row["key"]] = row
+    rows = [done[key] for key, _, _ in jobs if done[key]["error"] is None]
+    return sorted(rows, key=lambda row: row["bic"])
+
+def table(rows, top=20):
+    """Text table of the best candidates."""
+    lines = ["{:>4} {:>10} {:>9} {:>4} {:>10} {:>6} {:>7} {:>5} {:>5}  {}".format(
+        "rank", "bic", "loglik", "k", "covariance", "prior", "scaling", "seed", "conv", "regime sizes")]
+    for rank, row in enumerate(rows[:top], 1):
+        params = row["params"]
+        lines.append("{:>4} {:>10.1f} {:>9.3f} {:>4} {:>10} {:>6} {:>7} {:>5} {:>5}  {}".format(
+            rank, row["bic"], row["log_likelihood"], "{}/{}".format(row["effective_components"], params["n_components"]), params["covariance_type"],
+            params["weight_concentration_prior"], "on" if row["scaling"] else "off", params["random_state"], "yes" if row["converged"] else "no", row["labels"]))
+    return "\n".join(lines)
+
+def save_best(feature_matrix, rows, object_store_dir):
+    """Refit the best candidate the algorithm can use and save it where Initialize loads selected models from.
+    Strategies are registered for the default model's regimes, so only candidates with as many components qualify,
+    and the chosen model is relabelled with regime.align so each label keeps the regime it stands for in the default model.
+    :param DataFrame feature_matrix: training months x features
+    :param list[dict] rows: candidates ranked by BIC
+    :param str object_store_dir: ObjectStore directory to save to
+    :return dict, str: the saved candidate and its key, or None, None if no candidate has the default component count
+    """
+    import main as algorithm_module
+    n_components = algorithm_module.MODEL_PARAMS["n_components"]
+    row = next((row for row in rows if row["params"]["n_components"] == n_components), None)
+    if row is None:
+        return None, None
+    values = feature_matrix.to_numpy()
+    _, reference = fit(values, algorithm_module.MODEL_PARAMS, False)
+    model, scorer = fit(values, row["params"], row["scaling"])
+    scorer, _ = regime.align(reference, scorer, values.std(axis=0))
+    backend = model_cache.ObjectStoreBackend(qc.ObjectStore(object_store_dir))
+    backend.save(SELECTED_KEY, model_cache.dumps(feature_matrix, model, scorer))
+    return row, SELECTED_KEY
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--object-store", default="results/objectstore", help="ObjectStore holding the cached regime model, the best model is saved here")
+    parser.add_argument("--data", default=None, help="build features from this data directory instead of the cache")
+    parser.add_argument("--start", default="2001-01", help="first month when building features from --data")
+    parser.add_argument("--end", default="2023-12", help="last month when building features from --data")
+    parser.add_argument("--components", type=int, nargs="+", default=[2, 3, 4, 5, 6])
+    parser.add_argument("--covariance", nargs="+", default=["full", "tied", "diag", "spherical"])
+    parser.add_argument("--priors", type=float, nargs="+", default=[0.1, 1.0, 10.0], help="weight concentration priors")
+    parser.add_argument("--scaling", nargs="+", choices=["off", "on"], default=["off", "on"], help="standardise features before fitting")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument("--out", default="selection.jsonl")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.data:
+        feature_matrix, _ = walkforward.dataset_features(args.data, args.start, args.end)
+    else:
+        feature_matrix, _ = walkforward.cached_features(args.object_store)
+    grid = (args.components, args.covariance, args.priors, [scaling == "on" for scaling in args.scaling], args.seeds)
+    rows = search(feature_matrix, grid, args.out, args.processes)
+    print(table(rows, args.top))
+    if rows:
+        row, key = save_best(feature_matrix, rows, args.object_store)
+        if key is None:
+            print("No candidate has as many components as the default model, nothing saved")
+        else:
+            print("Saved the best {} component model ({}, {} covariance) to {} in {}, run with --parameter selected_model={}".format(
+                row["params"]["n_components"], "scaled" if row["scaling"] else "unscaled", row["params"]["covariance_type"], key, args.object_store, key))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Parallel parameter sweep of TradingStrategy over the offline engine.
+
+The spec is a JSON file with either a grid or a random search:
+    {"grid": {"risk_factor": [1.5, 2.0, 2.5], "short_window": [5, 7], "strong_buy": [[1.2, 1.2, 1.5, 1.2], [1.1, 1.1, 1.3, 1.1]]}}
+    {"random": {"risk_factor": {"low": 1.0, "high": 3.0}, "long_window": {"choices": [14, 21, 28]}}, "samples": 200, "seed": 0}
+Names are algorithm parameters read with GetParameter in Initialize, list values are passed comma separated.
+
+    python -m offline.sweep data spec.json --out sweep.jsonl --processes 64
+
+Every finished configuration is appended to the output file as one JSON line, so rerunning the same command
+resumes a half finished sweep. Workers open the same memory-mapped dataset read-only, and the regime model is
+trained once up front into a shared ObjectStore so workers only ever load it.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+import offline
+offline.install()
+from offline import data, engine
+
+# Keep each worker single threaded, parallelism comes from the process pool
+for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(variable, "1")
+
+def configurations(spec):
+    """Expand a sweep spec into a list of parameter dicts."""
+    if "grid" in spec:
+        names = sorted(spec["grid"])
+        return [dict(zip(names, values)) for values in itertools.product(*(spec["grid"][name] for name in names))]
+    rng = np.random.default_rng(spec.get("seed", 0))
+    configs = []
+    for _ in range(spec["samples"]):
+        config = {}
+        for name in sorted(spec["random"]):
+            domain = spec["random"][name]
+            if "choices" in domain:
+                config[name] = domain["choices"][rng.integers(len(domain["choices"]))]
+            elif isinstance(domain["low"], int) and isinstance(domain["high"], int):
+                config[name] = int(rng.integers(domain["low"], domain["high"] + 1))
+            else:
+                config[name] = float(rng.uniform(domain["low"], domain["high"]))
+        configs.append(config)
+    return configs
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+def completed(path):
+    """Keys of configurations already in a results file."""
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    done.add(config_key(json.loads(line)["parameters"]))
+    return done
+
+# Worker state, set once per process by _init_worker
+_worker = {}
+
+def _init_worker(data_dir, object_store_dir):
+    import main as algorithm_module
+    _worker["algorithm_class"] = algorithm_module.TradingStrategy
+    _worker["dataset"] = data.DataSet(data_dir)
+    _worker["object_store_dir"] = object_store_dir
+
+def _run_config(config):
+    started = time.perf_counter()
+    try:
+        result = engine.run(_worker["algorithm_class"], _worker["dataset"], _worker["object_store_dir"], parameters=config)
+        summary = result.summary()
+        error = None
+    except Exception as e:
+        summary = {}
+        error = "{}: {}".format(type(e).__name__, e)
+    row = {"parameters": config, "error": error, "seconds": time.perf_counter() - started}
+    row.update({name: (None if value is None or (isinstance(value, float) and np.isnan(value)) else float(value)) for name, value in summary.items()})
+    return row
+
+def prime(data_dir, object_store_dir):
+    """Open every ticker and train the regime model once, before the workers start."""
+    import main as algorithm_module
+    dataset = data.DataSet(data_dir)
+    dataset.preload(name[:-len(".csv")] for name in os.listdir(data_dir) if name.endswith(".csv"))
+    engine.Engine(dataset, object_store_dir).initialize(algorithm_module.TradingStrategy)
+
+def sweep(data_dir, spec, out, processes=None, object_store_dir=None):
+    """Run every configuration of spec not already in out, appending results as they finish.
+    :return list[dict]: all rows in out, including earlier runs
+    """
+    import multiprocessing
+    object_store_dir = object_store_dir or os.path.splitext(out)[0] + "_objectstore"
+    done = completed(out)
+    pending = [config for config in configurations(spec) if config_key(config) not in done]
+    print("{} configurations, {} already done, {} to run".format(len(pending) + len(done), len(done), len(pending)))
+    if pending:
+        prime(data_dir, object_store_dir)
+        processes = processes or os.cpu_count()
+        with multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn").Pool(
+                processes, initializer=_init_worker, initargs=(data_dir, object_store_dir)) as pool, open(out, "a") as f:
+            for i, row in enumerate(pool.imap_unordered(_run_config, pending), 1):
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+                print("[{}/{}] sharpe {} drawdown {} turnover {} {}".format(
+                    i, len(pending), _fmt(row.get("sharpe")), _fmt(row.get("max_drawdown")), _fmt(row.get("turnover")), row["error"] or config_key(row["parameters"])))
+    with open(out) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _fmt(value):
+    return "{:8.3f}".format(value) if value is not None else "     n/a"
+
+def table(rows, sort_by="sharpe", top=20):
+    """Text table of the best configurations."""
+    rows = sorted((row for row in rows if row.get(sort_by) is not None), key=lambda row: row[sort_by], reverse=True)[:top]
+    lines = ["{:>8} {:>9} {:>9}  parameters".format("sharpe", "drawdown", "turnover")]
+    for row in rows:
+        lines.append("{} {} {}  {}".format(_fmt(row["sharpe"]), _fmt(row["max_drawdown"]), _fmt(row["turnover"]), config_key(row["parameters"])))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir")
+    parser.add_argument("spec", help="JSON sweep spec")
+    parser.add_argument("--out", default="sweep.jsonl")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    rows = sweep(args.data_dir, spec, args.out, args.processes)
+    print(table(rows, top=args.top))
+
+if __name__ == "__main__":
+    main()
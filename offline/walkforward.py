@@ -0,0 +1,178 @@
+"""Walk-forward validation of the regime model on the monthly feature matrix.
+
+    python -m offline.walkforward --object-store results/objectstore --out walkforward
+    python -m offline.walkforward --data data --start 2001-01 --end 2023-12 --window rolling --train-months 120
+
+Each fold fits the model on the months before its test block and labels the test block out of sample. The
+expanding window trains on every earlier month, the rolling window on the last train-months. Fold labels are mapped
+onto the regimes of a model fitted on every month with regime.align, so labels from different folds mean the same
+regime. Folds are fitted in parallel on a process pool.
+
+Features come from the cached training matrix in an ObjectStore, or are built from a data directory for any range.
+Writes <out>/labels.csv with the out of sample label of every test month and <out>/summary.json with flip rates and
+fold to fold alignment scores, and prints the summary.
+"""
+import argparse
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import offline
+offline.install()
+from offline import data, qc
+import features
+import model_cache
+import regime
+
+# Keep each worker single threaded, parallelism comes from the process pool
+for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(variable, "1")
+
+def cached_features(object_store_dir):
+    """Training feature matrix and model hyperparameters of the regime model cached in an ObjectStore."""
+    from sklearn import mixture
+    backend = model_cache.ObjectStoreBackend(qc.ObjectStore(object_store_dir))
+    keys = [key for key in backend.keys() if key.startswith(model_cache.KEY_PREFIX + "/")]
+    if not keys:
+        raise SystemExit("No cached regime model in {}, run a backtest first or pass --data".format(object_store_dir))
+    cached = model_cache.ModelCache(backend).load(keys[0], mixture.BayesianGaussianMixture)
+    if cached is None:
+        raise SystemExit("Cached regime model {} is from another cache version".format(keys[0]))
+    feature_matrix, _, model = cached
+    return feature_matrix, model.get_params()
+
+def dataset_features(data_dir, start, end):
+    """Monthly feature matrix from a data directory, as TrainModel builds it."""
+    import main as algorithm_module
+    dataset = data.DataSet(data_dir)
+    def column(ticker, field):
+        bars = dataset[ticker]
+        return bars.frame(0, len(bars))[field]
+    months = pd.period_range(start, end, freq="M")
+    feature_matrix = features.monthly_features(column("SPY", "close"), column("VIX", "close"), column(qc.Fred.CommercialPaper.Three0DayAAAssetbackedCommercialPaperInterestRate, "value"),
+                                               algorithm_module.RISK_FREE_RATE, months).dropna()
+    return feature_matrix, dict(algorithm_module.MODEL_PARAMS)
+
+def folds(n_months, min_train, step, window="expanding", train_months=None):
+    """Train and test ranges of every fold.
+    :param int n_months: number of months in the feature matrix
+    :param int min_train: months in the first training window
+    :param int step: months in each test block, and how far the window moves between folds
+    :param str window: expanding or rolling
+    :param int train_months: training window length for rolling folds, defaults to min_train
+    :return list[(int, int, int)]: (train start, test start, test stop) month positions
+    """
+    train_months = train_months or min_train
+    ranges = []
+    for test_start in range(min_train, n_months, step):
+        train_start = 0 if window == "expanding" else max(0, test_start - train_months)
+        ranges.append((train_start, test_start, min(test_start + step, n_months)))
+    return ranges
+
+def fit(data, params):
+    """Fit the regime model and reduce it to a RegimeScorer."""
+    from sklearn import mixture
+    with warnings.catch_warnings():
+        # Short training windows may stop at max_iter, which is part of what this measures
+        warnings.simplefilter("ignore")
+        model = mixture.BayesianGaussianMixture(**params).fit(data)
+    return regime.RegimeScorer.from_model(model)
+
+def _fit_fold(job):
+    data, params = job
+    return fit(data, params)
+
+def validate(feature_matrix, params, min_train=60, step=1, window="expanding", train_months=None, processes=None):
+    """Walk forward over feature_matrix.
+    :return DataFrame labels, dict summary: out of sample label per test month, and stability statistics
+    """
+    import multiprocessing
+    from sklearn.metrics import adjusted_rand_score
+    values = feature_matrix.to_numpy()
+    scale = values.std(axis=0)
+    ranges = folds(len(values), min_train, step, window, train_months)
+    if not ranges:
+        raise SystemExit("Need more than {} months, got {}".format(min_train, len(values)))
+
+    reference = fit(values, params)
+    full_sample = reference.predict(values)
+    jobs = [(values[train_start:test_start], params) for train_start, test_start, _ in ranges]
+    with multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn").Pool(processes or os.cpu_count()) as pool:
+        scorers = pool.map(_fit_fold, jobs)
+
+    rows = []
+    fold_labels = []
+    alignment_distances = []
+    for fold, ((train_start, test_start, test_stop), scorer) in enumerate(zip(ranges, scorers)):
+        aligned, order = regime.align(reference, scorer, scale)
+        labels = aligned.predict(values)
+        fold_labels.append(labels)
+        alignment_distances.append(float(np.mean(np.linalg.norm((reference.means - aligned.means) / scale, axis=1))))
+        for month in range(test_start, test_stop):
+            rows.append((str(feature_matrix.index[month]), fold, int(labels[month]), int(full_sample[month])))
+    labels = pd.DataFrame(rows, columns=["month", "fold", "label", "full_sample_label"])
+
+    # Consecutive folds compared on the months both were trained on
+    adjusted_rand = []
+    agreement = []
+    for (previous_range, previous), (current_range, current) in zip(zip(ranges, fold_labels), zip(ranges[1:], fold_labels[1:])):
+        shared = slice(max(previous_range[0], current_range[0]), previous_range[1])
+        adjusted_rand.append(adjusted_rand_score(previous[shared], current[shared]))
+        agreement.append(float(np.mean(previous[shared] == current[shared])))
+
+    out_of_sample = labels["label"].to_numpy()
+    summary = {
+        "months": len(values),
+        "folds": len(ranges),
+        "window": window,
+        "test_months": len(labels),
+        # Share of consecutive test months whose regime changes
+        "flip_rate": float(np.mean(out_of_sample[1:] != out_of_sample[:-1])) if len(out_of_sample) > 1 else 0.0,
+        "full_sample_flip_rate": float(np.mean(labels["full_sample_label"].to_numpy()[1:] != labels["full_sample_label"].to_numpy()[:-1])) if len(labels) > 1 else 0.0,
+        # Share of test months labelled the same out of sample as by the model fitted on every month
+        "full_sample_agreement": float(np.mean(out_of_sample == labels["full_sample_label"].to_numpy())),
+        "fold_adjusted_rand_mean": float(np.mean(adjusted_rand)) if adjusted_rand else None,
+        "fold_adjusted_rand_min": float(np.min(adjusted_rand)) if adjusted_rand else None,
+        "fold_agreement_mean": float(np.mean(agreement)) if agreement else None,
+        # Mean standardised distance between each fold's regime means and the full sample regime means
+        "alignment_distance_mean": float(np.mean(alignment_distances)),
+        "alignment_distance_max": float(np.max(alignment_distances)),
+        "regime_counts": {str(label): int(count) for label, count in zip(*np.unique(out_of_sample, return_counts=True))},
+    }
+    return labels, summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--object-store", default="results/objectstore", help="ObjectStore holding the cached regime model")
+    parser.add_argument("--data", default=None, help="build features from this data directory instead of the cache")
+    parser.add_argument("--start", default="2001-01", help="first month when building features from --data")
+    parser.add_argument("--end", default="2023-12", help="last month when building features from --data")
+    parser.add_argument("--window", choices=["expanding", "rolling"], default="expanding")
+    parser.add_argument("--min-train", type=int, default=60, help="months in the first training window")
+    parser.add_argument("--train-months", type=int, default=None, help="rolling window length, defaults to --min-train")
+    parser.add_argument("--step", type=int, default=1, help="months per test block")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to every core")
+    parser.add_argument("--out", default="walkforward", help="output directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.data:
+        feature_matrix, params = dataset_features(args.data, args.start, args.end)
+    else:
+        feature_matrix, params = cached_features(args.object_store)
+    labels, summary = validate(feature_matrix, params, args.min_train, args.step, args.window, args.train_months, args.processes)
+    summary["seconds"] = time.perf_counter() - started
+
+    os.makedirs(args.out, exist_ok=True)
+    labels.to_csv(os.path.join(args.out, "labels.csv"), index=False)
+    with open(os.path.join(args.out, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    for name, value in summary.items():
+        print("{:>24}: {}".format(name, value))
+
+if __name__ == "__main__":
+    main()
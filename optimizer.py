@@ -0,0 +1,80 @@
+import numpy as np
+
+def project(weights, lower, upper, gross=None):
+    """Nearest weights within per-asset bounds and a gross exposure limit.
+    The bounds must contain zero, so the result is weights soft thresholded towards zero and then bounded. Gross
+    exposure is piecewise linear in the threshold, so a safeguarded Newton search finds it exactly in a few steps.
+    :param array weights: weights to project
+    :param array lower: lowest weight per asset, at most zero
+    :param array upper: highest weight per asset, at least zero
+    :param float gross: largest sum of absolute weights, None for no limit
+    :return array: projected weights
+    """
+    clipped = np.clip(weights, lower, upper)
+    if gross is None or np.abs(clipped).sum() <= gross:
+        return clipped
+    size = np.abs(weights)
+    cap = np.where(weights >= 0, upper, -lower)
+    low, high = 0.0, float(size.max())
+    threshold = 0.0
+    for _ in range(100):
+        shrunk = size - threshold
+        excess = np.clip(shrunk, 0, cap).sum() - gross
+        if abs(excess) <= 1e-12 * gross:
+            break
+        if excess > 0:
+            low = threshold
+        else:
+            high = threshold
+        # Exposure falls by one per unit of threshold for every asset between zero and its cap
+        active = np.count_nonzero((shrunk > 0) & (shrunk < cap))
+        threshold = threshold + excess / active if active else (low + high) / 2
+        if not low < threshold < high:
+            threshold = (low + high) / 2
+    return np.sign(weights) * np.clip(size - threshold, 0, cap)
+
+def solve(expected_returns, factors, risk_aversion, anchor, tracking_penalty, lower, upper, gross=None, initial=None, tolerance=1e-8, max_iterations=1000):
+    """Mean variance weights pulled towards anchor weights, under per-asset bounds and a gross exposure limit.
+    Minimises risk_aversion / 2 * w'Cw - r'w + tracking_penalty / 2 * |w - anchor|^2 by accelerated projected gradient
+    with adaptive restarts. The covariance C is given as F'F, e.g. F the scaled deviations of a few days of returns, so
+    each iteration costs days x assets rather than assets squared. The tracking term keeps the problem strictly convex
+    even though C is singular whenever there are fewer days than assets.
+    :param array expected_returns: expected return per asset
+    :param array factors: rows x assets matrix F with covariance F'F
+    :param float risk_aversion: weight of the variance term
+    :param array anchor: weights the solution is pulled towards
+    :param float tracking_penalty: weight of the distance to anchor, must be positive
+    :param array lower: lowest weight per asset, at most zero
+    :param array upper: highest weight per asset, at least zero
+    :param float gross: largest sum of absolute weights, None for no limit
+    :param array initial: starting weights, e.g. the previous solution, defaults to anchor
+    :param float tolerance: stop once no weight moves by more than this in an iteration
+    :param int max_iterations: iteration limit
+    :return array weights, int iterations: solution and the number of iterations taken
+    """
+    anchor = np.asarray(anchor, dtype=float)
+    factors = np.asarray(factors, dtype=float)
+    # F'F and FF' share their largest eigenvalue, take it from whichever is smaller
+    gram = factors @ factors.T if factors.shape[0] <= factors.shape[1] else factors.T @ factors
+    largest = np.linalg.eigvalsh(gram)[-1] if gram.size else 0.0
+    step = 1 / (risk_aversion * largest + tracking_penalty)
+    linear = expected_returns + tracking_penalty * anchor
+    weights = project(anchor if initial is None else np.asarray(initial, dtype=float), lower, upper, gross)
+    point = weights
+    momentum = 1.0
+    for iteration in range(1, max_iterations + 1):
+        gradient = risk_aversion * ((point @ factors.T) @ factors) + tracking_penalty * point - linear
+        updated = project(point - step * gradient, lower, upper, gross)
+        change = updated - weights
+        if np.max(np.abs(change), initial=0.0) <= tolerance:
+            return updated, iteration
+        if (point - updated) @ change > 0:
+            # Going uphill, drop the momentum
+            momentum = 1.0
+            point = updated
+        else:
+            next_momentum = (1 + np.sqrt(1 + 4 * momentum ** 2)) / 2
+            point = updated + ((momentum - 1) / next_momentum) * change
+            momentum = next_momentum
+        weights = updated
+    return weights, max_iterations
@@ -2,87 +2,141 @@
 from AlgorithmImports import *
 #endregion
 import numpy as np
+import pandas as pd
+import optimizer
+
+# Allocation multipliers indexed by market condition (steady state, crisis, walking on ice, inflation), used unless thresholds overrides them
+# In crisis market, bias towards selling; in steady states bias towards top momentum performers
+# In high inflation situations, rebalance less; in high volatility situations tend to reduce size
+MULTIPLIERS = {
+    'strong_buy': [1.2, 1.2, 1.5, 1.2],
+    'buy': [1, 1, 1, 1],
+    'sell': [0.8, -1.2, 1, 0.8],
+    'strong_sell': [0.7, -1.5, 0.6, 0.7],
+}
+
+# Weight optimiser limits indexed by market condition, used unless thresholds overrides them
+# Gross leverage is highest in steady states; shorts are only allowed in crisis and walking on ice, where the strategies short
+REGIME_LIMITS = {
+    'gross_leverage': [2.0, 1.0, 1.0, 1.5],
+    'max_short': [0.0, 0.5, 0.25, 0.0],
+    'risk_aversion': [2.0, 8.0, 6.0, 4.0],
+}
+
+# Largest weight of one asset, and how strongly the optimiser holds on to the multiplier weights rather than chasing
+# expected returns, which over two weeks of history are mostly noise. Used unless thresholds overrides them
+OPTIMISER_DEFAULTS = {
+    'max_weight': 1.0,
+    'tracking_penalty': 20.0,
+}
+
+# Market condition whose values are used for conditions without their own, as strategies.strategy_for falls back to walking on ice
+FALLBACK_CONDITION = 2
+
+# Trading days per year, expected returns and covariances are annualised for the optimiser
+TRADING_DAYS = 252
+
+def regime_value(values, market_condition):
+    """Entry of a per market condition list, the fallback condition's entry for conditions past the end of the list."""
+    return values[market_condition] if 0 <= market_condition < len(values) else values[FALLBACK_CONDITION]
 
 # Rebalance portfolio based on current portfolio performance
-def adjust(current_portfolio, market_condition, historical_data, risk_free_rate, thresholds, portfolio_returns):
+def adjust(current_portfolio, market_condition, historical_data, risk_free_rate, thresholds, portfolio_returns, macd=None):
     """Rebalance portfolio according to performance.
-    :param dict[str, float] current_portfolio: symbols and weights of currently held portfolio
+    Performance multipliers give the preferred weights, and the optimiser finds the weights nearest to them that also
+    trade off expected return against risk, within the market condition's gross leverage, short and per-asset limits.
+    :param dict[str, float] current_portfolio: symbols and weights of currently held portfolio, the optimiser's starting point
     :param int market_condition: current market situation
-    :param dataframe historical_data: last 14 days of market data on securities held
+    :param dataframe historical_data: last 14 days of market data on securities held, a History frame or a days x symbols frame of closes
     :param int risk_free_rate: risk free rate used for calculations
-    :param dict[str, float] thresholds: threshold values
+    :param dict[str, float] thresholds: threshold values, optionally with max_weight, tracking_penalty and per market condition lists as in MULTIPLIERS and REGIME_LIMITS
     :param int portfolio_returns: value of portfolio returns between each period
+    :param dict[str, float] macd: current MACD per symbol from a StreamingMACD, calculated from historical_data if not given
     :return dict[str, float] current_portfolio: symbols and weights of new portfolio
     """
     # Calculate performance factors for each asset
-    risks, returns, diversification = calculate_factors(historical_data, current_portfolio)
-    
+    symbols = list(current_portfolio)
+    prices = closes_matrix(historical_data, symbols)
+    risks, returns, diversification = price_factors(prices)
+
     # Calculate current sharpe ratios for each asset
     # Calculate threshold sharpe ratios for each asset - cutoff point for when we reallocate asset, based on diverification, return, and potential risks.
-    sharpe_ratios = {}
-    threshold_sharpe_ratios = {}
-    for symbol, weight in current_portfolio.items():
-        sharpe_ratios[symbol] = (returns[symbol] - risk_free_rate) / risks[symbol]
-        threshold_sharpe_ratios[symbol] = (thresholds['risk_factor'] * risks[symbol]) + (thresholds['return_factor'] * returns[symbol]) + (thresholds['diversification_factor'] * diversification[symbol])
-
-    # Remove any assets that are underperforming, and replace them with greater allocations of "good" assets
-    # Depending on the market condition, we may want to reallocate more or less aggressively
-    for symbol, weight in current_portfolio.items():
-
-        # In crisis market, bias towards selling; in steady states bias towards top momentum performers
-        # In high inflation situations, rebalance less; in high volatility situations tend to reduce size
-        strong_buy = [1.2, 1.5, 1.2, 1.2]
-        buy = [1, 1, 1, 1]
-        sell = [-1.2, 1, 0.8, 0.8]
-        strong_sell = [-1.5, 0.6, 0.7, 0.7]
-
-        # Calculate MACD for each asset
-        prices = historical_data.loc[symbol]['close']
-        macd = calculate_macd(prices, thresholds['short_window'], thresholds['long_window'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe_ratios = (returns - risk_free_rate) / risks
+    threshold_sharpe_ratios = (thresholds['risk_factor'] * risks) + (thresholds['return_factor'] * returns) + (thresholds['diversification_factor'] * diversification)
+
+    # Scale each asset's weight up or down depending on how it performs, more or less aggressively depending on the market condition
+    strong_buy = regime_value(thresholds.get('strong_buy', MULTIPLIERS['strong_buy']), market_condition)
+    buy = regime_value(thresholds.get('buy', MULTIPLIERS['buy']), market_condition)
+    sell = regime_value(thresholds.get('sell', MULTIPLIERS['sell']), market_condition)
+    strong_sell = regime_value(thresholds.get('strong_sell', MULTIPLIERS['strong_sell']), market_condition)
+    anchor = np.empty(len(symbols))
+    for i, (symbol, weight) in enumerate(current_portfolio.items()):
+
+        # Calculate MACD for each asset, unless streaming values are available
+        if macd is not None and symbol in macd and not np.isnan(macd[symbol]):
+            symbol_macd = macd[symbol]
+        else:
+            symbol_prices = prices[:, i]
+            symbol_macd = calculate_macd(symbol_prices[~np.isnan(symbol_prices)], thresholds['short_window'], thresholds['long_window'])
 
         # If the sharpe ratio is above the threshold, and the MACD is positive, increase allocation to asset
-        if macd > 0:
-            if sharpe_ratios[symbol] >= threshold_sharpe_ratios[symbol]:
-                current_portfolio[symbol] = abs(weight)*strong_buy[market_condition - 1]
-            else:
-                current_portfolio[symbol] = abs(weight)*buy[market_condition - 1]
+        if symbol_macd > 0:
+            anchor[i] = abs(weight)*(strong_buy if sharpe_ratios[i] >= threshold_sharpe_ratios[i] else buy)
         # If the sharpe ratio is below the threshold, and the MACD is negative, decrease allocation to asset
         else:
-            if sharpe_ratios[symbol] <= threshold_sharpe_ratios[symbol]:
-                current_portfolio[symbol] = abs(weight)*strong_sell[market_condition - 1]
-            else:
-                current_portfolio[symbol] = abs(weight)*sell[market_condition - 1]
-                
-        # If the portfolio is doing well, scale up
-        if portfolio_returns > 0:
-            if market_condition == 2:
-                current_portfolio[symbol] = abs(weight)*0.6
-            else:
-                current_portfolio[symbol] = abs(weight)*1.2
-        else:
-            current_portfolio[symbol] = abs(weight)*0.5
+            anchor[i] = abs(weight)*(strong_sell if sharpe_ratios[i] <= threshold_sharpe_ratios[i] else sell)
 
-    return current_portfolio
+    # If the portfolio is doing well, scale up
+    if portfolio_returns > 0:
+        anchor *= 0.6 if market_condition == 2 else 1.2
+    else:
+        anchor *= 0.5
+
+    # Solve for the weights closest to these that trade off return against risk within the market condition's limits,
+    # starting from the current weights, which are last week's solution
+    expected_returns, return_factors = return_moments(prices)
+    max_weight = thresholds.get('max_weight', OPTIMISER_DEFAULTS['max_weight'])
+    max_short = min(regime_value(thresholds.get('max_short', REGIME_LIMITS['max_short']), market_condition), max_weight)
+    weights, _ = optimizer.solve(expected_returns * TRADING_DAYS, return_factors * np.sqrt(TRADING_DAYS),
+                                 regime_value(thresholds.get('risk_aversion', REGIME_LIMITS['risk_aversion']), market_condition),
+                                 anchor, thresholds.get('tracking_penalty', OPTIMISER_DEFAULTS['tracking_penalty']),
+                                 np.full(len(symbols), -max_short), np.full(len(symbols), max_weight),
+                                 regime_value(thresholds.get('gross_leverage', REGIME_LIMITS['gross_leverage']), market_condition),
+                                 initial=np.fromiter(current_portfolio.values(), dtype=float, count=len(symbols)))
+    return dict(zip(symbols, weights.tolist()))
 
 def numpy_ewma(data, window):
-    """Strategy in crisis situations. Called on market_condition.
-    Take exponential weighted moving average, using in MACD calculation.
+    """Take exponential weighted moving average, using in MACD calculation.
+    The series is processed in blocks short enough that the alpha_rev**n scale factors stay far from underflow,
+    with each block continuing from the last average of the previous one.
     :param array data: array to calculate EWMA on
     :param int window: what window to use
     """
     alpha = 2 /(window + 1.0)
     alpha_rev = 1-alpha
     n = data.shape[0]
+    out = np.empty(n)
+    if n == 0:
+        return out
+
+    # Longest block for which alpha_rev**block stays above 1e-150
+    block = max(1, int(-150 / np.log10(alpha_rev))) if alpha_rev > 0 else 1
+    previous = data[0]
+    for start in range(0, n, block):
+        chunk = data[start:start + block]
+        m = chunk.shape[0]
 
-    pows = alpha_rev**(np.arange(n+1))
+        pows = alpha_rev**(np.arange(m+1))
 
-    scale_arr = 1/pows[:-1]
-    offset = data[0]*pows[1:]
-    pw0 = alpha*alpha_rev**(n-1)
+        scale_arr = 1/pows[:-1]
+        offset = previous*pows[1:]
+        pw0 = alpha*alpha_rev**(m-1)
 
-    mult = data*pw0*scale_arr
-    cumsums = mult.cumsum()
-    out = offset + cumsums*scale_arr[::-1]
+        mult = chunk*pw0*scale_arr
+        cumsums = mult.cumsum()
+        out[start:start + m] = offset + cumsums*scale_arr[::-1]
+        previous = out[start + m - 1]
     return out
 
 def calculate_macd(prices, short_window, long_window):
@@ -103,46 +157,100 @@ def calculate_macd(prices, short_window, long_window):
 
     return macd
 
-def calculate_factors(historical_data, portfolio):
-    """Calculate sharpe-related performance factors for each asset.
-    :param array historical_data: 30-day data for securities
-    :param dict portfolio: list of securities and their respective weights
+def price_matrix(historical_data, symbols):
+    """Align daily closes of all symbols into one matrix.
+    :param dataframe historical_data: History frame indexed by (symbol, time)
+    :param list symbols: symbols to include, in column order
+    :return dataframe: days x symbols closes, NaN where a symbol has no bar
     """
-    risks = {}
-    mean_returns = {}
-    diversification = {}
-
-    for symbol in portfolio:
-        prices = historical_data.loc[symbol]['close'].resample('d').last()
-        returns = np.diff(prices) / prices[:-1]
-
-        # Get risk and return for asset
-        risks[symbol] = np.std(returns)
-        mean_returns[symbol] = np.mean(returns)
-
-        # Calculate pairwise correlations between asset and all other assets
-        correlations = []
-        for compare_symbol in portfolio:
-            if symbol != compare_symbol:
-                compare_prices = historical_data.loc[compare_symbol]['close'].resample('d').last()
-                compare_returns = np.diff(compare_prices) / compare_prices[:-1]
-
-                # Make sure the two assets have the same number of returns
-                if len(returns) > len(compare_returns):
-                    returns = returns[:len(compare_returns)]
-                elif len(compare_returns) > len(returns):
-                    compare_returns = compare_returns[:len(returns)]
-                correlation = np.corrcoef(returns, compare_returns)[0][1]
-                correlations.append(correlation)
-        
-    # Calculate average pairwise correlation
-        avg_correlation = np.mean(correlations)
-    
-    # Calculate diversification benefit
-        diversification_benefit = 1 - avg_correlation
-        diversification[symbol] = diversification_benefit
+    if historical_data.empty or 'close' not in historical_data:
+        return pd.DataFrame(columns=list(symbols), dtype=float)
+    closes = historical_data['close']
+    # Only the requested symbols, so days on which no other symbol traded do not become empty rows
+    closes = closes[closes.index.get_level_values(0).isin(list(symbols))]
+    # Key bars by calendar day so symbols with different bar end times line up, on a new index so the caller's frame is untouched
+    days = pd.DatetimeIndex(closes.index.get_level_values(1)).normalize()
+    closes = pd.Series(closes.to_numpy(), index=pd.MultiIndex.from_arrays([closes.index.get_level_values(0), days]))
+    closes = closes[~closes.index.duplicated(keep='last')]
+    # Symbols without history get an empty column
+    return closes.unstack(level=0).reindex(columns=list(symbols)).astype(float)
 
-    return risks, mean_returns, diversification
+def closes_matrix(historical_data, symbols):
+    """Daily closes of symbols as a days x symbols array.
+    :param dataframe historical_data: History frame indexed by (symbol, time), or a days x symbols frame of closes such as a BarStore window
+    :param list symbols: symbols to include, in column order
+    :return array: days x symbols closes, NaN where a symbol has no bar
+    """
+    if isinstance(historical_data.index, pd.MultiIndex) or historical_data.empty:
+        return price_matrix(historical_data, symbols).to_numpy(dtype=float)
+    return historical_data.reindex(columns=symbols).to_numpy(dtype=float)
+
+def returns_matrix(historical_data, symbols):
+    """Align daily closes of all symbols into one matrix and take simple returns.
+    Returns spanning a day on which a symbol has no bar are left as NaN.
+    :param dataframe historical_data: History frame indexed by (symbol, time)
+    :param list symbols: symbols to include, in column order
+    :return dataframe: days x symbols returns
+    """
+    return price_matrix(historical_data, symbols).pct_change(fill_method=None).iloc[1:]
+
+def price_factors(prices):
+    """Sharpe-related performance factors from a matrix of closes, skipping missing values like pandas does.
+    :param array prices: days x symbols closes, NaN where a symbol has no bar
+    :return array risks, array mean_returns, array diversification: factors per symbol column
+    """
+    returns = prices[1:] / prices[:-1] - 1
+    valid = ~np.isnan(returns)
+    counts = valid.sum(axis=0)
+
+    # Get risk and return for each asset
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_returns = np.where(valid, returns, 0).sum(axis=0) / counts
+        deviations = np.where(valid, returns - mean_returns, 0)
+        risks = np.sqrt((deviations ** 2).sum(axis=0) / counts)
+
+        # Pairwise correlation over the days both assets have returns, from a few matrix products.
+        # Returns are centred first so the sums stay accurate
+        mask = valid.astype(float)
+        pairs = mask.T @ mask
+        sums = deviations.T @ mask
+        squares = (deviations ** 2).T @ mask
+        covariance = deviations.T @ deviations - sums * sums.T / pairs
+        variance = squares - sums ** 2 / pairs
+        correlations = covariance / np.sqrt(variance * variance.T)
+        correlations[(pairs < 2) | (variance <= 0) | (variance.T <= 0)] = np.nan
 
+        # Average pairwise correlation between each asset and all other assets
+        np.fill_diagonal(correlations, np.nan)
+        valid_correlations = ~np.isnan(correlations)
+        avg_correlation = np.where(valid_correlations, correlations, 0).sum(axis=1) / valid_correlations.sum(axis=1)
 
+    # Calculate diversification benefit
+    diversification = 1 - avg_correlation
+    return risks, mean_returns, diversification
+
+def return_moments(prices):
+    """Mean daily returns and a factor matrix of their covariance, for the weight optimiser.
+    The factors are the deviations of each symbol's returns from its mean, zero on days without a return, scaled so
+    factors.T @ factors has each symbol's variance on its diagonal. Unlike a pairwise covariance this is always
+    positive semidefinite. Symbols without returns get a zero mean and zero factors.
+    :param array prices: days x symbols closes, NaN where a symbol has no bar
+    :return array mean_returns, array factors: mean per symbol column, and return days x symbols factors
+    """
+    returns = prices[1:] / prices[:-1] - 1
+    valid = ~np.isnan(returns)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_returns = np.where(counts > 0, np.where(valid, returns, 0).sum(axis=0) / counts, 0.0)
+        factors = np.where(valid, returns - mean_returns, 0) / np.sqrt(np.maximum(counts, 1))
+    return mean_returns, factors
 
+def calculate_factors(historical_data, portfolio):
+    """Calculate sharpe-related performance factors for each asset.
+    :param array historical_data: 30-day data for securities, a History frame or a days x symbols frame of closes
+    :param dict portfolio: list of securities and their respective weights
+    :return Series risks, Series mean_returns, Series diversification: factors indexed by symbol
+    """
+    symbols = list(portfolio)
+    risks, mean_returns, diversification = price_factors(closes_matrix(historical_data, symbols))
+    return pd.Series(risks, index=symbols), pd.Series(mean_returns, index=symbols), pd.Series(diversification, index=symbols)
@@ -0,0 +1,170 @@
+import io
+
+import numpy as np
+
+# Bump when the artifact layout changes
+ARTIFACT_VERSION = 2
+
+class RegimeScorer:
+    """Fitted regime model reduced to the arrays needed to label new months, scored with numpy alone.
+    Follows the operation order of sklearn's full covariance mixture models, so labels match model.predict exactly.
+    Other covariance types are stored as full matrices and agree with model.predict up to rounding.
+    """
+    def __init__(self, weights, log_weights, means, precisions_cholesky, log_det, log_dof, correction, feature_mean=None, feature_scale=None):
+        """
+        :param array weights: mixing weight of each component, for reference
+        :param array log_weights: expected log mixing weight of each component
+        :param array means: components x features means
+        :param array precisions_cholesky: components x features x features Cholesky factors of the precision matrices
+        :param array log_det: log determinant of each Cholesky factor
+        :param array log_dof: Wishart degrees of freedom term of each component, zero for GaussianMixture
+        :param array correction: variational log lambda term of each component, zero for GaussianMixture
+        :param array feature_mean: subtracted from the features before scoring when the model was fitted on scaled data
+        :param array feature_scale: features are divided by this after subtracting feature_mean
+        """
+        self.weights = np.asarray(weights, dtype=float)
+        self.log_weights = np.asarray(log_weights, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.precisions_cholesky = np.asarray(precisions_cholesky, dtype=float)
+        self.log_det = np.asarray(log_det, dtype=float)
+        self.log_dof = np.asarray(log_dof, dtype=float)
+        self.correction = np.asarray(correction, dtype=float)
+        n_features = self.means.shape[1]
+        self.feature_mean = np.zeros(n_features) if feature_mean is None else np.asarray(feature_mean, dtype=float)
+        self.feature_scale = np.ones(n_features) if feature_scale is None else np.asarray(feature_scale, dtype=float)
+        # mu @ L does not depend on the data, so it is worked out once
+        self.shifts = np.array([mean @ cholesky for mean, cholesky in zip(self.means, self.precisions_cholesky)]).reshape(self.means.shape)
+
+    @property
+    def n_components(self):
+        return len(self.means)
+
+    @classmethod
+    def from_model(cls, model, feature_mean=None, feature_scale=None):
+        """Build a scorer from a fitted sklearn GaussianMixture or BayesianGaussianMixture.
+        :param model: fitted mixture model
+        :param array feature_mean: mean removed from the training data before fitting, if it was standardised
+        :param array feature_scale: scale the training data was divided by before fitting, if it was standardised
+        """
+        # scipy is already loaded whenever sklearn is, so this costs nothing extra when training
+        from scipy.special import digamma
+        n_components, n_features = model.means_.shape
+        precisions_cholesky = full_cholesky(model.precisions_cholesky_, model.covariance_type, n_components, n_features)
+        log_det = np.sum(np.log(precisions_cholesky.reshape(n_components, -1)[:, ::n_features + 1]), axis=1)
+
+        if hasattr(model, "weight_concentration_"):
+            if model.weight_concentration_prior_type == "dirichlet_process":
+                digamma_sum = digamma(model.weight_concentration_[0] + model.weight_concentration_[1])
+                digamma_a = digamma(model.weight_concentration_[0])
+                digamma_b = digamma(model.weight_concentration_[1])
+                log_weights = digamma_a - digamma_sum + np.hstack((0, np.cumsum(digamma_b - digamma_sum)[:-1]))
+            else:
+                log_weights = digamma(model.weight_concentration_) - digamma(np.sum(model.weight_concentration_))
+            log_dof = 0.5 * n_features * np.log(model.degrees_of_freedom_)
+            log_lambda = n_features * np.log(2.0) + np.sum(digamma(0.5 * (model.degrees_of_freedom_ - np.arange(0, n_features)[:, np.newaxis])), 0)
+            correction = 0.5 * (log_lambda - n_features / model.mean_precision_)
+        else:
+            log_weights = np.log(model.weights_)
+            log_dof = np.zeros(n_components)
+            correction = np.zeros(n_components)
+        return cls(model.weights_, log_weights, model.means_, precisions_cholesky, log_det, log_dof, correction, feature_mean, feature_scale)
+
+    def feature_means(self):
+        """Component means in the units of the features, rather than of the scaled data the model was fitted on."""
+        return self.means * self.feature_scale + self.feature_mean
+
+    def scale_features(self, data):
+        """Features as the model was fitted on them, unchanged unless it was fitted on standardised data."""
+        return (np.asarray(data, dtype=float) - self.feature_mean) / self.feature_scale
+
+    def weighted_log_prob(self, data):
+        """Unnormalised log probability of each regime.
+        :param array data: months x features, or a single month as a 1D array
+        :return array: months x components
+        """
+        data = np.atleast_2d(self.scale_features(data))
+        n_features = data.shape[1]
+        log_prob = np.empty((len(data), self.n_components))
+        for k in range(self.n_components):
+            y = (data @ self.precisions_cholesky[k]) - self.shifts[k]
+            log_prob[:, k] = np.sum(np.square(y), axis=1)
+        log_gauss = -0.5 * (n_features * np.log(2 * np.pi) + log_prob) + self.log_det
+        return (log_gauss - self.log_dof) + self.correction + self.log_weights
+
+    def predict_log_proba(self, data):
+        """Log posterior probability of each regime, normalised per month."""
+        weighted = self.weighted_log_prob(data)
+        peak = weighted.max(axis=1, keepdims=True)
+        return weighted - (peak + np.log(np.sum(np.exp(weighted - peak), axis=1, keepdims=True)))
+
+    def predict(self, data):
+        """Regime label of each month, the same labels as model.predict."""
+        return np.argmax(self.weighted_log_prob(data), axis=1)
+
+    def permuted(self, order):
+        """Scorer with components reordered, label i of the result is component order[i] of this scorer."""
+        order = np.asarray(order)
+        return RegimeScorer(self.weights[order], self.log_weights[order], self.means[order], self.precisions_cholesky[order],
+                            self.log_det[order], self.log_dof[order], self.correction[order], self.feature_mean, self.feature_scale)
+
+    def to_arrays(self, prefix=""):
+        """Arrays that from_arrays rebuilds the scorer from, with names starting with prefix."""
+        return {
+            prefix + "weights": self.weights,
+            prefix + "log_weights": self.log_weights,
+            prefix + "means": self.means,
+            prefix + "precisions_cholesky": self.precisions_cholesky,
+            prefix + "log_det": self.log_det,
+            prefix + "log_dof": self.log_dof,
+            prefix + "correction": self.correction,
+            prefix + "feature_mean": self.feature_mean,
+            prefix + "feature_scale": self.feature_scale,
+            prefix + "version": np.array(ARTIFACT_VERSION),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        """Inverse of to_arrays, None if the arrays are from another artifact version."""
+        if int(arrays[prefix + "version"]) != ARTIFACT_VERSION:
+            return None
+        return cls(*(arrays[prefix + name] for name in ("weights", "log_weights", "means", "precisions_cholesky", "log_det", "log_dof", "correction", "feature_mean", "feature_scale")))
+
+    def dumps(self):
+        """Serialise to npz bytes."""
+        buffer = io.BytesIO()
+        np.savez(buffer, **self.to_arrays())
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        """Inverse of dumps."""
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls.from_arrays(arrays)
+
+def full_cholesky(precisions_cholesky, covariance_type, n_components, n_features):
+    """Precision Cholesky factors of any sklearn covariance type as components x features x features matrices."""
+    if covariance_type == "full":
+        return np.asarray(precisions_cholesky)
+    if covariance_type == "tied":
+        return np.broadcast_to(precisions_cholesky, (n_components, n_features, n_features)).copy()
+    if covariance_type == "diag":
+        return np.stack([np.diag(row) for row in precisions_cholesky])
+    if covariance_type == "spherical":
+        return np.asarray(precisions_cholesky)[:, np.newaxis, np.newaxis] * np.eye(n_features)
+    raise ValueError("Unknown covariance type {}".format(covariance_type))
+
+def align(reference, scorer, scale=None):
+    """Relabel scorer so each of its regimes takes the label of the nearest regime of reference.
+    Components are paired one to one by minimum total distance between means in feature units, so a refitted or
+    separately selected model keeps the meaning of market_condition even if only one of them scales its features.
+    :param RegimeScorer reference: scorer whose labels are kept
+    :param RegimeScorer scorer: scorer to relabel, with the same number of components
+    :param array scale: per feature scale the distances are measured in, e.g. the feature standard deviations
+    :return RegimeScorer, array: relabelled scorer and the order applied to it
+    """
+    # Only needed when retraining, where scipy is already loaded by sklearn
+    from scipy.optimize import linear_sum_assignment
+    scale = np.ones(reference.means.shape[1]) if scale is None else np.asarray(scale, dtype=float)
+    distances = np.linalg.norm((reference.feature_means()[:, np.newaxis, :] - scorer.feature_means()[np.newaxis, :, :]) / scale, axis=2)
+    _, order = linear_sum_assignment(distances)
+    return scorer.permuted(order), order
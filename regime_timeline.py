@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import features
+import strategies
+
+def month_starts(trading_days, start=None, end=None):
+    """First trading day of every month, the days Update runs on.
+    :param DatetimeIndex trading_days: trading days of the market, e.g. the SPY bar times
+    :param start: first day to include, defaults to the first trading day
+    :param end: last day to include, defaults to the last trading day
+    :return DatetimeIndex: first trading day of each month between start and end
+    """
+    days = pd.DatetimeIndex(trading_days).normalize().unique().sort_values()
+    firsts = days[np.r_[True, days.to_period("M")[1:] != days.to_period("M")[:-1]]] if len(days) else days
+    if start is not None:
+        firsts = firsts[firsts >= pd.Timestamp(start)]
+    if end is not None:
+        firsts = firsts[firsts <= pd.Timestamp(end)]
+    return firsts
+
+def forward_returns(closes, times):
+    """Return of every symbol from the last close before each time to the last close before the next time.
+    The last time runs to the final close. Symbols without a price at either end get a zero return, as if in cash.
+    :param DataFrame closes: days x symbols closes
+    :param DatetimeIndex times: decision times in order
+    :return array: times x symbols returns
+    """
+    filled = closes.ffill()
+    ends = np.searchsorted(filled.index.values, pd.DatetimeIndex(times).values, side="left") - 1
+    values = filled.to_numpy(dtype=float)
+    entry = np.where(ends[:, np.newaxis] >= 0, values[np.maximum(ends, 0)], np.nan)
+    exit = np.vstack([entry[1:], values[-1:]]) if len(entry) else entry
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = exit / entry - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+def strategy_weights(closes, times, universe, length=30):
+    """Weights of every registered strategy at each time, from the closes Update would pass it.
+    :param DataFrame closes: days x symbols closes in universe order
+    :param DatetimeIndex times: decision times
+    :param Universe universe: symbols the strategies allocate to
+    :param int length: days of closes passed to each strategy
+    :return list[str] names, array weights: strategy names, and strategies x times x symbols weights
+    """
+    functions = list(dict.fromkeys(strategies.STRATEGIES[condition] for condition in sorted(strategies.STRATEGIES)))
+    windows = np.stack([features.trailing_windows(closes[symbol], times, length) for symbol in closes.columns], axis=2)
+    weights = np.zeros((len(functions), len(windows), closes.shape[1]))
+    for k, prices in enumerate(windows):
+        for s, function in enumerate(functions):
+            weights[s, k] = function(prices, universe)
+    return [function.__name__ for function in functions], weights
+
+def timeline(model, spy_close, vix_close, interest, closes, universe, risk_free_rate, start=None, end=None, length=30):
+    """Regime PredictModel would pick at every month start, and how each strategy did over the following month.
+    Features for every month come from one vectorized pass and are scored with one model call. Every strategy's
+    allocation is evaluated against the next month's returns in one matrix product, so the chosen strategy's
+    return can be compared with what the others would have made.
+    :param RegimeScorer model: regime model, anything with predict
+    :param Series spy_close: daily SPY closes
+    :param Series vix_close: daily VIX closes
+    :param Series interest: daily 30-day AA commercial paper rate
+    :param DataFrame closes: days x symbols closes of the universe, in universe order
+    :param Universe universe: symbols the strategies allocate to
+    :param float risk_free_rate: risk free rate used for the sharpe feature
+    :param start: first month start to include
+    :param end: last month start to include
+    :param int length: days of history per prediction, as requested from History
+    :return DataFrame: one row per month start with the features, the regime, the chosen strategy, its return and every strategy's return
+    """
+    times = month_starts(spy_close.dropna().index, start, end)
+    feature_matrix = features.batch_window_features(spy_close, vix_close, interest, risk_free_rate, times, length)
+    complete = ~feature_matrix.isna().any(axis=1).to_numpy()
+    labels = np.full(len(times), -1)
+    if complete.any():
+        labels[complete] = model.predict(feature_matrix.to_numpy()[complete])
+
+    names, weights = strategy_weights(closes, times, universe, length)
+    strategy_returns = np.einsum("skn,kn->ks", weights, forward_returns(closes, times))
+    chosen = np.array([names.index(strategies.strategy_for(label).__name__) for label in labels])
+
+    result = feature_matrix.copy()
+    result["regime"] = labels
+    result["strategy"] = [names[s] for s in chosen]
+    result["return"] = np.where(complete, strategy_returns[np.arange(len(times)), chosen], np.nan)
+    for s, name in enumerate(names):
+        result[name] = strategy_returns[:, s]
+    return result
+
+def attribution(months, strategy_names=None):
+    """Profit and loss of the regime timeline by regime.
+    :param DataFrame months: output of timeline
+    :param list[str] strategy_names: strategy return columns to compare, defaults to every registered strategy
+    :return DataFrame: per regime the number of months, the chosen strategy's mean, compounded and share of total
+    log return, its hit rate, and the mean monthly return every strategy would have had in those months
+    """
+    if strategy_names is None:
+        strategy_names = [name for name in dict.fromkeys(function.__name__ for function in strategies.STRATEGIES.values()) if name in months]
+    months = months[months["regime"] >= 0]
+    log_returns = np.log1p(months["return"])
+    grouped = months.groupby("regime")
+    table = pd.DataFrame({
+        "strategy": grouped["strategy"].first(),
+        "months": grouped.size(),
+        "mean_return": grouped["return"].mean(),
+        "total_return": np.expm1(log_returns.groupby(months["regime"]).sum()),
+        "share_of_log_return": log_returns.groupby(months["regime"]).sum() / log_returns.sum() if log_returns.sum() != 0 else np.nan,
+        "hit_rate": grouped["return"].apply(lambda returns: float(np.mean(returns > 0))),
+    })
+    for name in strategy_names:
+        table["mean_" + name] = grouped[name].mean()
+    return table
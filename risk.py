@@ -0,0 +1,171 @@
+import numpy as np
+
+class RiskMonitor:
+    """Per-symbol trailing stops, portfolio drawdown from a high-water mark and per-symbol exposure limits, updated one bar at a time.
+    Positions and cash are tracked from fills and the portfolio value is kept as a running sum, so each price update and
+    each fill is a constant amount of work whatever the size of the universe. Only a drawdown breach looks at every
+    open position, to find the ones that lost money since the high-water mark.
+    Breaches are collected as target weights for the affected symbols only, read and cleared with pop_targets.
+    """
+    def __init__(self, symbols, cash, trailing_stop=0.1, max_drawdown=0.05, max_exposure=1.0):
+        """
+        :param list symbols: symbols to monitor
+        :param float cash: starting cash, the initial portfolio value
+        :param float trailing_stop: close a position once its price moves this fraction against it from the best price since entry, 0 to switch off
+        :param float max_drawdown: close losing positions once portfolio value falls this fraction below its high-water mark, 0 to switch off
+        :param float max_exposure: largest absolute holding value of one symbol as a fraction of portfolio value, 0 to switch off
+        """
+        self.index = {symbol: i for i, symbol in enumerate(symbols)}
+        self.trailing_stop = trailing_stop
+        self.max_drawdown = max_drawdown
+        self.max_exposure = max_exposure
+        n = len(self.index)
+        self.quantity = np.zeros(n)
+        self.price = np.full(n, np.nan)
+        # Best price since the position was opened, highest for longs and lowest for shorts
+        self.extreme = np.full(n, np.nan)
+        # Price at the last high-water mark, filled in lazily the first time a symbol trades after the mark moves
+        self.mark_price = np.full(n, np.nan)
+        self.mark_epoch = np.full(n, -1, dtype=np.int64)
+        self.epoch = 0
+        self.cash = float(cash)
+        self.holdings_value = 0.0
+        self.high_water_mark = float(cash)
+        # Portfolio value the drawdown check fires below. It is the high-water mark until a breach, then the value at
+        # the breach, so losing positions are closed again only on a new low and the mark itself never moves down
+        self.trigger = float(cash)
+        self.open = set()
+        self.targets = {}
+        self.reasons = {}
+
+    @property
+    def portfolio_value(self):
+        return self.cash + self.holdings_value
+
+    @property
+    def drawdown(self):
+        """Current fall of portfolio value below the high-water mark, as a fraction of the mark."""
+        return 1 - self.portfolio_value / self.high_water_mark if self.high_water_mark > 0 else 0.0
+
+    def _target(self, symbol, weight, reason):
+        # Closing wins over trimming when a symbol breaches more than one limit
+        if symbol not in self.targets or weight == 0:
+            self.targets[symbol] = weight
+            self.reasons[symbol] = reason
+
+    def update(self, symbol, price):
+        """Feed the latest price of one symbol and check its trailing stop and exposure."""
+        i = self.index[symbol]
+        previous = self.price[i]
+        if self.mark_epoch[i] != self.epoch:
+            # The symbol has not traded since the mark moved, so its last price is its price at the mark.
+            # A symbol first priced after the mark is measured from that first price
+            self.mark_price[i] = previous if not np.isnan(previous) else price
+            self.mark_epoch[i] = self.epoch
+        self.price[i] = price
+        quantity = self.quantity[i]
+        if quantity == 0:
+            return
+        self.holdings_value += quantity * (price - (previous if not np.isnan(previous) else price))
+
+        direction = 1.0 if quantity > 0 else -1.0
+        if direction * (price - self.extreme[i]) > 0:
+            self.extreme[i] = price
+        elif self.trailing_stop and direction * (price / self.extreme[i] - 1) <= -self.trailing_stop:
+            self._target(symbol, 0.0, "trailing stop")
+            return
+        if self.max_exposure:
+            value = self.portfolio_value
+            if value > 0 and abs(quantity * price) / value > self.max_exposure:
+                self._target(symbol, direction * self.max_exposure, "exposure")
+
+    def end_bar(self):
+        """Check the portfolio drawdown once every symbol's price for the bar has been fed in."""
+        value = self.portfolio_value
+        if value > self.high_water_mark:
+            self.high_water_mark = value
+            self.trigger = value
+            self.epoch += 1
+            return
+        if not self.max_drawdown or self.drawdown < self.max_drawdown or value >= self.trigger:
+            return
+        for symbol in self.open:
+            i = self.index[symbol]
+            mark = self.mark_price[i] if self.mark_epoch[i] == self.epoch else self.price[i]
+            if self.quantity[i] * (self.price[i] - mark) < 0:
+                self._target(symbol, 0.0, "drawdown")
+        # Re-arm below this bar's value, rather than closing positions again on every bar of the same drawdown
+        self.trigger = value
+
+    def on_fill(self, symbol, quantity, price, cash):
+        """Record a fill.
+        :param symbol: filled symbol
+        :param float quantity: signed fill quantity
+        :param float price: fill price
+        :param float cash: portfolio cash after the fill, including fees
+        """
+        i = self.index.get(symbol)
+        self.cash = float(cash)
+        if i is None or quantity == 0:
+            return
+        if np.isnan(self.price[i]):
+            self.price[i] = price
+        before = self.quantity[i]
+        after = before + quantity
+        self.holdings_value += quantity * self.price[i]
+        self.quantity[i] = after
+        if after == 0:
+            self.extreme[i] = np.nan
+            self.open.discard(symbol)
+        elif before == 0 or np.sign(before) != np.sign(after):
+            # New position, or flipped from long to short, trails from the fill price
+            self.extreme[i] = price
+            self.open.add(symbol)
+
+    def to_arrays(self, prefix=""):
+        """Arrays restore reloads the monitor from, with names starting with prefix."""
+        return {
+            prefix + "symbols": np.array(list(map(str, self.index)), dtype=str),
+            prefix + "quantity": self.quantity,
+            prefix + "price": self.price,
+            prefix + "extreme": self.extreme,
+            prefix + "mark_price": self.mark_price,
+            prefix + "mark_epoch": self.mark_epoch,
+            prefix + "state": np.array([self.epoch, self.cash, self.holdings_value, self.high_water_mark, self.trigger]),
+        }
+
+    def restore(self, arrays, prefix=""):
+        """Load state saved by to_arrays, False and unchanged if it was saved for other symbols."""
+        if arrays[prefix + "symbols"].tolist() != list(map(str, self.index)):
+            return False
+        for name in ("quantity", "price", "extreme", "mark_price", "mark_epoch"):
+            setattr(self, name, arrays[prefix + name].copy())
+        epoch, self.cash, self.holdings_value, self.high_water_mark, self.trigger = arrays[prefix + "state"].tolist()
+        self.epoch = int(epoch)
+        self.open = {symbol for symbol, i in self.index.items() if self.quantity[i] != 0}
+        return True
+
+    def sync(self, quantities, cash):
+        """Replace the tracked positions and cash with the actual ones, e.g. after a restart.
+        Positions that are new or changed side start trailing from the last price, the others keep their best price.
+        :param dict quantities: held quantity per symbol, symbols left out are flat
+        :param float cash: portfolio cash
+        """
+        quantity = np.zeros(len(self.index))
+        for symbol, held in quantities.items():
+            if symbol in self.index:
+                quantity[self.index[symbol]] = held
+        changed = np.sign(quantity) != np.sign(self.quantity)
+        self.extreme = np.where(quantity == 0, np.nan, np.where(changed, self.price, self.extreme))
+        self.quantity = quantity
+        self.cash = float(cash)
+        self.holdings_value = float(np.sum(np.where(quantity != 0, quantity * np.nan_to_num(self.price), 0)))
+        self.open = {symbol for symbol, i in self.index.items() if quantity[i] != 0}
+
+    def pop_targets(self):
+        """Target weights of the symbols that breached a limit since the last call, and why.
+        :return dict[str, float] targets, dict[str, str] reasons: target weight and breached limit per symbol
+        """
+        targets, reasons = self.targets, self.reasons
+        self.targets, self.reasons = {}, {}
+        return targets, reasons
@@ -3,77 +3,122 @@ from AlgorithmImports import *
 #endregion
 import numpy as np
 
-def crisis_strategy(historical_data, securities):
+# Regime strategies by market_condition, filled in by the register decorator
+STRATEGIES = {}
+
+# Number of top momentum symbols held in steady state markets
+TOP_K = 3
+
+class Universe:
+    """Symbols available to the strategies, each tagged with an asset class.
+    Strategies allocate to asset classes, and a class weight is split evenly across its symbols,
+    so the same strategy runs on 5 or 500 symbols.
+    """
+    def __init__(self, symbols, asset_classes):
+        """
+        :param list[str] symbols: symbols, in the column order of the price matrices passed to strategies
+        :param list[str] asset_classes: asset class of each symbol, e.g. market, tech, gold, bonds, treasuries
+        """
+        self.symbols = list(symbols)
+        self.asset_classes = np.asarray(asset_classes)
+        self.classes, self.codes = np.unique(self.asset_classes, return_inverse=True)
+        self.class_sizes = np.bincount(self.codes, minlength=len(self.classes))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def mask(self, asset_class):
+        """Boolean vector selecting the symbols of one asset class."""
+        return self.asset_classes == asset_class
+
+    def allocate(self, class_weights):
+        """Weight vector giving each asset class its weight, split evenly across the class's symbols.
+        :param dict[str, float] class_weights: total weight per asset class, classes not in the universe are ignored
+        :return array weights: weight per symbol
+        """
+        weights_by_class = np.zeros(len(self.classes))
+        for asset_class, weight in class_weights.items():
+            position = np.searchsorted(self.classes, asset_class)
+            if position < len(self.classes) and self.classes[position] == asset_class:
+                weights_by_class[position] = weight
+        return weights_by_class[self.codes] / self.class_sizes[self.codes]
+
+    def to_portfolio(self, weights):
+        """Convert a weight vector to a symbol to weight dict, leaving out zero weights."""
+        return {self.symbols[i]: float(weights[i]) for i in np.flatnonzero(weights)}
+
+def register(*market_conditions):
+    """Register a strategy for one or more market conditions."""
+    def decorator(strategy):
+        for market_condition in market_conditions:
+            STRATEGIES[market_condition] = strategy
+        return strategy
+    return decorator
+
+def strategy_for(market_condition):
+    """Strategy for a market condition, walking on ice for any condition without its own strategy."""
+    return STRATEGIES.get(market_condition, woi_strategy)
+
+def momentum(prices, days=14):
+    """Mean daily return of each symbol over the last days.
+    :param array prices: days x symbols closing prices, NaN where a symbol has no bar
+    :return array: momentum per symbol, NaN where a symbol has no returns
+    """
+    returns = prices[1:] / prices[:-1] - 1
+    recent = returns[-days:]
+    counts = np.sum(~np.isnan(recent), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, np.nansum(recent, axis=0) / counts, np.nan)
+
+def top_k(values, k):
+    """Boolean mask of the k largest values, ignoring NaN."""
+    mask = np.zeros(len(values), dtype=bool)
+    values = np.where(np.isnan(values), -np.inf, values)
+    k = min(k, int(np.sum(np.isfinite(values))))
+    if k > 0:
+        mask[np.argpartition(-values, k - 1)[:k]] = True
+    return mask
+
+@register(1)
+def crisis_strategy(prices, universe):
     """Execute trading strategy for crisis market condition.
     Short equities, small allocation to bonds and gold as we go risk off. Called on market_condition.
-    :param array historical_data: 30-day data for securities
-    :param array securities: list of securities that we own
-    :return dict[str, float] updated_portfolio
+    :param array prices: 30-day closing prices, days x symbols in universe order
+    :param Universe universe: symbols that we can trade
+    :return array weights: weight per symbol
     """
-    updated_portfolio = {}
-
     # Set initial weights for rebalancing
-    updated_portfolio["SPY"] = -0.2
-    updated_portfolio["XAGUSD"] = 0.2
-    updated_portfolio["UST"] = 0.2
+    return universe.allocate({"market": -0.2, "gold": 0.2, "treasuries": 0.2})
 
-    return updated_portfolio
-
-def steady_state_strategy(historical_data, securities):
+@register(0)
+def steady_state_strategy(prices, universe):
     """Execute trading strategy for steady state market condition.
     Follow the market, biased towards tech equities.
-    :return dict[str, float] updated_portfolio
+    :return array weights: weight per symbol
     """
-    updated_portfolio = {}
-    momentum_comparison = {}
-
-    # Calculate momentum for each security
-    for symbol in securities:
-        if symbol in historical_data:
-            prices = historical_data.loc[symbol]['close'].resample('d').last()
-            returns = np.diff(prices) / prices[:-1]
-            # Calculate the momentum over the last 2 weeks
-            momentum_comparison[symbol] == returns[-14:].mean()
-
-    # Put three symbols with greatest momentum into list
-    basket = sorted(momentum_comparison, key=momentum_comparison.get, reverse=True)[:3]
-
-    # Bias portfolio towards tech equities
-    if "TQQQ" not in basket:
-        basket.append("TQQQ")
-    if "SPY" not in basket:
-        basket.append("SPY")
-    # Even out weights
-    for symbol in basket:
-        updated_portfolio[symbol] = 1/len(basket)
+    # Symbols with greatest momentum over the last 2 weeks
+    basket = top_k(momentum(prices, 14), TOP_K)
 
-    return updated_portfolio
+    # Bias portfolio towards tech equities and the market
+    basket |= universe.mask("tech") | universe.mask("market")
 
-def inflation_strategy(historical_data, securities):
+    # Even out weights
+    if not basket.any():
+        return np.zeros(len(universe))
+    return basket / basket.sum()
+
+@register(3)
+def inflation_strategy(prices, universe):
     """Execute trading strategy for inflation market condition.
     Buy Gold as an inflation hedge, and invest in equities and bonds.
-    :return dict[str, float] updated_portfolio
+    :return array weights: weight per symbol
     """
-    updated_portfolio = {}
-
-    updated_portfolio["TQQQ"] = 0.2
-    updated_portfolio["SPY"] = 0.5
-    updated_portfolio["XAGUSD"] = 0.1
-    updated_portfolio["UBT"] = 0.1
-    updated_portfolio["UST"] = 0.1
-
-    return updated_portfolio
+    return universe.allocate({"tech": 0.2, "market": 0.5, "gold": 0.1, "bonds": 0.1, "treasuries": 0.1})
 
-# Execute trading strategy for Walking on Ice market condition
-def woi_strategy(historical_data, securities):
-    """# Execute trading strategy for Walking on Ice market condition.
+@register(2)
+def woi_strategy(prices, universe):
+    """Execute trading strategy for Walking on Ice market condition.
     High volatility and uncertainty, so we go risk off with a bias towards bonds.
-    :return dict[str, float] updated_portfolio
+    :return array weights: weight per symbol
     """
-    updated_portfolio = {}
-
-    updated_portfolio["UBT"] = 0.33
-    updated_portfolio["UST"] = 0.33
-    updated_portfolio["TQQQ"] = -0.1
-
-    return updated_portfolio
+    return universe.allocate({"bonds": 0.33, "treasuries": 0.33, "tech": -0.1})
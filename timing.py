@@ -0,0 +1,129 @@
+import bisect
+import time
+from contextlib import nullcontext
+
+# Upper edges of the wall time histogram buckets in seconds, 4 per decade from 1 microsecond to 100 seconds.
+# Slower calls land in one overflow bucket
+BUCKETS = [10 ** (exponent / 4) for exponent in range(-24, 9)]
+
+class Timer:
+    """Call count, total and maximum wall time, rows returned and a fixed size wall time histogram for one name."""
+    __slots__ = ("calls", "total", "max", "rows", "counts")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds, rows=0):
+        self.calls += 1
+        self.total += seconds
+        self.rows += rows
+        if seconds > self.max:
+            self.max = seconds
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the q-th percentile call, the maximum for the overflow bucket."""
+        if not self.calls:
+            return 0.0
+        rank = q / 100 * self.calls
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "total": self.total,
+            "mean": self.total / self.calls if self.calls else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "rows": self.rows,
+            "histogram": {"edges": BUCKETS, "counts": self.counts},
+        }
+
+class _Measure:
+    """Context manager timing one block into a Timer."""
+    __slots__ = ("timer", "clock", "started")
+
+    def __init__(self, timer, clock):
+        self.timer = timer
+        self.clock = clock
+
+    def __enter__(self):
+        self.started = self.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.record(self.clock() - self.started)
+        return False
+
+class Profiler:
+    """Wall time of named methods and blocks, see timing.NullProfiler for the disabled version."""
+    enabled = True
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.timers = {}
+
+    def timer(self, name):
+        if name not in self.timers:
+            self.timers[name] = Timer()
+        return self.timers[name]
+
+    def wrap(self, name, function, rows=False):
+        """Wrap a function so every call is timed under name.
+        :param str name: timer name
+        :param callable function: function or bound method to time
+        :param bool rows: also count the rows of the returned value, e.g. for History data frames
+        :return callable: timed function
+        """
+        timer = self.timer(name)
+        clock = self.clock
+        def timed(*args, **kwargs):
+            started = clock()
+            result = function(*args, **kwargs)
+            timer.record(clock() - started, len(result) if rows and hasattr(result, "__len__") else 0)
+            return result
+        timed.__wrapped__ = function
+        return timed
+
+    def measure(self, name):
+        """Context manager timing a block under name."""
+        return _Measure(self.timer(name), self.clock)
+
+    def summary(self):
+        """One line per timer, slowest total first."""
+        lines = ["{:<14} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}".format("name", "calls", "total s", "mean ms", "p50 ms", "p95 ms", "max ms", "rows")]
+        for name, timer in sorted(self.timers.items(), key=lambda item: -item[1].total):
+            stats = timer.to_dict()
+            lines.append("{:<14} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>9}".format(
+                name, stats["calls"], stats["total"], stats["mean"] * 1e3, stats["p50"] * 1e3, stats["p95"] * 1e3, stats["max"] * 1e3, stats["rows"]))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {name: timer.to_dict() for name, timer in self.timers.items()}
+
+class NullProfiler:
+    """Stand in for Profiler when timing is switched off. wrap returns the function itself, so wrapped calls cost nothing."""
+    enabled = False
+    _null = nullcontext()
+
+    def wrap(self, name, function, rows=False):
+        return function
+
+    def measure(self, name):
+        return self._null
+
+    def summary(self):
+        return ""
+
+    def to_dict(self):
+        return {}
@@ -1,97 +1,82 @@
-import numpy as np
 import itertools
-from scipy import linalg
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-
-means = np.array([[-0.04193198,1.11485344,22.53207206,-0.08767917,0.23441203,3.22835194],[-0.11536963,1.60988842,31.13567036,-0.055891,0.12901063,3.04363133],[0.11299296,1.54344841,27.29784195,0.06019754,0.09676839,3.9023696,],[0.18788007,1.44682264,25.4480972,0.09091709,1.88950034,4.72486333]])
-
-cov0 = np.array([[1.83791745e-02,-4.17533457e-05,4.31252886e-02,1.53180272e-02,1.79897652e-02,-3.82045193e-02],[-4.17533457e-05,3.42521995e-02,1.92525116e-01,3.33387781e-03,2.36566065e-02,1.59020937e-02],[4.31252886e-02,1.92525116e-01,3.46683724e+00,7.27749443e-02,-1.75223309e-01,1.26626816e-01],[1.53180272e-02,3.33387781e-03,7.27749443e-02,1.41577817e-02,1.50638645e-02,-4.12333447e-02],[1.79897652e-02,2.36566065e-02,-1.75223309e-01,1.50638645e-02,1.96835879e-01,-1.01209421e-01],[-3.82045193e-02,1.59020937e-02,1.26626816e-01,-4.12333447e-02,-1.01209421e-01,6.19909298e-01]])
-
-cov1 = np.array([[5.28672473e-02,-5.93058725e-02,-2.66495058e-01,2.78770099e-02,1.99280947e-02,-1.67176833e-02],[-5.93058725e-02,1.04229593e-01,5.98204650e-01,-2.83650476e-02,-7.04457119e-03,5.01087584e-02],[-2.66495058e-01,5.98204650e-01,8.65902471e+00,-8.10645489e-02,-3.56901361e-01,-3.97971091e-01],[2.78770099e-02,-2.83650476e-02,-8.10645489e-02,1.56402534e-02,1.03962277e-02,-1.53444878e-02],[1.99280947e-02,-7.04457119e-03,-3.56901361e-01,1.03962277e-02,1.40646384e-01,8.94053089e-02],[-1.67176833e-02,5.01087584e-02,-3.97971091e-01,-1.53444878e-02,8.94053089e-02,2.95198661e-01]])
-
-cov2 = np.array([[6.02348349e-02,-9.86748943e-03,-2.78588256e-02,3.44697655e-02,7.89222264e-03,-5.05464547e-02],[-9.86748943e-03,1.04816669e-01,3.30098022e-01,-1.33773837e-02,-3.40435931e-03,2.51987139e-01],[-2.78588256e-02,3.30098022e-01,3.04080826e+00,-1.50912327e-03,-1.52185221e-01,4.56069308e-01],[3.44697655e-02,-1.33773837e-02,-1.50912327e-03,2.16572723e-02,4.24825013e-03,-5.58765740e-02],[7.89222264e-03,-3.40435931e-03,-1.52185221e-01,4.24825013e-03,1.26409787e-01,4.25383383e-02],[-5.05464547e-02,2.51987139e-01,4.56069308e-01,-5.58765740e-02,4.25383383e-02,8.32573255e-01]])
-
-cov3 = np.array([[2.33486370e-02,1.63393056e-04,-3.60046458e-02,1.45586485e-02,9.13635344e-02,6.15897870e-02],[1.63393056e-04,3.25649452e-02,2.04282481e-01,1.70951778e-03,4.48130940e-02,6.82207127e-02],[-3.60046458e-02,2.04282481e-01,3.15735136e+00,7.36631563e-03,-2.16151226e-01,-6.08526178e-02],[1.45586485e-02,1.70951778e-03,7.36631563e-03,9.81194874e-03,5.86924208e-02,3.52841009e-02],[9.13635344e-02,4.48130940e-02,-2.16151226e-01,5.86924208e-02,7.91495055e-01,5.78903988e-01],[6.15897870e-02,6.82207127e-02,-6.08526178e-02,3.52841009e-02,5.78903988e-01,6.48033348e-01]])
-
-covariances = np.vstack((cov0,cov1,cov2,cov3))
-covs = np.stack((cov0,cov1,cov2,cov3), axis=0)
-# np.savetxt("meandata.csv", means, fmt='%f', delimiter=",")
-# np.savetxt("covdata.csv", covariances, fmt='%f', delimiter=",")
-
-color_iter = itertools.cycle(["navy", "cornflowerblue", "gold", "darkorange"])
-
-reduced_covs = np.array([[[9.01335046e-02,7.70115761e-03],[7.70115761e-03,6.87247192e-01]],[[4.50745675e-02,4.55744210e-01],[4.55744210e-01,2.05645373e+01]],[[5.09218247e-02,5.25518136e-02],[5.25518136e-02,3.94158813e+00]],[[5.07691597e-02,5.03554371e-02],[5.03554371e-02,3.93164443e+00]]])
 
-reduced_means = np.array([[-0.0251199,-0.03948504],[0.13621489,-1.8610608,],[0.01362694,-0.42629251],[0.01230244,-0.44204143]])
-
-for i in range(4):
-    print(linalg.eigh(covs[i]))
-
-# def plot_results(X, Y, means, covariances, index, title):
-#     splot = plt.subplot(5, 1, 1 + index)
-#     for i, (mean, covar, color) in enumerate(zip(means, covariances, color_iter)):
-#         v, w = linalg.eigh(covar)
-#         v = 2.0 * np.sqrt(2.0) * np.sqrt(v)
-#         u = w[0] / linalg.norm(w[0])
-#         # as the DP will not use every component it has access to
-#         # unless it needs it, we shouldn't plot the redundant
-#         # components.
-#         if not np.any(Y == i):
-#             continue
-#         plt.scatter(X[Y == i, 0], X[Y == i, 1], 0.8, color=color)
-
-#         # Plot an ellipse to show the Gaussian component
-#         angle = np.arctan(u[1] / u[0])
-#         angle = 180.0 * angle / np.pi  # convert to degrees
-#         ell = mpl.patches.Ellipse(mean, v[0], v[1], angle=180.0 + angle, color=color)
-#         ell.set_clip_box(splot.bbox)
-#         ell.set_alpha(0.5)
-#         splot.add_artist(ell)
-
-#     plt.xlim(-6.0, 4.0 * np.pi - 6.0)
-#     plt.ylim(-5.0, 5.0)
-#     plt.title(title)
-#     plt.xticks(())
-#     plt.yticks(())
-
-def plot_results(means, covariances, index, title):
-    splot = plt.subplot(1, 1, 1 + index)
-    for i, (mean, covar, color) in enumerate(zip(means, covariances, color_iter)):
-        v, w = linalg.eigh(covar)
-        v = 2.0 * np.sqrt(2.0) * np.sqrt(v)
-        u = w[0] / linalg.norm(w[0])
-        # Plot an ellipse to show the Gaussian component
-        angle = np.arctan(u[1] / u[0])
-        angle = 180.0 * angle / np.pi  # convert to degrees
-        ell = mpl.patches.Ellipse(mean, v[0], v[1], angle=180.0 + angle, color=color)
-        ell.set_clip_box(splot.bbox)
-        ell.set_alpha(0.5)
-        splot.add_artist(ell)
-    plt.xlabel("SPY returns")
-    plt.ylabel("SPY momentum")
-    plt.xlim(-5.0, 5)
-    plt.ylim(-9.0, 5.0)
-    plt.xticks()
-    plt.yticks()
-    plt.savefig(title+".png", dpi=300)
-    plt.show()
-
-def plot_samples(X, Y, n_components, index, title):
-    plt.subplot(5, 1, 4 + index)
-    for i, color in zip(range(n_components), color_iter):
-        # as the DP will not use every component it has access to
-        # unless it needs it, we shouldn't plot the redundant
-        # components.
-        if not np.any(Y == i):
+import numpy as np
+import matplotlib
+# Diagnostics are rendered to files, never shown, so no display is needed
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Ellipse
+
+COLORS = ["navy", "cornflowerblue", "gold", "darkorange"]
+# Components holding less of the mixing weight than this are left out, the Dirichlet prior leaves them unused
+MIN_WEIGHT = 0.01
+
+def component_covariances(scorer):
+    """Means and covariance matrices of every component, in the units of the features rather than of the scaled data.
+    The scorer keeps Cholesky factors of the precisions, so all components are inverted in one batched call.
+    :param RegimeScorer scorer: fitted regime model
+    :return array means, array covariances: components x features, and components x features x features
+    """
+    inverse = np.linalg.inv(scorer.precisions_cholesky)
+    # Precision is L L', so the covariance is L^-T L^-1
+    covariances = np.swapaxes(inverse, 1, 2) @ inverse
+    covariances = covariances * np.outer(scorer.feature_scale, scorer.feature_scale)
+    means = scorer.means * scorer.feature_scale + scorer.feature_mean
+    return means, covariances
+
+def feature_pairs(n_features):
+    """Every pair of feature indices, 15 pairs for 6 features."""
+    return list(itertools.combinations(range(n_features), 2))
+
+def ellipses(means, covariances, pairs):
+    """Ellipse of every component projected onto every feature pair, from one batched eigendecomposition.
+    Sized as in the sklearn mixture examples, 2 sqrt(2) standard deviations across each axis.
+    :param array means: components x features means
+    :param array covariances: components x features x features covariances
+    :param list[tuple[int, int]] pairs: feature index pairs
+    :return array centres, array sizes, array angles: pairs x components x 2 centres, pairs x components x 2 widths and
+        heights, and pairs x components angles in degrees
+    """
+    pairs = np.asarray(pairs)
+    centres = means[:, pairs].transpose(1, 0, 2)
+    # pairs x components x 2 x 2 blocks of the covariance matrices
+    blocks = covariances[:, pairs[:, :, np.newaxis], pairs[:, np.newaxis, :]].transpose(1, 0, 2, 3)
+    values, vectors = np.linalg.eigh(blocks)
+    sizes = 2.0 * np.sqrt(2.0) * np.sqrt(np.maximum(values[..., ::-1], 0))
+    # Width runs along the eigenvector of the largest eigenvalue, the last column
+    angles = np.degrees(np.arctan2(vectors[..., 1, 1], vectors[..., 0, 1]))
+    return centres, sizes, angles
+
+def plot_pair(path, names, samples, labels, centres, sizes, angles, weights, dpi=100):
+    """Draw the component ellipses and the labelled samples of one feature pair, and save the figure.
+    :param str path: image file to write
+    :param tuple[str, str] names: x and y feature names
+    :param array samples: months x 2 feature values
+    :param array labels: regime label of each month
+    :param array centres: components x 2 ellipse centres
+    :param array sizes: components x 2 ellipse widths and heights
+    :param array angles: ellipse angle of each component, in degrees
+    :param array weights: mixing weight of each component
+    :param int dpi: image resolution
+    :return str: path
+    """
+    # Fixed margins, a tight layout pass would cost as much as drawing the figure
+    figure = Figure(figsize=(6, 4.5))
+    figure.subplots_adjust(left=0.12, right=0.97, bottom=0.12, top=0.96)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    for i, (centre, size, angle, weight) in enumerate(zip(centres, sizes, angles, weights)):
+        # As the DP will not use every component it has access to unless it needs it, unused components are not plotted
+        if weight < MIN_WEIGHT:
             continue
-        plt.scatter(X[Y == i, 0], X[Y == i, 1], 0.8, color=color)
-
-    plt.xlim(-6.0, 4.0 * np.pi - 6.0)
-    plt.ylim(-5.0, 5.0)
-    plt.title(title)
-    plt.xticks(())
-    plt.yticks(())
-
-if __name__ == "__main__":
-    plot_results(reduced_means.tolist(), reduced_covs.tolist(), 0, "Clusters")
\ No newline at end of file
+        color = COLORS[i % len(COLORS)]
+        axes.add_patch(Ellipse(centre, size[0], size[1], angle=angle, color=color, alpha=0.3))
+        members = labels == i
+        axes.scatter(samples[members, 0], samples[members, 1], s=6, color=color, label="regime {} ({:.0%})".format(i, weight))
+    axes.set_xlabel(names[0])
+    axes.set_ylabel(names[1])
+    axes.legend(fontsize="small", loc="upper right")
+    axes.autoscale_view()
+    figure.savefig(path, dpi=dpi)
+    return path